@@ -1,23 +1,68 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file, has_request_context
 import os
+import atexit
 from openai import OpenAI
 import requests
 import base64
 import time
 import json
-from datetime import datetime, timedelta
 import hashlib
-import secrets
+import threading
 import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from contextlib import contextmanager
 from functools import wraps
+from cache import TTLCache
+from message_queue import MessageQueue, PostgresJobStore
+from conversation_store import ConversationStore
+from sessions import SessionStore
+from evolution_client import EvolutionClient
+from market_data import RatesCache, fetch_exchange_rates
+from intents import classify as classify_intent
+from prompts import build_messages, with_current_info
+from context_window import HistoryWindow
+from faq_cache import FAQCache
+from greetings import GreetingPool
+from llm_router import LLMRouter, Provider
+import metrics
+import logs
+from dedupe import DeliveryDeduper
+from coalescer import MessageCoalescer
+from media_store import MediaStore
+from media_pipeline import VisionImagePipeline
+from image_jobs import ImageJobManager, FINISHED as IMAGE_JOB_FINISHED
+from passwords import PasswordHasher, PasswordHasherBusy
+from auth_repository import AuthRepository, DatabaseUnavailable
 
 app = Flask(__name__)
 
+# Logs estructurados (JSON por línea, escritos desde un hilo aparte)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MAX_FIELD = int(os.environ.get('LOG_MAX_FIELD', 200))  # Caracteres máximos por campo
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))  # Fracción de eventos info/debug que se escriben
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')  # Por evento: "webhook.received=0.1,prodia.response=0.5"
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # Registros en espera antes de descartar
+
+logs.setup(
+    level=LOG_LEVEL,
+    max_field=LOG_MAX_FIELD,
+    sample_rates=logs.parse_sample_rates(LOG_SAMPLE_RATES),
+    default_rate=LOG_SAMPLE_RATE,
+    queue_size=LOG_QUEUE_SIZE
+)
+webhook_log = logs.get_logger('webhook')
+image_log = logs.get_logger('image')
+auth_log = logs.get_logger('auth')
+
 # Configuración de APIs
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 XAI_API_KEY = os.environ.get('XAI_API_KEY')  # API key de Grok (xAI)
 PRODIA_API_KEY = os.environ.get('PRODIA_API_KEY')  # API key de Prodia (sin censura)
+# URLs de los proveedores (se cambian para pruebas de carga locales, ver bench/loadtest.py;
+# la de OpenAI se toma de OPENAI_BASE_URL directamente en el SDK)
+XAI_BASE_URL = os.environ.get('XAI_BASE_URL', 'https://api.x.ai/v1')
+PRODIA_API_URL = os.environ.get('PRODIA_API_URL', 'https://inference.prodia.com/v2/job')
 
 # Cliente de OpenAI (para imágenes con GPT-4o)
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
@@ -25,17 +70,127 @@ openai_client = OpenAI(api_key=OPENAI_API_KEY)
 # Cliente de Grok (para texto con grok-4-fast-reasoning)
 grok_client = OpenAI(
     api_key=XAI_API_KEY,
-    base_url="https://api.x.ai/v1"
+    base_url=XAI_BASE_URL
 ) if XAI_API_KEY else None
 
+# Enrutamiento entre proveedores de LLM
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))  # Segundos por llamada
+LLM_HEDGE = os.environ.get('LLM_HEDGE', 'true').lower() == 'true'  # Enviar al segundo proveedor si el primero tarda más que su p95
+LLM_HEDGE_MIN_DELAY = float(os.environ.get('LLM_HEDGE_MIN_DELAY', 2))  # Nunca duplicar antes de N segundos
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', 5))  # Errores seguidos para abrir el circuito
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', 30))  # Segundos sin tráfico antes de reintentar
+LLM_WORKERS = int(os.environ.get('LLM_WORKERS', 16))  # Llamadas simultáneas por proceso
+
+grok_text_provider = Provider('grok', grok_client, 'grok-4-fast-reasoning',
+                              failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN)
+openai_gpt4o_provider = Provider('openai', openai_client, 'gpt-4o',
+                                 failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN)
+
+# Texto: Grok (93% más barato) primero y GPT-4o de respaldo
+text_router = LLMRouter(
+    [grok_text_provider, openai_gpt4o_provider],
+    hedge=LLM_HEDGE,
+    hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+    timeout=LLM_TIMEOUT,
+    workers=LLM_WORKERS,
+    observe=metrics.observe_llm
+)
+
+# Visión: solo GPT-4o (comparte estadísticas y circuito con el texto)
+vision_router = LLMRouter([openai_gpt4o_provider], hedge=False, timeout=LLM_TIMEOUT, workers=LLM_WORKERS,
+                          observe=metrics.observe_llm)
+
+# Mensaje cuando falla el modelo
+CHAT_ERROR_MESSAGE = "Lo siento, hubo un error procesando tu mensaje. Por favor intenta de nuevo."
+
 # Configuración de Evolution API
 EVOLUTION_API_URL = os.environ.get('EVOLUTION_API_URL')
 EVOLUTION_API_KEY = os.environ.get('EVOLUTION_API_KEY')
 INSTANCE_NAME = os.environ.get('INSTANCE_NAME', 'my-whatsapp')
+EVOLUTION_CONNECT_TIMEOUT = float(os.environ.get('EVOLUTION_CONNECT_TIMEOUT', 5))  # Segundos
+EVOLUTION_READ_TIMEOUT = float(os.environ.get('EVOLUTION_READ_TIMEOUT', 30))  # Segundos
+EVOLUTION_MAX_RETRIES = int(os.environ.get('EVOLUTION_MAX_RETRIES', 2))
+EVOLUTION_POOL_SIZE = int(os.environ.get('EVOLUTION_POOL_SIZE', 20))  # Conexiones keep-alive por proceso
+
+# Cliente compartido de Evolution API (conexiones reutilizadas entre hilos)
+evolution_client = EvolutionClient(
+    EVOLUTION_API_URL,
+    EVOLUTION_API_KEY,
+    INSTANCE_NAME,
+    connect_timeout=EVOLUTION_CONNECT_TIMEOUT,
+    read_timeout=EVOLUTION_READ_TIMEOUT,
+    max_retries=EVOLUTION_MAX_RETRIES,
+    pool_size=EVOLUTION_POOL_SIZE
+)
+
+# Cola del webhook (procesamiento en segundo plano)
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 500))
+WEBHOOK_QUEUE_DURABLE = os.environ.get('WEBHOOK_QUEUE_DURABLE', 'false').lower() == 'true'  # Persistir jobs en PostgreSQL
+CHAT_ADVISORY_LOCKS = os.environ.get('CHAT_ADVISORY_LOCKS', 'false').lower() == 'true'  # Orden por chat también entre workers de gunicorn
+CHAT_LOCK_TIMEOUT = float(os.environ.get('CHAT_LOCK_TIMEOUT', 60))  # Segundos esperando el lock de un chat antes de seguir sin él
+WEBHOOK_COALESCE_MS = int(os.environ.get('WEBHOOK_COALESCE_MS', 0))  # Ventana para juntar mensajes seguidos del mismo chat (0 = desactivado)
+WEBHOOK_COALESCE_MAX_MS = int(os.environ.get('WEBHOOK_COALESCE_MAX_MS', 6000))  # Espera máxima desde el primer mensaje del turno
+WEBHOOK_DEDUPE_WINDOW = int(os.environ.get('WEBHOOK_DEDUPE_WINDOW', 10000))  # Entregas recordadas en memoria por proceso
+WEBHOOK_DEDUPE_PERSIST = os.environ.get('WEBHOOK_DEDUPE_PERSIST', 'true').lower() == 'true'  # Compartir entre workers vía PostgreSQL
+
+# Generación de imágenes de la app en segundo plano
+IMAGE_JOB_WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS', 2))  # Generaciones simultáneas por proceso
+IMAGE_JOB_MAX_PENDING = int(os.environ.get('IMAGE_JOB_MAX_PENDING', 20))  # Jobs en cola o corriendo antes de responder 503
+IMAGE_JOB_RESULT_TTL = int(os.environ.get('IMAGE_JOB_RESULT_TTL', 3600))  # Segundos que se guarda el resultado
+IMAGE_JOB_MAX_WAIT = float(os.environ.get('IMAGE_JOB_MAX_WAIT', 25))  # Máximo long-poll de /api/jobs/<id>
+
+# Imágenes generadas: almacén local servido en /media/<hash> (compartido entre workers)
+MEDIA_DIR = os.environ.get('MEDIA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 512 * 1024 * 1024))  # Al pasarse se borran las menos usadas
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', '').rstrip('/')  # URL pública del servidor (para que Evolution descargue las imágenes)
+
+# Imágenes recibidas: presupuesto antes de enviarlas al modelo de visión (requiere Pillow)
+VISION_MAX_SIDE = int(os.environ.get('VISION_MAX_SIDE', 1024))  # Píxeles del lado más largo
+VISION_MAX_BYTES = int(os.environ.get('VISION_MAX_BYTES', 1024 * 1024))
+VISION_JPEG_QUALITY = int(os.environ.get('VISION_JPEG_QUALITY', 85))
+
+# Datos de mercado (tasas de cambio)
+EXCHANGE_RATES_REFRESH = float(os.environ.get('EXCHANGE_RATES_REFRESH', 3600))  # Segundos entre refrescos
 
 # Configuración de Base de Datos PostgreSQL
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Pool de conexiones (por proceso de gunicorn)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # Segundos esperando una conexión libre
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))  # Reciclar conexiones cada 30 min
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))  # Cerrar conexiones ociosas extra tras 5 min
+
+# Cache de validación de tokens (por proceso)
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 60))  # Segundos
+AUTH_CACHE_MAX_SIZE = int(os.environ.get('AUTH_CACHE_MAX_SIZE', 10000))
+
+# Hash de contraseñas (PBKDF2): costo y cupos compartidos por todos los workers del host
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 100000))  # Al subirlo, cada login rehace su hash
+PASSWORD_HASH_SLOTS = int(os.environ.get('PASSWORD_HASH_SLOTS', 1))  # Workers que pueden estar calculando un hash a la vez
+PASSWORD_HASH_MAX_WAIT = float(os.environ.get('PASSWORD_HASH_MAX_WAIT', 0.5))  # Segundos esperando un cupo antes de responder 503
+PASSWORD_HASH_LOCK_DIR = os.environ.get('PASSWORD_HASH_LOCK_DIR')  # Por defecto un directorio temporal del host
+
+# Sesiones en memoria (por proceso): historial reciente de cada chat activo
+SESSION_MAX_BYTES = int(os.environ.get('SESSION_MAX_BYTES', 64 * 1024 * 1024))  # Presupuesto total de memoria
+SESSION_IDLE_TTL = float(os.environ.get('SESSION_IDLE_TTL', 1800))  # Segundos de inactividad antes de olvidar un chat
+SESSION_COMPRESS_MIN = int(os.environ.get('SESSION_COMPRESS_MIN', 1024))  # Comprimir respuestas desde N bytes (0 = nunca)
+
+# Historial en el prompt: presupuesto de tokens (lo que no cabe se resume en segundo plano)
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 3000))
+HISTORY_MAX_MESSAGES = int(os.environ.get('HISTORY_MAX_MESSAGES', 40))  # Mensajes guardados por chat
+HISTORY_SUMMARY_TOKENS = int(os.environ.get('HISTORY_SUMMARY_TOKENS', 400))  # Largo máximo del resumen
+
+# Cache de respuestas a preguntas frecuentes (por proceso; FAQ_CACHE_MAX_SIZE=0 lo desactiva)
+FAQ_CACHE_TTL = float(os.environ.get('FAQ_CACHE_TTL', 6 * 3600))  # Segundos
+FAQ_CACHE_MAX_SIZE = int(os.environ.get('FAQ_CACHE_MAX_SIZE', 1000))
+
+# Saludos de bienvenida pre-generados (por proceso)
+GREETING_BATCH_SIZE = int(os.environ.get('GREETING_BATCH_SIZE', 10))  # Saludos por llamada al modelo
+GREETING_LOW_WATER = int(os.environ.get('GREETING_LOW_WATER', 5))  # Pedir otro lote al bajar de aquí
+
 # Google OAuth Config
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 
@@ -43,135 +198,184 @@ GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 # BASE DE DATOS Y AUTENTICACIÓN
 # ============================================
 
-def get_db_connection():
-    """Obtiene conexión a PostgreSQL"""
-    try:
-        conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
-        return conn
-    except Exception as e:
-        print(f"❌ Error conectando a DB: {e}")
-        return None
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Retorna el pool de conexiones del proceso (se crea en el primer uso)"""
+    global _db_pool
+    if _db_pool is None and DATABASE_URL:
+        with _db_pool_lock:
+            if _db_pool is None:
+                try:
+                    _db_pool = ConnectionPool(
+                        DATABASE_URL,
+                        min_size=DB_POOL_MIN_SIZE,
+                        max_size=DB_POOL_MAX_SIZE,
+                        timeout=DB_POOL_TIMEOUT,
+                        max_lifetime=DB_POOL_MAX_LIFETIME,
+                        max_idle=DB_POOL_MAX_IDLE,
+                        kwargs={"row_factory": dict_row},
+                        # Verificar que la conexión sigue viva antes de entregarla
+                        check=ConnectionPool.check_connection,
+                        name="navros-db",
+                        open=True
+                    )
+                    print(f"✅ Pool de DB creado (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+                except Exception as e:
+                    print(f"❌ Error creando pool de DB: {e}")
+                    return None
+    return _db_pool
 
-def init_db():
-    """Inicializa las tablas de usuarios si no existen"""
-    conn = get_db_connection()
+@contextmanager
+def get_db_connection():
+    """Obtiene una conexión del pool de PostgreSQL (se devuelve al pool al salir del with)"""
+    pool = get_db_pool()
+    conn = None
+    if pool:
+        try:
+            with metrics.timed('db_pool_wait'):
+                conn = pool.getconn(timeout=DB_POOL_TIMEOUT)
+        except Exception as e:
+            print(f"❌ Error conectando a DB: {e}")
+    
     if not conn:
-        return False
+        yield None
+        return
     
     try:
-        cur = conn.cursor()
-        
-        # Tabla de usuarios
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255),
-                name VARCHAR(255),
-                google_id VARCHAR(255) UNIQUE,
-                profile_picture TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE
-            )
-        ''')
-        
-        # Tabla de tokens de sesión
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS auth_tokens (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                token VARCHAR(255) UNIQUE NOT NULL,
-                device_info TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP NOT NULL,
-                is_valid BOOLEAN DEFAULT TRUE
-            )
-        ''')
-        
-        # Índices para mejor rendimiento
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_users_google_id ON users(google_id)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_tokens_token ON auth_tokens(token)')
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        print("✅ Base de datos inicializada correctamente")
-        return True
-    except Exception as e:
-        print(f"❌ Error inicializando DB: {e}")
-        return False
+        # Tiempo que el llamador tiene la conexión (sus consultas)
+        with metrics.timed('db'):
+            yield conn
+    finally:
+        # El pool descarta la conexión si quedó rota y hace rollback si quedó una transacción abierta
+        pool.putconn(conn)
+
+# Usuarios y tokens: cada flujo de autenticación es una transacción en una conexión
+auth_repository = AuthRepository(get_db_connection)
+
+# Como mucho PASSWORD_HASH_SLOTS workers calculan un hash a la vez: una ráfaga de logins
+# recibe 503 en vez de ocupar todos los workers sync (y el webhook sigue atendiéndose)
+password_hasher = PasswordHasher(
+    iterations=PASSWORD_HASH_ITERATIONS,
+    slots=PASSWORD_HASH_SLOTS,
+    max_wait=PASSWORD_HASH_MAX_WAIT,
+    lock_dir=PASSWORD_HASH_LOCK_DIR
+)
+
+AUTH_BUSY_MESSAGE = "Hay muchos inicios de sesión en este momento. Intenta de nuevo en unos segundos"
 
 def hash_password(password):
-    """Genera hash seguro de contraseña"""
-    salt = secrets.token_hex(16)
-    hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-    return f"{salt}${hash_obj.hex()}"
+    """Genera hash seguro de contraseña (puede lanzar PasswordHasherBusy)"""
+    return password_hasher.hash(password)
 
 def verify_password(password, password_hash):
-    """Verifica si la contraseña coincide con el hash"""
-    try:
-        salt, hash_value = password_hash.split('$')
-        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-        return hash_obj.hex() == hash_value
-    except:
-        return False
+    """Verifica la contraseña. Retorna (válida, hash_nuevo) (puede lanzar PasswordHasherBusy)"""
+    return password_hasher.verify(password, password_hash)
 
-def generate_token():
-    """Genera un token de autenticación seguro"""
-    return secrets.token_urlsafe(32)
+def auth_busy_response():
+    auth_log.warning('auth.hash_busy', stats=password_hasher.stats())
+    return jsonify({"error": AUTH_BUSY_MESSAGE}), 503, {"Retry-After": "5"}
 
-def create_auth_token(user_id, device_info=None, days_valid=30):
-    """Crea un nuevo token de autenticación"""
-    conn = get_db_connection()
-    if not conn:
-        return None
-    
-    try:
-        cur = conn.cursor()
-        token = generate_token()
-        expires_at = datetime.now() + timedelta(days=days_valid)
-        
-        cur.execute('''
-            INSERT INTO auth_tokens (user_id, token, device_info, expires_at)
-            VALUES (%s, %s, %s, %s)
-            RETURNING token
-        ''', (user_id, token, device_info, expires_at))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        return token
-    except Exception as e:
-        print(f"❌ Error creando token: {e}")
-        return None
+# Cache de tokens válidos: hash del token -> datos del usuario
+token_cache = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL)
+
+# Canal de PostgreSQL para avisar a los demás workers que deben limpiar su cache local
+CACHE_INVALIDATION_CHANNEL = 'navros_cache_invalidate'
+
+def token_cache_key(token):
+    """Clave del cache (nunca guardamos el token en claro)"""
+    return hashlib.sha256(token.encode()).hexdigest()
 
 def validate_token(token):
     """Valida un token y retorna el usuario si es válido"""
-    conn = get_db_connection()
-    if not conn:
-        return None
+    cache_key = token_cache_key(token)
+    cached_user = token_cache.get(cache_key)
+    if cached_user is not None:
+        return dict(cached_user)
     
+    # Si un logout o una desactivación invalida el cache mientras leemos la DB,
+    # el resultado puede ser anterior a la revocación y no se cachea
+    generation = token_cache.generation()
     try:
-        cur = conn.cursor()
-        cur.execute('''
-            SELECT u.id, u.email, u.name, u.profile_picture, u.google_id
-            FROM auth_tokens t
-            JOIN users u ON t.user_id = u.id
-            WHERE t.token = %s 
-            AND t.is_valid = TRUE 
-            AND t.expires_at > NOW()
-            AND u.is_active = TRUE
-        ''', (token,))
-        
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
-        return dict(user) if user else None
+        user = auth_repository.find_token_user(token)
     except Exception as e:
         print(f"❌ Error validando token: {e}")
         return None
+    
+    if not user:
+        return None
+    
+    user = dict(user)
+    # No cachear más allá de la expiración real del token
+    expires_in = float(user.pop('expires_in'))
+    token_cache.set(cache_key, user, ttl=expires_in, generation=generation)
+    return dict(user)
+
+def invalidate_cached_token(token, notify=True):
+    """Elimina un token del cache (logout) y avisa a los demás workers"""
+    cache_key = token_cache_key(token)
+    token_cache.pop(cache_key)
+    if notify:
+        notify_cache_invalidation(f"token:{cache_key}")
+
+def invalidate_cached_user(user_id, notify=True):
+    """Elimina del cache todos los tokens de un usuario (desactivación)"""
+    token_cache.pop_where(lambda user: user['id'] == user_id)
+    if notify:
+        notify_cache_invalidation(f"user:{user_id}")
+
+def notify_cache_invalidation(payload):
+    """Publica una invalidación por NOTIFY para que todos los procesos limpien su cache"""
+    with get_db_connection() as conn:
+        if not conn:
+            return
+        try:
+            conn.execute('SELECT pg_notify(%s, %s)', (CACHE_INVALIDATION_CHANNEL, payload))
+            conn.commit()
+        except Exception as e:
+            print(f"❌ Error publicando invalidación de token: {e}")
+
+def listen_cache_invalidations():
+    """Hilo en segundo plano: escucha invalidaciones de otros workers y limpia el cache local"""
+    while True:
+        try:
+            # Conexión dedicada (no del pool) porque LISTEN la mantiene ocupada
+            with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                conn.execute(f'LISTEN {CACHE_INVALIDATION_CHANNEL}')
+                # Lo que haya cambiado mientras estuvimos desconectados ya no es confiable
+                token_cache.clear()
+                conversation_store.clear_cache()
+                for notification in conn.notifies():
+                    kind, _, value = notification.payload.partition(':')
+                    if kind == 'token':
+                        token_cache.pop(value)
+                    elif kind == 'user' and value.isdigit():
+                        invalidate_cached_user(int(value), notify=False)
+                    elif kind == 'chat':
+                        conversation_store.handle_notification(value)
+        except Exception as e:
+            print(f"❌ Error escuchando invalidaciones de cache: {e}")
+            token_cache.clear()
+            conversation_store.clear_cache()
+            time.sleep(5)
+
+def start_cache_invalidation_listener():
+    """Arranca el listener de invalidaciones (una vez por proceso)"""
+    if not DATABASE_URL:
+        return
+    threading.Thread(target=listen_cache_invalidations, name="cache-invalidation", daemon=True).start()
+
+def deactivate_user(user_id):
+    """Desactiva un usuario e invalida sus sesiones de inmediato"""
+    try:
+        auth_repository.deactivate_user(user_id)
+    except Exception as e:
+        print(f"❌ Error desactivando usuario: {e}")
+        return False
+    
+    invalidate_cached_user(user_id)
+    return True
 
 def require_auth(f):
     """Decorador para requerir autenticación"""
@@ -205,179 +409,130 @@ def optional_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+# Sesiones de chat en memoria, acotadas por bytes e inactividad
+session_store = SessionStore(
+    max_bytes=SESSION_MAX_BYTES,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_turns=HISTORY_MAX_MESSAGES,
+    compress_min=SESSION_COMPRESS_MIN
+)
+
+# Historial de conversación compartido entre workers (últimos HISTORY_MAX_MESSAGES mensajes por chat)
+conversation_store = ConversationStore(
+    get_connection=get_db_connection if DATABASE_URL else None,
+    max_messages=HISTORY_MAX_MESSAGES,
+    sessions=session_store,
+    notify_channel=CACHE_INVALIDATION_CHANNEL
+)
+
 # Inicializar base de datos al arrancar
-init_db()
+auth_repository.init_tables()
+conversation_store.init_table()
+start_cache_invalidation_listener()
 
+@metrics.timed_stage('whatsapp_send')
 def send_whatsapp_message(phone_number, message):
     """Envía un mensaje de WhatsApp usando Evolution API"""
-    url = f"{EVOLUTION_API_URL}/message/sendText/{INSTANCE_NAME}"
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'apikey': EVOLUTION_API_KEY
-    }
-    
-    data = {
-        "number": phone_number,
-        "text": message
-    }
+    result = evolution_client.send_text(phone_number, message)
+    if result is None:
+        metrics.provider_error('evolution')
+    return result
+
+WELCOME_FALLBACK = "¡Hola! ¿En qué te puedo ayudar?"
+
+def generate_greetings(count):
+    """Genera un lote de saludos de bienvenida variados (una sola llamada a Grok)"""
+    if not grok_client:
+        return []
     
-    try:
-        response = requests.post(url, json=data, headers=headers)
-        return response.json()
-    except Exception as e:
-        print(f"Error enviando mensaje: {e}")
-        return None
+    response = grok_client.chat.completions.create(
+        model="grok-3-fast",
+        messages=[
+            {
+                "role": "system",
+                "content": "Eres NAVROS, un asistente virtual amable. Genera saludos de bienvenida cortos, naturales y cálidos (máximo 2 oraciones cada uno). No menciones productos ni vendas nada. Solo saluda y pregunta en qué puedes ayudar. Cada saludo debe ser distinto a los demás. Puedes usar máximo 1 emoji por saludo."
+            },
+            {
+                "role": "user",
+                "content": f"Genera {count} saludos de bienvenida distintos, uno por línea, sin numerar y sin comillas"
+            }
+        ],
+        max_tokens=60 * count,
+        temperature=0.9
+    )
+    lines = (response.choices[0].message.content or '').splitlines()
+    # Quitar viñetas o numeración por si el modelo las agrega
+    return [line.strip().lstrip('-•*0123456789.) ').strip('"') for line in lines if line.strip()]
+
+# Pool de saludos: la bienvenida se envía sin esperar al modelo
+greeting_pool = GreetingPool(
+    generate_batch=generate_greetings,
+    fallback=WELCOME_FALLBACK,
+    batch_size=GREETING_BATCH_SIZE,
+    low_water=GREETING_LOW_WATER
+)
+greeting_pool.start()
 
 def send_welcome_message(phone_number):
-    """Envía mensaje de bienvenida generado por IA"""
-    # Usar Grok para generar un saludo natural y variado
+    """Envía un mensaje de bienvenida del pool de saludos generados por IA"""
     try:
-        if grok_client:
-            response = grok_client.chat.completions.create(
-                model="grok-3-fast",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Eres NAVROS, un asistente virtual amable. Genera un saludo de bienvenida corto, natural y cálido (máximo 2 oraciones). No menciones productos ni vendas nada. Solo saluda y pregunta en qué puedes ayudar. Varía el saludo para que no sea siempre igual. Puedes usar máximo 1 emoji."
-                    },
-                    {
-                        "role": "user",
-                        "content": "Genera un saludo de bienvenida"
-                    }
-                ],
-                max_tokens=100,
-                temperature=0.9
-            )
-            mensaje = response.choices[0].message.content
-        else:
-            mensaje = "¡Hola! ¿En qué te puedo ayudar?"
-        
-        return send_whatsapp_message(phone_number, mensaje)
+        return send_whatsapp_message(phone_number, greeting_pool.take())
     except Exception as e:
-        print(f"Error generando bienvenida: {e}")
-        return send_whatsapp_message(phone_number, "¡Hola! ¿En qué te puedo ayudar?")
-
+        print(f"Error enviando bienvenida: {e}")
+        return send_whatsapp_message(phone_number, WELCOME_FALLBACK)
+
+def public_media_url(url):
+    """URL absoluta para una imagen del almacén local (las demás URLs no cambian)"""
+    if not media_store.name_from_url(url):
+        return url
+    if PUBLIC_BASE_URL:
+        return f"{PUBLIC_BASE_URL}{url}"
+    if has_request_context():
+        return f"{request.url_root.rstrip('/')}{url}"
+    return url
+
+@metrics.timed_stage('whatsapp_send')
 def send_whatsapp_image(phone_number, image_data, caption=""):
     """Envía una imagen por WhatsApp usando Evolution API (soporta URL o base64)"""
-    url = f"{EVOLUTION_API_URL}/message/sendMedia/{INSTANCE_NAME}"
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'apikey': EVOLUTION_API_KEY
-    }
+    name = media_store.name_from_url(image_data)
+    if name:
+        if PUBLIC_BASE_URL:
+            # Evolution descarga la imagen de /media: no viaja base64 en el JSON
+            return evolution_client.send_media(phone_number, public_media_url(image_data), caption, mimetype=media_store.mimetype(name))
+        
+        # Sin URL pública Evolution no puede descargarla: enviarla en base64
+        data = media_store.read(name)
+        if data is None:
+            print(f"❌ Imagen {name} ya no está en el almacén")
+            return None
+        return evolution_client.send_media(phone_number, base64.b64encode(data).decode('ascii'), caption, mimetype=media_store.mimetype(name))
     
     # Detectar si es base64 o URL
     if image_data.startswith("data:"):
         # Es base64, extraer solo los datos
         base64_data = image_data.split(",")[1] if "," in image_data else image_data
-        data = {
-            "number": phone_number,
-            "mediatype": "image",
-            "media": base64_data,
-            "mimetype": "image/jpeg",
-            "caption": caption
-        }
-    else:
-        # Es URL normal
-        data = {
-            "number": phone_number,
-            "mediatype": "image",
-            "media": image_data,
-            "caption": caption
-        }
+        return evolution_client.send_media(phone_number, base64_data, caption, mimetype="image/jpeg")
     
-    try:
-        response = requests.post(url, json=data, headers=headers)
-        print(f"Imagen enviada: {response.status_code}")
-        return response.json()
-    except Exception as e:
-        print(f"Error enviando imagen: {e}")
-        return None
+    # Es URL normal
+    return evolution_client.send_media(phone_number, image_data, caption)
 
 def is_image_request(text):
     """Detecta si el usuario está pidiendo generar una imagen"""
-    if not text:
-        return False
-    
-    texto_lower = text.lower().strip()
-    
-    # PRIMERO: Detectar frases que CLARAMENTE son solicitudes de imagen
-    triggers_imagen_fuertes = [
-        'genera una imagen', 'generar una imagen', 'generame una imagen', 'genérame una imagen',
-        'genera la imagen', 'generar la imagen', 'generame la imagen', 'genérame la imagen',
-        'crea una imagen', 'crear una imagen', 'creame una imagen', 'créame una imagen',
-        'genera una foto', 'crea una foto', 'hazme una foto',
-        'genera un logo', 'crea un logo', 'genera un logotipo', 'crea un logotipo',
-        'dibuja', 'dibújame', 'dibujar',
-        'hazme una imagen', 'haz una imagen',
-        'hazme un dibujo', 'haz un dibujo',
-        'quiero una imagen', 'necesito una imagen',
-        'genera un dibujo', 'crea un dibujo',
-        'genera imagen', 'crear imagen', 'generar imagen',
-        'dibujame', 'dibújame',
-        'crea img', 'genera img', 'haz img'
-    ]
-    
-    for trigger in triggers_imagen_fuertes:
-        if trigger in texto_lower:
-            return True
-    
-    # Patrones para personas/personajes (genera a X, dibuja a Y)
-    patrones_persona = [
-        'genera a ', 'crea a ', 'dibuja a ', 'hazme a ', 'haz a ',
-        'generame a ', 'genérame a ', 'creame a ', 'créame a ',
-        'dibujame a ', 'dibújame a '
-    ]
-    
-    for patron in patrones_persona:
-        if texto_lower.startswith(patron):
-            return True
-    
-    # Patrones: acción + palabra de imagen
-    palabras_accion = ['genera', 'crea', 'haz', 'hazme', 'dibuja']
-    palabras_imagen = ['imagen', 'dibujo', 'foto', 'ilustración', 'ilustracion', 'img', 'retrato', 'logo', 'logotipo']
-    
-    for accion in palabras_accion:
-        for imagen in palabras_imagen:
-            if accion in texto_lower and imagen in texto_lower:
-                return True
-    
-    # Si NO es claramente imagen, verificar exclusiones para otros patrones
-    exclusiones = [
-        'texto', 'codigo', 'código', 'programa', 'script', 'lista', 
-        'resumen', 'ensayo', 'documento', 'archivo', 'email', 'correo',
-        'mensaje', 'respuesta', 'explicación', 'explicacion', 'plan',
-        'receta', 'horario', 'tabla', 'excel', 'pdf', 'word',
-        'funcion', 'función', 'variable', 'clase', 'método', 'metodo',
-        'párrafo', 'parrafo', 'oracion', 'oración', 'frase', 'historia',
-        'cuento', 'poema', 'canción', 'cancion', 'letra', 'análisis', 'analisis',
-        'informe', 'reporte', 'carta', 'nota', 'apunte', 'tarea',
-        'pregunta', 'quiz', 'examen', 'ejercicio', 'problema de',
-        'sorteo', 'número', 'numero', 'aleatorio', 'random', 'simulacion', 'simulación'
-    ]
-    
-    # Solo aplicar exclusiones si el mensaje empieza con "genera un/una" sin palabra de imagen
-    if texto_lower.startswith(('genera un ', 'genera una ', 'crea un ', 'crea una ')):
-        for excl in exclusiones:
-            if excl in texto_lower:
-                return False
-        # Si no hay exclusión y empieza con genera/crea, probablemente es imagen
-        return True
-    
-    return False
+    return classify_intent(text).is_image_request
+
+# Almacén de imágenes generadas (direccionado por contenido)
+media_store = MediaStore(MEDIA_DIR, max_bytes=MEDIA_MAX_BYTES)
 
+@metrics.timed_stage('image_generation')
 def generate_image(prompt):
     """Genera una imagen usando Prodia con Nano Banana Pro (Gemini 3 Pro)"""
     try:
-        print(f"🎨 Generando imagen con Nano Banana Pro: {prompt[:100]}...")
+        image_log.info('prodia.request', prompt=prompt)
         
         if not PRODIA_API_KEY:
-            print("❌ PRODIA_API_KEY no configurado")
+            image_log.error('prodia.not_configured')
             return None
         
-        print(f"🔑 API Key presente: {PRODIA_API_KEY[:20]}...")
-        
         headers = {
             "Authorization": f"Bearer {PRODIA_API_KEY}",
             "Content-Type": "application/json",
@@ -392,34 +547,34 @@ def generate_image(prompt):
             }
         }
         
-        print(f"📤 Enviando request a Prodia...")
-        print(f"📤 Data: {data}")
-        
         # Endpoint correcto de Prodia v2
         response = requests.post(
-            "https://inference.prodia.com/v2/job",
+            PRODIA_API_URL,
             headers=headers,
             json=data,
             timeout=120
         )
         
-        print(f"📋 Respuesta Status: {response.status_code}")
-        print(f"📋 Respuesta Headers: {dict(response.headers)}")
+        content_type = response.headers.get('content-type', '')
+        image_log.info(
+            'prodia.response',
+            status=response.status_code,
+            content_type=content_type,
+            bytes=len(response.content),
+            job_id=response.headers.get('x-prodia-job-id') or response.headers.get('x-request-id')
+        )
         
         if response.status_code == 200:
-            content_type = response.headers.get('content-type', '')
-            print(f"📋 Content-Type: {content_type}")
-            
             if 'image' in content_type:
-                # La respuesta es directamente la imagen
-                image_base64 = base64.b64encode(response.content).decode('utf-8')
-                print(f"✅ Imagen generada exitosamente ({len(image_base64)} chars base64)")
-                return f"data:image/jpeg;base64,{image_base64}"
+                # La respuesta es directamente la imagen: guardarla y devolver su URL
+                name = media_store.put(response.content, content_type.split(';')[0].strip())
+                image_log.info('prodia.image_stored', name=name)
+                return media_store.url(name)
             else:
                 # Puede ser JSON con URL
                 try:
                     result = response.json()
-                    print(f"📋 Respuesta JSON: {result}")
+                    image_log.info('prodia.json_response', body=result)
                     if 'imageUrl' in result:
                         return result['imageUrl']
                     elif 'url' in result:
@@ -428,43 +583,55 @@ def generate_image(prompt):
                     pass
                 
                 # Intentar como imagen de todas formas
-                image_base64 = base64.b64encode(response.content).decode('utf-8')
-                print(f"✅ Tratando respuesta como imagen ({len(image_base64)} chars)")
-                return f"data:image/jpeg;base64,{image_base64}"
+                name = media_store.put(response.content)
+                image_log.warning('prodia.unknown_content_type', content_type=content_type, name=name)
+                return media_store.url(name)
         else:
-            print(f"❌ Error en la respuesta: {response.status_code}")
-            print(f"❌ Response body: {response.text[:500]}")
+            metrics.provider_error('prodia')
+            image_log.error('prodia.error', status=response.status_code, body=response.text[:LOG_MAX_FIELD])
             return None
     
     except Exception as e:
-        print(f"❌ Error generando imagen: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        metrics.provider_error('prodia')
+        image_log.error('prodia.exception', exc_info=True, error=str(e))
         return None
 
-# Diccionario para rastrear usuarios nuevos (en memoria)
-user_sessions = {}
-
-# Diccionario para almacenar el historial de conversación de cada usuario
-conversation_history = {}
-
+# Imágenes pedidas desde la app: pool dedicado y acotado, el request responde con un job_id
+image_jobs = ImageJobManager(
+    generate=generate_image,
+    workers=IMAGE_JOB_WORKERS,
+    max_pending=IMAGE_JOB_MAX_PENDING,
+    result_ttl=IMAGE_JOB_RESULT_TTL,
+    get_connection=get_db_connection if DATABASE_URL else None
+)
+image_jobs.init_table()
+
+# Tasas de cambio compartidas, refrescadas en segundo plano (el request nunca espera a la API)
+exchange_rates_cache = RatesCache(
+    fetch=fetch_exchange_rates,
+    refresh_interval=EXCHANGE_RATES_REFRESH,
+    name="exchange-rates"
+)
+exchange_rates_cache.start()
+
+@metrics.timed_stage('exchange_rates')
 def get_exchange_rates():
-    """Obtiene tasas de cambio actuales usando API gratuita"""
+    """Obtiene tasas de cambio actuales desde el cache (sin llamar a la API en el request)"""
+    data = exchange_rates_cache.get()
+    if not data:
+        # Todavía no hay snapshot (recién arrancó el worker o la API está caída)
+        return None
+    
     try:
-        # API gratuita de tasas de cambio
-        response = requests.get('https://api.exchangerate-api.com/v4/latest/USD', timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            rates = data.get('rates', {})
-            date = data.get('date', 'N/A')
-            
-            # Tasas principales
-            eur = rates.get('EUR', 'N/A')
-            cop = rates.get('COP', 'N/A')
-            mxn = rates.get('MXN', 'N/A')
-            
-            info = f"""📊 TASAS DE CAMBIO ACTUALES (Actualizado: {date})
+        rates = data.get('rates', {})
+        date = data.get('date', 'N/A')
+        
+        # Tasas principales
+        eur = rates.get('EUR', 'N/A')
+        cop = rates.get('COP', 'N/A')
+        mxn = rates.get('MXN', 'N/A')
+        
+        info = f"""📊 TASAS DE CAMBIO ACTUALES (Actualizado: {date})
 
 1 USD = {eur} EUR (Euro)
 1 USD = {cop} COP (Peso Colombiano)
@@ -473,10 +640,8 @@ def get_exchange_rates():
 Para otras monedas:
 - 1 EUR = {1/eur if eur != 'N/A' else 'N/A'} USD
 - 1 COP = {1/cop if cop != 'N/A' else 'N/A'} USD"""
-            
-            return info
-        else:
-            return None
+        
+        return info
     except Exception as e:
         print(f"Error obteniendo tasas de cambio: {e}")
         return None
@@ -493,176 +658,130 @@ def get_current_info(query):
 
 def is_greeting(text):
     """Detecta si el mensaje es un saludo"""
-    if not text:
-        return False
+    return classify_intent(text).is_greeting
+
+def summarize_history(previous_summary, messages):
+    """Condensa mensajes viejos del chat (corre en segundo plano, nunca dentro de un request)"""
+    transcript = "\n".join(
+        f"{'Usuario' if m['role'] == 'user' else 'Asistente'}: {m['content']}" for m in messages
+    )
+    if previous_summary:
+        transcript = f"Resumen previo:\n{previous_summary}\n\nMensajes nuevos:\n{transcript}"
+    
+    response, _ = text_router.complete(
+        messages=[
+            {
+                "role": "system",
+                "content": "Resume la conversación entre un usuario y el asistente NAVROS en español, en pocas frases. "
+                           "Conserva datos concretos (nombres, cifras, preferencias, pedidos pendientes) y omite saludos y relleno."
+            },
+            {"role": "user", "content": transcript}
+        ],
+        max_tokens=HISTORY_SUMMARY_TOKENS,
+        temperature=0.3
+    )
+    return (response.choices[0].message.content or '').strip()
+
+# Ventana de historial por tokens, con resumen de los turnos que ya no caben
+history_window = HistoryWindow(
+    budget=HISTORY_TOKEN_BUDGET,
+    summarize=summarize_history,
+    get_connection=get_db_connection if DATABASE_URL else None
+)
+history_window.init_table()
+
+# Respuestas a preguntas frecuentes de la marca (Instagram, página web, creador, productos)
+faq_cache = FAQCache(
+    maxsize=FAQ_CACHE_MAX_SIZE,
+    ttl=FAQ_CACHE_TTL
+) if FAQ_CACHE_MAX_SIZE > 0 else None
+
+def cached_faq_answer(message):
+    """Respuesta cacheada si el mensaje es una pregunta frecuente ya respondida"""
+    if not faq_cache or not message:
+        return None
+    answer = faq_cache.get(message)
+    if answer:
+        print(f"⚡ Respuesta desde el cache de preguntas frecuentes")
+    return answer
+
+def remember_faq_answer(message, answer, has_history):
+    """Cachea la respuesta solo si se generó sin historial (la verán otros usuarios)"""
+    if faq_cache and message and answer and answer != CHAT_ERROR_MESSAGE and not has_history:
+        faq_cache.set(message, answer)
+
+def build_chat_context(message, phone_number, image_url=None):
+    """Arma los mensajes para el modelo (sistema + historial) y el texto final del usuario
     
-    saludos = [
-        'hola', 'hi', 'hello', 'buenas', 'buenos días', 'buenos dias', 
-        'buenas tardes', 'buenas noches', 'hey', 'ey', 'alo', 'aló',
-        'que tal', 'qué tal', 'saludos', 'buenas buenas'
-    ]
+    Retorna (mensajes, texto_final, hay_historial).
+    """
+    # Primero verificar si necesita información actualizada
+    current_info = None
+    if message and not image_url:  # Solo buscar info actual si es texto puro
+        current_info = get_current_info(message)
     
-    texto_limpio = text.lower().strip()
+    # Historial del usuario: los mensajes recientes que caben en el presupuesto (+ resumen de los anteriores)
+    user_history = history_window.build(phone_number, conversation_store.get_history(phone_number))
     
-    # Verificar si es exactamente un saludo
-    if texto_limpio in saludos:
-        return True
+    # Sistema (fijo, cacheable por el proveedor) + historial + contexto variable al final
+    messages = build_messages(user_history)
     
-    # Verificar si empieza con un saludo común
-    for saludo in ['hola', 'buenas', 'buenos', 'hey', 'hi']:
-        if texto_limpio.startswith(saludo) and len(texto_limpio) < 20:
-            return True
+    # Si hay información actual disponible, agregarla al mensaje
+    final_message = with_current_info(message, current_info)
+    if current_info:
+        print(f"✅ Información actualizada agregada: {current_info[:100]}...")
     
-    return False
+    return messages, final_message, bool(user_history)
 
 def get_chatgpt_response(message, phone_number, image_url=None):
-    """Obtiene respuesta de ChatGPT con soporte para imágenes y MEMORIA CONVERSACIONAL"""
+    """Obtiene respuesta de ChatGPT con soporte para imágenes y MEMORIA CONVERSACIONAL
+    
+    image_url puede ser una URL (o data URL) o una lista de ellas.
+    """
     try:
-        # Primero verificar si necesita información actualizada
-        current_info = None
-        if message and not image_url:  # Solo buscar info actual si es texto puro
-            current_info = get_current_info(message)
-        
-        # Inicializar historial si no existe para este usuario
-        if phone_number not in conversation_history:
-            conversation_history[phone_number] = []
-        
-        # Obtener historial del usuario (últimos 10 mensajes para no exceder límites)
-        user_history = conversation_history[phone_number][-10:]
-        
-        # Obtener fecha y hora actual
-        fecha_actual = datetime.now().strftime("%A %d de %B de %Y")
-        hora_actual = datetime.now().strftime("%H:%M")
-        
-        # Mensaje del sistema - tono profesional, adaptable y natural
-        system_message = {
-            "role": "system", 
-            "content": f"""Eres NAVROS, un asistente virtual amable y versátil. Puedes ayudar con cualquier tema: preguntas generales, tareas, dudas, conversación, y también sobre la marca NAVROS cuando sea relevante.
-
-INFORMACIÓN TEMPORAL IMPORTANTE:
-- Fecha actual: {fecha_actual}
-- Hora actual (aproximada): {hora_actual}
-Usa siempre esta información cuando te pregunten por la fecha u hora.
-
-TU NOMBRE E IDENTIDAD:
-- Te llamas NAVROS
-- Fuiste creado por el equipo de NAVROS
-- Si preguntan quién te creó, quién te hizo, o quién es tu creador, responde que fuiste creado por el equipo de NAVROS
-- Puedes generar imágenes cuando te lo pidan (con frases como "genera una imagen de...", "dibuja...", "crea una imagen de...")
-
-PRINCIPIO FUNDAMENTAL:
-Sé natural y abierto. NO fuerces el tema de la marca. Si alguien te saluda o pregunta algo general, simplemente ayúdale. Solo habla de NAVROS si el usuario pregunta específicamente sobre ropa, la marca, productos o temas relacionados.
-
-FORMATO DE LINKS IMPORTANTE:
-Cuando compartas links, escríbelos de forma limpia y directa, SIN formato markdown:
-- Instagram: https://www.instagram.com/navros.co/
-- Página web: https://navros.co/
-NUNCA uses corchetes [] ni paréntesis () para links. Solo escribe la URL directa.
-
-CÓMO ADAPTARTE AL TONO:
-
-1. TONO POR DEFECTO:
-• Amable, cálido y profesional
-• Sin jerga callejera ni exceso de emojis
-• Cercano sin ser confianzudo
-
-2. SI EL USUARIO ES CASUAL/JUVENIL:
-Si usa "bro", "pana", "parce", "man" o habla muy relajado:
-• Puedes relajar tu tono gradualmente
-• Usa expresiones similares pero sin exagerar
-• Máximo 1-2 emojis por mensaje
-
-3. SI EL USUARIO ES MUY FORMAL:
-• Mantén distancia respetuosa
-• Lenguaje claro y profesional
-
-4. PREGUNTAS ACADÉMICAS O TÉCNICAS:
-• Responde con profundidad y precisión
-• Usa lenguaje claro y bien estructurado
-• Sé útil como un experto accesible
-• Puedes dar respuestas extensas y detalladas cuando el tema lo requiera
-
-LO QUE NUNCA DEBES HACER:
-• NO menciones la marca NAVROS a menos que sea relevante o te pregunten
-• NO fuerces conversaciones hacia productos o ropa
-• No uses jerga callejera a menos que el usuario la use primero
-• No abuses de emojis (máximo 1-2 por mensaje)
-• No seas excesivamente efusivo o exagerado
-• NUNCA uses formato markdown para links
-
-CUÁNDO SÍ HABLAR DE NAVROS:
-• Si preguntan por ropa, suéteres, camisetas, streetwear
-• Si preguntan directamente por la marca o productos
-• Si preguntan por precios, envíos, tallas
-• Si el contexto lo hace natural
-
-INFORMACIÓN SOBRE NAVROS (usar solo cuando sea relevante):
-NAVROS es una marca de streetwear contemporánea que combina lo urbano con elegancia moderna.
-
-Productos principales:
-• Suéteres Oversize Premium: prendas gruesas, acid wash, confección premium
-• Camisetas Streetwear: cortes amplios, tonos sobrios
-• Próximamente: Hoodies, Joggers, Camisas, Accesorios
-
-Estilo: streetwear elegante, siluetas amplias, materiales premium.
-
-EJEMPLOS DE RESPUESTAS:
-
-Usuario: "Quién te creó?"
-Tú: "Fui creado por el equipo de NAVROS."
-
-Usuario: "Qué fecha es hoy?"
-Tú: "Hoy es {fecha_actual}."
-
-Usuario: "Cuál es tu Instagram?"
-Tú: "Nuestro Instagram es https://www.instagram.com/navros.co/"
-
-Usuario: "Ayúdame con una tarea de matemáticas"
-Tú: "Claro, con gusto. ¿Qué necesitas resolver?"
-
-Recuerda: eres un asistente útil para TODO, no solo para vender. Sé natural y solo menciona la marca cuando tenga sentido."""
-        }
-        
-        # Construir mensajes incluyendo el historial
-        messages = [system_message] + user_history
+        # Preguntas frecuentes: responder sin llamar al modelo
+        if not image_url:
+            cached_answer = cached_faq_answer(message)
+            if cached_answer:
+                save_exchange(phone_number, message, cached_answer)
+                return cached_answer
         
-        # Si hay información actual disponible, agregarla al mensaje
-        final_message = message
-        if current_info:
-            final_message = f"{message}\n\n[INFORMACIÓN ACTUALIZADA EN TIEMPO REAL]\n{current_info}\n\nUsa esta información para responder la pregunta del usuario."
-            print(f"✅ Información actualizada agregada: {current_info[:100]}...")
+        messages, final_message, has_history = build_chat_context(message, phone_number, image_url)
         
         # Si hay una imagen, usamos GPT-4o con visión (mejor calidad)
         if image_url:
             print(f"📸 Procesando imagen con GPT-4o Vision...")
             
             try:
-                # Crear el mensaje con la imagen
+                # Crear el mensaje con la(s) imagen(es)
+                image_urls = image_url if isinstance(image_url, list) else [image_url]
                 user_message = {
                     "role": "user",
                     "content": [
                         {
                             "type": "text",
                             "text": final_message if final_message else "¿Qué hay en esta imagen?"
-                        },
+                        }
+                    ] + [
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": image_url
+                                "url": url
                             }
                         }
+                        for url in image_urls
                     ]
                 }
                 
                 messages.append(user_message)
                 
                 # Usar OpenAI GPT-4o para imágenes
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    max_tokens=4000,
-                    temperature=0.8
-                )
+                with metrics.timed('llm_vision'):
+                    response, _ = vision_router.complete(
+                        messages=messages,
+                        max_tokens=4000,
+                        temperature=0.8
+                    )
                 
                 print("✅ Imagen procesada exitosamente con GPT-4o")
                 
@@ -672,51 +791,79 @@ Recuerda: eres un asistente útil para TODO, no solo para vender. Sé natural y
                 if message:
                     print("Reintentando solo con texto...")
                     user_message = {"role": "user", "content": f"{message} [Nota: Había una imagen pero no pude procesarla]"}
-                    messages.append(user_message)
-                    response = openai_client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=messages,
-                        max_tokens=4000,
-                        temperature=0.8
-                    )
+                    # Reemplazar el mensaje con la imagen: el reintento puede ir a un proveedor sin visión
+                    messages[-1] = user_message
+                    with metrics.timed('llm'):
+                        response, provider = text_router.complete(
+                            messages=messages,
+                            max_tokens=4000,
+                            temperature=0.8
+                        )
                 else:
                     raise Exception("No pude procesar la imagen y no hay texto alternativo")
         else:
-            # Sin imagen, usar Grok para texto (93% más barato)
-            # Si no hay API key de Grok, usar GPT-4o como fallback
-            if grok_client:
-                print(f"💬 Procesando texto con Grok-4-fast-reasoning...")
-                model_to_use = "grok-4-fast-reasoning"
-                client_to_use = grok_client
-            else:
-                print(f"💬 Procesando texto con GPT-4o (Grok no configurado)...")
-                model_to_use = "gpt-4o"
-                client_to_use = openai_client
-            
             user_message = {"role": "user", "content": final_message}
             messages.append(user_message)
             
-            response = client_to_use.chat.completions.create(
-                model=model_to_use,
-                messages=messages,
-                max_tokens=4000,
-                temperature=0.8
-            )
+            # El router elige el proveedor sano más rápido (y duplica el request si tarda demasiado)
+            with metrics.timed('llm'):
+                response, provider = text_router.complete(
+                    messages=messages,
+                    max_tokens=4000,
+                    temperature=0.8
+                )
+            print(f"💬 Texto procesado con {provider.label}")
         
         assistant_response = response.choices[0].message.content
         
-        # Guardar el intercambio en el historial (solo texto, no imágenes completas para ahorrar tokens)
-        conversation_history[phone_number].append({"role": "user", "content": message if message else "[imagen enviada]"})
-        conversation_history[phone_number].append({"role": "assistant", "content": assistant_response})
-        
-        # Limitar historial a últimos 20 mensajes (10 intercambios) para no exceder límites
-        if len(conversation_history[phone_number]) > 20:
-            conversation_history[phone_number] = conversation_history[phone_number][-20:]
+        save_exchange(phone_number, message, assistant_response)
+        if not image_url:
+            remember_faq_answer(message, assistant_response, has_history)
         
         return assistant_response
     except Exception as e:
         print(f"Error con OpenAI: {e}")
-        return "Lo siento, hubo un error procesando tu mensaje. Por favor intenta de nuevo."
+        return CHAT_ERROR_MESSAGE
+
+def save_exchange(phone_number, message, assistant_response):
+    """Guarda el intercambio en el historial (solo texto, no imágenes completas para ahorrar tokens)"""
+    # El store limita el historial a los últimos HISTORY_MAX_MESSAGES mensajes
+    conversation_store.append(phone_number, [
+        {"role": "user", "content": message if message else "[imagen enviada]"},
+        {"role": "assistant", "content": assistant_response}
+    ])
+
+def stream_chatgpt_response(message, phone_number):
+    """Igual que get_chatgpt_response (solo texto) pero entrega el texto a medida que llega"""
+    cached_answer = cached_faq_answer(message)
+    if cached_answer:
+        save_exchange(phone_number, message, cached_answer)
+        yield cached_answer
+        return
+    
+    messages, final_message, has_history = build_chat_context(message, phone_number)
+    messages.append({"role": "user", "content": final_message})
+    
+    provider, stream = text_router.stream(
+        messages=messages,
+        max_tokens=4000,
+        temperature=0.8
+    )
+    print(f"💬 Streaming con {provider.label}")
+    
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+    
+    # Al terminar, guardar la respuesta completa igual que en modo normal
+    assistant_response = ''.join(parts)
+    save_exchange(phone_number, message, assistant_response)
+    remember_faq_answer(message, assistant_response, has_history)
 
 @app.route('/')
 def home():
@@ -726,197 +873,453 @@ def home():
         "features": "Soporte para texto e imágenes con GPT-4o"
     })
 
+# Normalización de imágenes recibidas (WhatsApp y app) antes de GPT-4o Vision
+vision_pipeline = VisionImagePipeline(
+    max_side=VISION_MAX_SIDE,
+    max_bytes=VISION_MAX_BYTES,
+    quality=VISION_JPEG_QUALITY
+)
+
+def extract_whatsapp_content(message_data):
+    """Extrae el texto y la imagen (como data URL) de un mensaje de WhatsApp"""
+    message_info = message_data.get('message', {})
+    
+    # Inicializar variables
+    text = None
+    image_url = None
+    
+    # Procesar mensaje de texto
+    if message_info.get('conversation'):
+        text = message_info.get('conversation')
+    elif message_info.get('extendedTextMessage'):
+        text = message_info.get('extendedTextMessage', {}).get('text')
+    
+    # Procesar imagen
+    if message_info.get('imageMessage'):
+        image_msg = message_info.get('imageMessage', {})
+        # Obtener caption de la imagen (texto que acompaña la imagen)
+        caption = image_msg.get('caption', '')
+        if caption:
+            text = caption
+        
+        # Las URLs de WhatsApp no son accesibles directamente por OpenAI
+        # Necesitamos descargar la imagen usando Evolution API
+        try:
+            print("Descargando imagen desde WhatsApp...")
+            
+            # Obtener la imagen en base64 (la descarga se reintenta si Evolution falla)
+            with metrics.timed('media_download'):
+                result = evolution_client.get_media_base64(message_data)
+            if result is None:
+                metrics.provider_error('evolution')
+            
+            if result:
+                base64_data = result.get('base64')
+                
+                if base64_data:
+                    # Obtener el tipo MIME (por defecto jpeg)
+                    mime_type = image_msg.get('mimetype', 'image/jpeg')
+                    
+                    # Decodificar una sola vez, reducir al presupuesto de visión y convertir a data URL
+                    image_url = vision_pipeline.to_data_url(base64_data, mime_type)
+                    if image_url:
+                        print(f"✅ Imagen descargada y preparada ({len(image_url)} caracteres)")
+                else:
+                    print("❌ No se obtuvo base64 de la imagen")
+                
+        except Exception as e:
+            print(f"❌ Error procesando imagen: {e}")
+            import traceback
+            traceback.print_exc()
+        
+        print(f"Imagen procesada - Caption: {caption}, Base64: {'Sí' if image_url and 'base64' in image_url else 'No'}")
+    
+    return text, image_url
+
+def process_whatsapp_message(message_data):
+    """Procesa un mensaje entrante de WhatsApp (se ejecuta en la cola, fuera del request)"""
+    process_whatsapp_messages([message_data])
+
+def process_whatsapp_messages(messages_data):
+    """Procesa uno o varios mensajes seguidos del mismo chat como un solo turno"""
+    phone_number = messages_data[0].get('key', {}).get('remoteJid')
+    
+    texts = []
+    image_urls = []
+    for message_data in messages_data:
+        text, image_url = extract_whatsapp_content(message_data)
+        if text:
+            texts.append(text)
+        if image_url:
+            image_urls.append(image_url)
+    
+    text = '\n'.join(texts) or None
+    # Una sola imagen se pasa como string (igual que antes); varias, como lista
+    image_url = image_urls[0] if len(image_urls) == 1 else (image_urls or None)
+    
+    # Procesar si hay contenido (texto o imagen)
+    if not ((text or image_url) and phone_number):
+        return
+    
+    if len(messages_data) > 1:
+        print(f"Procesando {len(messages_data)} mensajes agrupados de {phone_number} ({len(image_urls)} imágenes)")
+    else:
+        print(f"Procesando mensaje de {phone_number}")
+    
+    # Si hay imagen pero no hay texto, usar un prompt por defecto
+    if image_url and not text:
+        text = "¿Qué hay en esta imagen?"
+        print("Imagen sin caption, usando prompt por defecto")
+    
+    # Detectar saludo y solicitud de imagen en un solo recorrido del texto
+    intent = classify_intent(text)
+    metrics.count_intent(intent.name, 'whatsapp')
+    es_saludo = intent.is_greeting
+    es_solicitud_imagen = intent.is_image_request
+    print(f"📋 Análisis del mensaje - Saludo: {es_saludo}, Solicitud imagen: {es_solicitud_imagen}, Texto: {text[:50] if text else 'None'}...")
+    
+    # Verificar si es un usuario nuevo (primera interacción en esta sesión)
+    is_new_user = session_store.touch(phone_number)
+    
+    if is_new_user:
+        print(f"Nuevo usuario en esta sesión: {phone_number}")
+    
+    # PRIMERO: Si es solicitud de imagen, procesarla directamente (sin bienvenida)
+    if es_solicitud_imagen:
+        print(f"🎨 Solicitud de imagen detectada: {text}")
+        
+        # Enviar mensaje de espera
+        send_whatsapp_message(phone_number, "Dame un momento, estoy creando tu imagen... 🎨")
+        
+        # Generar la imagen
+        generated_image_url = generate_image(text)
+        
+        if generated_image_url:
+            # Enviar la imagen generada
+            send_whatsapp_image(phone_number, generated_image_url, "¡Aquí está tu imagen! ✨")
+        else:
+            send_whatsapp_message(phone_number, "Lo siento, no pude generar la imagen. ¿Podrías intentar con otra descripción?")
+        return
+    
+    # SEGUNDO: Si es solo un saludo simple, enviar bienvenida
+    if es_saludo and not image_url:
+        print(f"Enviando mensaje de bienvenida (saludo detectado)")
+        send_welcome_message(phone_number)
+        return
+    
+    if image_urls:
+        print(f"Procesando con {len(image_urls)} imagen(es): {image_urls[0][:100]}...")
+    
+    try:
+        # Obtiene respuesta de ChatGPT (con o sin imagen)
+        chatgpt_response = get_chatgpt_response(text, phone_number, image_url)
+        
+        # Envía respuesta por WhatsApp
+        send_whatsapp_message(phone_number, chatgpt_response)
+        
+    except Exception as e:
+        print(f"Error procesando mensaje: {e}")
+        import traceback
+        traceback.print_exc()
+        
+        # Enviar mensaje de error más específico
+        if image_url:
+            error_msg = "Disculpa, tuve un problema procesando la imagen. ¿Podrías agregar un texto describiendo qué necesitas de la imagen?"
+        else:
+            error_msg = "Disculpa, hubo un error procesando tu mensaje. ¿Podrías intentar de nuevo?"
+        
+        send_whatsapp_message(phone_number, error_msg)
+
+# Entregas repetidas de Evolution (mismo key.id + remoteJid) se descartan antes de encolar
+delivery_deduper = DeliveryDeduper(
+    get_connection=get_db_connection if DATABASE_URL and WEBHOOK_DEDUPE_PERSIST else None,
+    window_size=WEBHOOK_DEDUPE_WINDOW
+)
+delivery_deduper.init_table()
+
+# Cola de mensajes del webhook: Evolution recibe el 200 de inmediato y los workers hacen el trabajo pesado
+def webhook_job_messages(job):
+    """Mensajes de un job de la cola (uno solo o un turno agrupado)"""
+    return job.get('messages') or [job['message_data']]
+
+def webhook_job_chat(job):
+    """Chat (remoteJid) al que pertenece un job de la cola"""
+    return webhook_job_messages(job)[0].get('key', {}).get('remoteJid')
+
+@contextmanager
+def chat_lock(chat_id):
+    """Lock por chat entre procesos (advisory lock de PostgreSQL), si está activado
+    
+    Lock de sesión (sobrevive al commit, así no dejamos una transacción abierta) tomado
+    con pg_try_advisory_lock hasta CHAT_LOCK_TIMEOUT: si no llega, el job sigue sin el
+    lock en vez de bloquear el worker. Si el unlock falla la conexión se cierra para
+    que el pool la descarte con el lock adentro. Solo se mide la espera del lock.
+    """
+    pool = get_db_pool() if CHAT_ADVISORY_LOCKS and chat_id else None
+    if not pool:
+        yield
+        return
+    
+    try:
+        with metrics.timed('db_pool_wait'):
+            conn = pool.getconn(timeout=DB_POOL_TIMEOUT)
+    except Exception as e:
+        print(f"❌ Error conectando a DB: {e}")
+        yield
+        return
+    
+    locked = False
+    try:
+        with metrics.timed('chat_lock_wait'):
+            locked = try_chat_lock(conn, chat_id)
+        if not locked:
+            webhook_log.warning('webhook.chat_lock_timeout', chat=chat_id, timeout=CHAT_LOCK_TIMEOUT)
+        yield
+    finally:
+        if locked:
+            try:
+                conn.execute('SELECT pg_advisory_unlock(hashtext(%s))', (chat_id,))
+                conn.commit()
+            except Exception as e:
+                print(f"❌ Error liberando el lock de {chat_id}: {e}")
+                conn.close()
+        pool.putconn(conn)
+
+def try_chat_lock(conn, chat_id, poll=0.1):
+    """Intenta tomar el advisory lock del chat hasta CHAT_LOCK_TIMEOUT. Retorna True si lo tomó"""
+    deadline = time.monotonic() + CHAT_LOCK_TIMEOUT
+    try:
+        while True:
+            row = conn.execute('SELECT pg_try_advisory_lock(hashtext(%s)) AS locked', (chat_id,)).fetchone()
+            conn.commit()
+            if row['locked']:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll)
+    except Exception as e:
+        print(f"❌ Error tomando el lock de {chat_id}: {e}")
+        return False
+
+def handle_webhook_job(job):
+    """Procesa un job de la cola (la cola ya garantiza orden por chat dentro del proceso)"""
+    with chat_lock(webhook_job_chat(job)):
+        process_whatsapp_messages(webhook_job_messages(job))
+
+message_queue = MessageQueue(
+    handler=handle_webhook_job,
+    workers=WEBHOOK_WORKERS,
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    store=PostgresJobStore(get_db_connection) if WEBHOOK_QUEUE_DURABLE else None,
+    key_func=webhook_job_chat
+)
+message_queue.start()
+
+def update_metric_gauges():
+    """Publica el estado de las colas de este worker (Prometheus suma los workers vivos)"""
+    queue_stats = message_queue.stats()
+    metrics.QUEUE_DEPTH.set(queue_stats['depth'])
+    metrics.IN_FLIGHT.set(queue_stats['in_flight'])
+    metrics.IMAGE_JOBS_PENDING.set(image_jobs.stats()['pending'])
+
+metrics.start_gauge_updater(update_metric_gauges)
+
+def enqueue_coalesced_messages(phone_number, items):
+    """Encola el turno agrupado (se llama cuando el chat queda en silencio)
+    
+    Con la cola persistente cada mensaje ya quedó retenido en webhook_jobs al llegar
+    (held_id): el turno agrupado los reemplaza, y si no se puede encolar la
+    recuperación los procesa después uno por uno en vez de perderlos.
+    """
+    messages_data = [item['message_data'] for item in items]
+    held_ids = [item['held_id'] for item in items if item.get('held_id') is not None]
+    # Ya no hay request al que responder 503: esperar un poco a que haya lugar en la cola
+    if message_queue.submit({"messages": messages_data}, timeout=30, replaces=held_ids):
+        return
+    report_unqueued_turn('queue_full', phone_number, items)
+
+def report_unqueued_turn(reason, phone_number, items):
+    """Registra un turno agrupado que no llegó a la cola (perdido, o retenido en la DB)"""
+    recoverable = all(item.get('held_id') is not None for item in items)
+    if recoverable:
+        webhook_log.warning('webhook.turn_deferred', reason=reason, chat=phone_number, messages=len(items))
+    else:
+        metrics.lost_turn(reason)
+        webhook_log.error('webhook.turn_lost', reason=reason, chat=phone_number, messages=len(items))
+
+def report_pending_coalesced_messages():
+    """Al apagar el proceso: los turnos que seguían agrupándose no se van a procesar aquí"""
+    for phone_number, items in message_coalescer.drain().items():
+        report_unqueued_turn('shutdown', phone_number, items)
+
+# Agrupación opcional de mensajes seguidos del mismo chat en un solo turno
+message_coalescer = MessageCoalescer(
+    flush=enqueue_coalesced_messages,
+    window=WEBHOOK_COALESCE_MS / 1000,
+    max_wait=WEBHOOK_COALESCE_MAX_MS / 1000
+) if WEBHOOK_COALESCE_MS > 0 else None
+if message_coalescer:
+    atexit.register(report_pending_coalesced_messages)
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    """Recibe mensajes de WhatsApp y responde con ChatGPT"""
+    """Recibe mensajes de WhatsApp, los encola y responde de inmediato"""
     try:
         data = request.json
-        print(f"Mensaje recibido: {data}")
+        # Payload recortado y sin base64/thumbnails (muestreable con LOG_SAMPLE_RATES)
+        webhook_log.info('webhook.received', evolution_event=data.get('event'), payload=data)
         
         # Verifica que sea un mensaje entrante
         if data.get('event') == 'messages.upsert':
             message_data = data.get('data', {})
-            
-            # Extrae información del mensaje
-            message_info = message_data.get('message', {})
+            message_info = message_data.get('message') or {}
             phone_number = message_data.get('key', {}).get('remoteJid')
+            message_id = message_data.get('key', {}).get('id')
             from_me = message_data.get('key', {}).get('fromMe', False)
             
             # No responde a mensajes propios
             if from_me:
                 return jsonify({"status": "ignored", "reason": "mensaje propio"}), 200
             
-            # Inicializar variables
-            text = None
-            image_url = None
+            # Solo encolar mensajes con algo que procesar (texto o imagen)
+            has_content = (
+                message_info.get('conversation')
+                or (message_info.get('extendedTextMessage') or {}).get('text')
+                or message_info.get('imageMessage')
+            )
+            if not (has_content and phone_number):
+                return jsonify({"status": "ignored", "reason": "sin contenido"}), 200
             
-            # Procesar mensaje de texto
-            if message_info.get('conversation'):
-                text = message_info.get('conversation')
-            elif message_info.get('extendedTextMessage'):
-                text = message_info.get('extendedTextMessage', {}).get('text')
+            # Evolution reenvía el evento si tardamos: no repetir LLM, imagen ni respuesta
+            if delivery_deduper.is_duplicate(phone_number, message_id):
+                webhook_log.info('webhook.duplicate', message_id=message_id, chat=phone_number)
+                return jsonify({"status": "ignored", "reason": "duplicado"}), 200
             
-            # Procesar imagen
-            if message_info.get('imageMessage'):
-                image_msg = message_info.get('imageMessage', {})
-                # Obtener caption de la imagen (texto que acompaña la imagen)
-                caption = image_msg.get('caption', '')
-                if caption:
-                    text = caption
-                
-                # Las URLs de WhatsApp no son accesibles directamente por OpenAI
-                # Necesitamos descargar la imagen usando Evolution API
-                try:
-                    print("Descargando imagen desde WhatsApp...")
-                    
-                    # Endpoint para obtener la imagen en base64
-                    download_url = f"{EVOLUTION_API_URL}/chat/getBase64FromMediaMessage/{INSTANCE_NAME}"
-                    download_data = {
-                        "message": message_data
-                    }
-                    download_headers = {
-                        'Content-Type': 'application/json',
-                        'apikey': EVOLUTION_API_KEY
-                    }
-                    
-                    response = requests.post(download_url, json=download_data, headers=download_headers, timeout=30)
-                    
-                    # 200 y 201 son respuestas exitosas
-                    if response.status_code in [200, 201]:
-                        result = response.json()
-                        base64_data = result.get('base64')
-                        
-                        if base64_data:
-                            # Obtener el tipo MIME (por defecto jpeg)
-                            mime_type = image_msg.get('mimetype', 'image/jpeg')
-                            
-                            # Limpiar el base64 (remover espacios, saltos de línea, prefijos, etc)
-                            base64_data = base64_data.replace('\n', '').replace('\r', '').replace(' ', '').strip()
-                            
-                            # Remover cualquier prefijo de data URL si existe
-                            if 'base64,' in base64_data:
-                                base64_data = base64_data.split('base64,')[1]
-                            
-                            # Convertir a URL de datos para OpenAI
-                            image_url = f"data:{mime_type};base64,{base64_data}"
-                            print(f"✅ Imagen descargada y convertida a base64 ({len(base64_data)} caracteres)")
-                        else:
-                            print("❌ No se obtuvo base64 de la imagen")
-                    else:
-                        print(f"❌ Error descargando imagen: {response.status_code} - {response.text[:200]}...")
-                        
-                except Exception as e:
-                    print(f"❌ Error procesando imagen: {e}")
-                    import traceback
-                    traceback.print_exc()
-                
-                print(f"Imagen procesada - Caption: {caption}, Base64: {'Sí' if image_url and 'base64' in image_url else 'No'}")
-            
-            # Procesar si hay contenido (texto o imagen)
-            if (text or image_url) and phone_number:
-                print(f"Procesando mensaje de {phone_number}")
-                
-                # Si hay imagen pero no hay texto, usar un prompt por defecto
-                if image_url and not text:
-                    text = "¿Qué hay en esta imagen?"
-                    print("Imagen sin caption, usando prompt por defecto")
-                
-                # Detectar si es un saludo
-                es_saludo = is_greeting(text)
-                
-                # Detectar si es una solicitud de imagen
-                es_solicitud_imagen = is_image_request(text)
-                print(f"📋 Análisis del mensaje - Saludo: {es_saludo}, Solicitud imagen: {es_solicitud_imagen}, Texto: {text[:50] if text else 'None'}...")
-                
-                # Verificar si es un usuario nuevo (primera interacción en esta sesión)
-                is_new_user = phone_number not in user_sessions
-                
-                if is_new_user:
-                    print(f"Nuevo usuario en esta sesión: {phone_number}")
-                    user_sessions[phone_number] = True
-                
-                # PRIMERO: Si es solicitud de imagen, procesarla directamente (sin bienvenida)
-                if es_solicitud_imagen:
-                    print(f"🎨 Solicitud de imagen detectada: {text}")
-                    
-                    # Enviar mensaje de espera
-                    send_whatsapp_message(phone_number, "Dame un momento, estoy creando tu imagen... 🎨")
-                    
-                    # Generar la imagen
-                    generated_image_url = generate_image(text)
-                    
-                    if generated_image_url:
-                        # Enviar la imagen generada
-                        send_whatsapp_image(phone_number, generated_image_url, "¡Aquí está tu imagen! ✨")
-                    else:
-                        send_whatsapp_message(phone_number, "Lo siento, no pude generar la imagen. ¿Podrías intentar con otra descripción?")
-                    
-                    return jsonify({
-                        "status": "success",
-                        "message": "Imagen generada y enviada",
-                        "image_request": True
-                    }), 200
-                
-                # SEGUNDO: Si es solo un saludo simple, enviar bienvenida
-                if es_saludo and not image_url:
-                    print(f"Enviando mensaje de bienvenida (saludo detectado)")
-                    send_welcome_message(phone_number)
-                    return jsonify({
-                        "status": "success",
-                        "message": "Mensaje de bienvenida enviado",
-                        "had_image": False,
-                        "greeting": True
-                    }), 200
-                
-                if image_url:
-                    print(f"Procesando con imagen: {image_url[:100]}...")
-                
-                try:
-                    # Obtiene respuesta de ChatGPT (con o sin imagen)
-                    chatgpt_response = get_chatgpt_response(text, phone_number, image_url)
-                    
-                    # Envía respuesta por WhatsApp
-                    send_whatsapp_message(phone_number, chatgpt_response)
-                    
-                except Exception as e:
-                    print(f"Error procesando mensaje: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    
-                    # Enviar mensaje de error más específico
-                    if image_url:
-                        error_msg = "Disculpa, tuve un problema procesando la imagen. ¿Podrías agregar un texto describiendo qué necesitas de la imagen?"
-                    else:
-                        error_msg = "Disculpa, hubo un error procesando tu mensaje. ¿Podrías intentar de nuevo?"
-                    
-                    send_whatsapp_message(phone_number, error_msg)
-                
+            if message_coalescer:
+                # Esperar a que el usuario termine de escribir antes de llamar al modelo
+                # (con la cola persistente el mensaje queda guardado mientras tanto)
+                held_id = message_queue.hold({"message_data": message_data})
+                buffered = message_coalescer.add(phone_number, {"message_data": message_data, "held_id": held_id})
                 return jsonify({
-                    "status": "success",
-                    "message": "Respuesta enviada",
-                    "had_image": image_url is not None,
-                    "new_user": is_new_user
+                    "status": "buffered",
+                    "message": "Mensaje agrupado",
+                    "buffered_messages": buffered
                 }), 200
+            
+            if not message_queue.submit({"message_data": message_data}):
+                # Cola llena: pedir a Evolution que reintente más tarde (y aceptar ese reintento)
+                delivery_deduper.forget(phone_number, message_id)
+                webhook_log.warning('webhook.queue_full', chat=phone_number, queue_depth=message_queue.depth())
+                return jsonify({"status": "busy", "message": "Cola llena, reintentar"}), 503
+            
+            return jsonify({
+                "status": "queued",
+                "message": "Mensaje encolado",
+                "queue_depth": message_queue.depth()
+            }), 200
         
         return jsonify({"status": "ok"}), 200
         
     except Exception as e:
-        print(f"Error en webhook: {e}")
+        webhook_log.error('webhook.error', exc_info=True, error=str(e))
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/media/<name>', methods=['GET'])
+def get_media(name):
+    """Sirve una imagen del almacén local (el nombre es su hash: se puede cachear para siempre)"""
+    path = media_store.path(name)
+    if not path:
+        return jsonify({"error": "Imagen no encontrada"}), 404
+    return send_file(path, mimetype=media_store.mimetype(name), max_age=31536000, conditional=True)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas en formato Prometheus (de todos los workers de gunicorn)"""
+    if not metrics.enabled:
+        return jsonify({"error": "prometheus_client no está instalado"}), 503
+    update_metric_gauges()
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type)
+
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint para verificar que el servidor está funcionando"""
-    return jsonify({"status": "healthy"}), 200
+    return jsonify({
+        "status": "healthy",
+        "sessions": session_store.footprint(),
+        "history": history_window.stats(),
+        "faq_cache": faq_cache.stats() if faq_cache else None,
+        "greetings": greeting_pool.stats(),
+        "llm": text_router.stats(),
+        "logs": logs.stats(),
+        "queue": message_queue.stats(),
+        "image_jobs": image_jobs.stats(),
+        "media": media_store.stats(),
+        "passwords": password_hasher.stats()
+    }), 200
 
 # ============================================
 # API PARA APP MÓVIL
 # ============================================
 
+def sse_event(event, data):
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+IMAGE_BUSY_MESSAGE = "Estoy creando muchas imágenes en este momento. Intenta de nuevo en unos minutos 🙏"
+
+def image_job_response(state):
+    """Respuesta de un job de imagen para la app (mismo formato que las respuestas de /api/chat)"""
+    if state['status'] == 'done':
+        return {"type": "image", "image_url": public_media_url(state['result']), "caption": "¡Aquí está tu imagen! ✨"}
+    return {"type": "text", "message": "Lo siento, no pude generar la imagen. ¿Podrías intentar con otra descripción?"}
+
+def image_job_accepted(job):
+    """Respuesta inmediata a una solicitud de imagen: el cliente consulta status_url"""
+    return {
+        "type": "image_job",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "message": "Dame un momento, estoy creando tu imagen... 🎨"
+    }
+
+def chat_event_stream(message, user_id, es_solicitud_imagen):
+    """Genera los eventos SSE de /api/chat/stream: 'delta' con cada fragmento y 'done' al final
+    
+    Las imágenes no se esperan en el stream (un worker sync quedaría ocupado hasta
+    que termine Prodia): se envía un evento 'job' y el cliente consulta /api/jobs/<id>.
+    """
+    try:
+        if es_solicitud_imagen:
+            job = image_jobs.submit(message, user_id)
+            if not job:
+                yield sse_event('error', {"message": IMAGE_BUSY_MESSAGE})
+                return
+            yield sse_event('job', image_job_accepted(job))
+            return
+        
+        parts = []
+        for delta in stream_chatgpt_response(message, user_id):
+            parts.append(delta)
+            yield sse_event('delta', {"text": delta})
+        
+        yield sse_event('done', {"type": "text", "message": ''.join(parts)})
+    except Exception as e:
+        print(f"❌ Error en streaming de /api/chat: {e}")
+        import traceback
+        traceback.print_exc()
+        yield sse_event('error', {"message": CHAT_ERROR_MESSAGE})
+
 @app.route('/api/chat', methods=['POST'])
+@app.route('/api/chat/stream', methods=['POST'])
 @optional_auth
 def api_chat():
-    """Endpoint para la app móvil - recibe mensajes y responde"""
+    """Endpoint para la app móvil - recibe mensajes y responde
+    
+    Con /api/chat/stream o 'Accept: text/event-stream' la respuesta se envía como
+    Server-Sent Events a medida que el modelo la genera.
+    """
     try:
         data = request.json
         message = data.get('message', '')
@@ -934,25 +1337,34 @@ def api_chat():
             return jsonify({"error": "Mensaje vacío"}), 400
         
         # Detectar si es solicitud de imagen
-        es_solicitud_imagen = is_image_request(message)
+        intent = classify_intent(message)
+        metrics.count_intent(intent.name, 'app')
+        es_solicitud_imagen = intent.is_image_request
+        
+        # Modo streaming (opcional)
+        wants_stream = (
+            request.path.endswith('/stream')
+            or request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
+        )
+        if wants_stream:
+            return Response(
+                stream_with_context(chat_event_stream(message, user_id, es_solicitud_imagen)),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'  # Evitar que un proxy acumule los eventos
+                }
+            )
         
         if es_solicitud_imagen:
             print(f"🎨 App - Solicitud de imagen detectada")
             
-            # Generar imagen
-            image_url = generate_image(message)
+            # Generar en segundo plano y responder de inmediato con el job_id
+            job = image_jobs.submit(message, user_id)
+            if not job:
+                return jsonify({"type": "text", "message": IMAGE_BUSY_MESSAGE}), 503
             
-            if image_url:
-                return jsonify({
-                    "type": "image",
-                    "image_url": image_url,
-                    "caption": "¡Aquí está tu imagen! ✨"
-                }), 200
-            else:
-                return jsonify({
-                    "type": "text",
-                    "message": "Lo siento, no pude generar la imagen. ¿Podrías intentar con otra descripción?"
-                }), 200
+            return jsonify(image_job_accepted(job)), 202
         
         # Respuesta de texto normal
         response = get_chatgpt_response(message, user_id, None)
@@ -968,6 +1380,30 @@ def api_chat():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@optional_auth
+def api_job_status(job_id):
+    """Estado de un job de imagen. Con ?wait=N espera hasta N segundos a que termine (long-poll)"""
+    try:
+        wait = min(max(request.args.get('wait', 0, type=float), 0), IMAGE_JOB_MAX_WAIT)
+        state = image_jobs.wait(job_id, wait) if wait else image_jobs.get(job_id)
+        
+        # El job_id es aleatorio; los jobs de usuarios autenticados además solo los ve su dueño
+        if state and state['owner'].startswith('user_'):
+            if not request.current_user or state['owner'] != f"user_{request.current_user['id']}":
+                state = None
+        if not state:
+            return jsonify({"error": "Job no encontrado"}), 404
+        
+        response = {"job_id": state['job_id'], "status": state['status']}
+        if state['status'] in IMAGE_JOB_FINISHED:
+            response.update(image_job_response(state))
+        return jsonify(response), 200
+        
+    except Exception as e:
+        print(f"❌ Error en /api/jobs: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/chat/image', methods=['POST'])
 @optional_auth
 def api_chat_image():
@@ -988,8 +1424,10 @@ def api_chat_image():
             user_id = data.get('user_id', 'guest_user')
             print(f"📱 App - Imagen de invitado ({user_id})")
         
-        # Crear URL de datos para OpenAI
-        image_url = f"data:image/jpeg;base64,{image_base64}"
+        # Crear URL de datos para OpenAI (reducida al presupuesto de visión)
+        image_url = vision_pipeline.to_data_url(image_base64)
+        if not image_url:
+            return jsonify({"error": "Imagen inválida"}), 400
         
         # Procesar con GPT-4o Vision
         response = get_chatgpt_response(caption, user_id, image_url)
@@ -1026,35 +1464,17 @@ def register():
         if not name:
             return jsonify({"error": "El nombre es requerido"}), 400
         
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Error de conexión"}), 500
-        
-        cur = conn.cursor()
+        # Hash antes de pedir conexión: no retener una conexión del pool mientras se calcula
+        try:
+            password_hash = hash_password(password)
+        except PasswordHasherBusy:
+            return auth_busy_response()
         
-        # Verificar si el email ya existe
-        cur.execute('SELECT id FROM users WHERE email = %s', (email,))
-        if cur.fetchone():
-            cur.close()
-            conn.close()
+        # Usuario y token de sesión en una sola sentencia (sin consultar antes si el email existe)
+        created = auth_repository.register(email, password_hash, name)
+        if not created:
             return jsonify({"error": "Este email ya está registrado"}), 409
-        
-        # Crear usuario
-        password_hash = hash_password(password)
-        cur.execute('''
-            INSERT INTO users (email, password_hash, name)
-            VALUES (%s, %s, %s)
-            RETURNING id, email, name
-        ''', (email, password_hash, name))
-        
-        user = cur.fetchone()
-        conn.commit()
-        
-        # Crear token de sesión
-        token = create_auth_token(user['id'])
-        
-        cur.close()
-        conn.close()
+        user, token = created
         
         print(f"✅ Usuario registrado: {email}")
         
@@ -1069,6 +1489,8 @@ def register():
             "token": token
         }), 201
         
+    except DatabaseUnavailable:
+        return jsonify({"error": "Error de conexión"}), 500
     except Exception as e:
         print(f"❌ Error en registro: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1084,40 +1506,24 @@ def login():
         if not email or not password:
             return jsonify({"error": "Email y contraseña requeridos"}), 400
         
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Error de conexión"}), 500
-        
-        cur = conn.cursor()
-        
         # Buscar usuario
-        cur.execute('''
-            SELECT id, email, name, password_hash, profile_picture
-            FROM users WHERE email = %s AND is_active = TRUE
-        ''', (email,))
+        user = auth_repository.find_login_user(email)
         
-        user = cur.fetchone()
+        # Verificar contraseña fuera de la conexión (sin usuario se gasta el mismo tiempo igual)
+        try:
+            valid, new_hash = verify_password(password, user['password_hash'] if user else None)
+        except PasswordHasherBusy:
+            return auth_busy_response()
         
-        if not user:
-            cur.close()
-            conn.close()
+        if not user or not valid:
             return jsonify({"error": "Credenciales incorrectas"}), 401
         
-        # Verificar contraseña
-        if not user['password_hash'] or not verify_password(password, user['password_hash']):
-            cur.close()
-            conn.close()
+        # Último login, hash nuevo (si cambió el formato o el costo) y token en una sola sentencia
+        token = auth_repository.complete_login(user['id'], new_hash)
+        if not token:
             return jsonify({"error": "Credenciales incorrectas"}), 401
-        
-        # Actualizar último login
-        cur.execute('UPDATE users SET last_login = NOW() WHERE id = %s', (user['id'],))
-        conn.commit()
-        
-        # Crear token
-        token = create_auth_token(user['id'])
-        
-        cur.close()
-        conn.close()
+        if new_hash:
+            auth_log.info('auth.password_rehashed', user_id=user['id'], iterations=PASSWORD_HASH_ITERATIONS)
         
         print(f"✅ Login exitoso: {email}")
         
@@ -1132,6 +1538,8 @@ def login():
             "token": token
         }), 200
         
+    except DatabaseUnavailable:
+        return jsonify({"error": "Error de conexión"}), 500
     except Exception as e:
         print(f"❌ Error en login: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1167,54 +1575,8 @@ def google_auth():
         if not email:
             return jsonify({"error": "No se pudo obtener el email de Google"}), 400
         
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Error de conexión"}), 500
-        
-        cur = conn.cursor()
-        
-        # Buscar usuario existente por google_id o email
-        cur.execute('''
-            SELECT id, email, name, profile_picture
-            FROM users WHERE google_id = %s OR email = %s
-        ''', (google_id, email))
-        
-        user = cur.fetchone()
-        
-        if user:
-            # Usuario existe, actualizar info de Google
-            cur.execute('''
-                UPDATE users 
-                SET google_id = %s, name = COALESCE(name, %s), 
-                    profile_picture = %s, last_login = NOW()
-                WHERE id = %s
-            ''', (google_id, name, picture, user['id']))
-            user_id = user['id']
-            is_new = False
-        else:
-            # Crear nuevo usuario
-            cur.execute('''
-                INSERT INTO users (email, name, google_id, profile_picture)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id
-            ''', (email, name, google_id, picture))
-            user_id = cur.fetchone()['id']
-            is_new = True
-        
-        conn.commit()
-        
-        # Crear token
-        token = create_auth_token(user_id)
-        
-        # Obtener datos actualizados del usuario
-        cur.execute('''
-            SELECT id, email, name, profile_picture
-            FROM users WHERE id = %s
-        ''', (user_id,))
-        user_data = cur.fetchone()
-        
-        cur.close()
-        conn.close()
+        # Buscar por google_id o email, crear o actualizar y crear el token en una sola sentencia
+        user_data, token, is_new = auth_repository.google_login(google_id, email, name, picture)
         
         print(f"✅ Google auth exitoso: {email} (nuevo: {is_new})")
         
@@ -1230,6 +1592,8 @@ def google_auth():
             "token": token
         }), 200
         
+    except DatabaseUnavailable:
+        return jsonify({"error": "Error de conexión"}), 500
     except Exception as e:
         print(f"❌ Error en Google auth: {e}")
         import traceback
@@ -1243,13 +1607,13 @@ def logout():
     try:
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
         
-        conn = get_db_connection()
-        if conn:
-            cur = conn.cursor()
-            cur.execute('UPDATE auth_tokens SET is_valid = FALSE WHERE token = %s', (token,))
-            conn.commit()
-            cur.close()
-            conn.close()
+        try:
+            auth_repository.revoke_token(token)
+        except DatabaseUnavailable:
+            pass  # Igual se quita del cache local y se avisa a los demás workers
+        
+        # Quitarlo del cache de inmediato para que el token deje de funcionar ya
+        invalidate_cached_token(token)
         
         return jsonify({"success": True, "message": "Sesión cerrada"}), 200
         
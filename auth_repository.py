@@ -0,0 +1,204 @@
+import secrets
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+USER_COLUMNS = 'id, email, name, profile_picture'
+
+
+class DatabaseUnavailable(Exception):
+    """No se pudo obtener una conexión del pool"""
+
+
+class AuthRepository:
+    """Acceso a usuarios y tokens de sesión (PostgreSQL)
+
+    Cada flujo de autenticación es una sola transacción en una sola conexión y, en lo
+    posible, una sola sentencia: el usuario y su token se escriben juntos con CTEs y
+    RETURNING, sin volver a leer lo que se acaba de escribir. Si el flujo falla a la
+    mitad no queda un usuario sin token ni un token a medias.
+    """
+
+    def __init__(self, get_connection, token_days=30):
+        self.get_connection = get_connection  # Context manager que entrega una conexión (o None)
+        self.token_days = token_days
+
+    def init_tables(self):
+        """Crea las tablas de usuarios y tokens si no existen"""
+        with self.get_connection() as conn:
+            if not conn:
+                return False
+            try:
+                cur = conn.cursor()
+
+                # Tabla de usuarios
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS users (
+                        id SERIAL PRIMARY KEY,
+                        email VARCHAR(255) UNIQUE NOT NULL,
+                        password_hash VARCHAR(255),
+                        name VARCHAR(255),
+                        google_id VARCHAR(255) UNIQUE,
+                        profile_picture TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_login TIMESTAMP,
+                        is_active BOOLEAN DEFAULT TRUE
+                    )
+                ''')
+
+                # Tabla de tokens de sesión
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS auth_tokens (
+                        id SERIAL PRIMARY KEY,
+                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                        token VARCHAR(255) UNIQUE NOT NULL,
+                        device_info TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        expires_at TIMESTAMP NOT NULL,
+                        is_valid BOOLEAN DEFAULT TRUE
+                    )
+                ''')
+
+                # Índices para mejor rendimiento
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_users_google_id ON users(google_id)')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_tokens_token ON auth_tokens(token)')
+
+                conn.commit()
+                cur.close()
+                print("✅ Base de datos inicializada correctamente")
+                return True
+            except Exception as e:
+                print(f"❌ Error inicializando DB: {e}")
+                return False
+
+    def register(self, email, password_hash, name, device_info=None):
+        """Crea el usuario y su token en una sentencia. Retorna (usuario, token) o None si el email ya existe"""
+        token, expires_at = self._new_token()
+        row = self._write_one(f'''
+            WITH new_user AS (
+                INSERT INTO users (email, password_hash, name)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (email) DO NOTHING
+                RETURNING {USER_COLUMNS}
+            ), new_token AS (
+                INSERT INTO auth_tokens (user_id, token, device_info, expires_at)
+                SELECT id, %s, %s, %s FROM new_user
+            )
+            SELECT {USER_COLUMNS} FROM new_user
+        ''', (email, password_hash, name, token, device_info, expires_at))
+        return (row, token) if row else None
+
+    def find_login_user(self, email):
+        """Usuario activo con su hash de contraseña (o None)"""
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'''
+                SELECT {USER_COLUMNS}, password_hash
+                FROM users WHERE email = %s AND is_active = TRUE
+            ''', (email,))
+            user = cur.fetchone()
+            cur.close()
+            return user
+
+    def complete_login(self, user_id, new_password_hash=None, device_info=None):
+        """Registra el login (y el hash nuevo, si hay) y crea el token en una sentencia.
+        Retorna el token o None si el usuario ya no está activo"""
+        token, expires_at = self._new_token()
+        row = self._write_one('''
+            WITH touched AS (
+                UPDATE users
+                SET last_login = NOW(), password_hash = COALESCE(%s, password_hash)
+                WHERE id = %s AND is_active = TRUE
+                RETURNING id
+            )
+            INSERT INTO auth_tokens (user_id, token, device_info, expires_at)
+            SELECT id, %s, %s, %s FROM touched
+            RETURNING token
+        ''', (new_password_hash, user_id, token, device_info, expires_at))
+        return row['token'] if row else None
+
+    def google_login(self, google_id, email, name, picture, device_info=None):
+        """Busca por google_id o email, crea o actualiza el usuario y crea el token en una sentencia.
+        Retorna (usuario, token, es_nuevo)"""
+        token, expires_at = self._new_token()
+        params = {
+            "google_id": google_id, "email": email, "name": name, "picture": picture,
+            "token": token, "device_info": device_info, "expires_at": expires_at
+        }
+        row = self._write_one(f'''
+            WITH by_google AS (
+                UPDATE users
+                SET name = COALESCE(name, %(name)s), profile_picture = %(picture)s, last_login = NOW()
+                WHERE google_id = %(google_id)s
+                RETURNING {USER_COLUMNS}, FALSE AS is_new
+            ), by_email AS (
+                -- Sin cuenta de Google vinculada: upsert por email (xmax = 0 solo en filas recién insertadas)
+                INSERT INTO users (email, name, google_id, profile_picture)
+                SELECT %(email)s, %(name)s, %(google_id)s, %(picture)s
+                WHERE NOT EXISTS (SELECT 1 FROM by_google)
+                ON CONFLICT (email) DO UPDATE
+                SET google_id = EXCLUDED.google_id, name = COALESCE(users.name, EXCLUDED.name),
+                    profile_picture = EXCLUDED.profile_picture, last_login = NOW()
+                RETURNING {USER_COLUMNS}, (xmax = 0) AS is_new
+            ), account AS (
+                SELECT * FROM by_google UNION ALL SELECT * FROM by_email
+            ), new_token AS (
+                INSERT INTO auth_tokens (user_id, token, device_info, expires_at)
+                SELECT id, %(token)s, %(device_info)s, %(expires_at)s FROM account
+            )
+            SELECT * FROM account
+        ''', params)
+        user = dict(row)
+        is_new = user.pop('is_new')
+        return user, token, is_new
+
+    def find_token_user(self, token):
+        """Usuario dueño de un token válido, con los segundos que le quedan al token (o None)"""
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT u.id, u.email, u.name, u.profile_picture, u.google_id,
+                       EXTRACT(EPOCH FROM (t.expires_at - NOW())) AS expires_in
+                FROM auth_tokens t
+                JOIN users u ON t.user_id = u.id
+                WHERE t.token = %s
+                AND t.is_valid = TRUE
+                AND t.expires_at > NOW()
+                AND u.is_active = TRUE
+            ''', (token,))
+            user = cur.fetchone()
+            cur.close()
+            return user
+
+    def revoke_token(self, token):
+        self._execute('UPDATE auth_tokens SET is_valid = FALSE WHERE token = %s', (token,))
+
+    def deactivate_user(self, user_id):
+        self._execute('UPDATE users SET is_active = FALSE WHERE id = %s', (user_id,))
+
+    def _new_token(self):
+        return secrets.token_urlsafe(32), datetime.now() + timedelta(days=self.token_days)
+
+    @contextmanager
+    def _connection(self):
+        """Como get_connection(), pero sin conexión lanza DatabaseUnavailable en vez de entregar None"""
+        with self.get_connection() as conn:
+            if not conn:
+                raise DatabaseUnavailable("Error de conexión")
+            yield conn
+
+    def _write_one(self, query, params):
+        """Ejecuta una sentencia de escritura, confirma y retorna la primera fila (o None)"""
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+            return row
+
+    def _execute(self, query, params):
+        with self._connection() as conn:
+            conn.execute(query, params)
+            conn.commit()
+
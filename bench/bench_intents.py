@@ -0,0 +1,93 @@
+"""Corpus dorado y micro-benchmark del clasificador de intención
+
+Uso (desde la raíz del repo):
+    python bench/bench_intents.py
+
+1. Verifica que intents.classify() da las mismas decisiones que el corpus
+   (bench/intent_corpus.json), generado con la implementación original.
+2. Compara el tiempo por mensaje contra la implementación original.
+3. Mide cómo cambia el costo al agregar cientos de frases nuevas.
+"""
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import intents  # noqa: E402
+from legacy_intents import is_greeting, is_image_request  # noqa: E402
+
+
+def load_corpus():
+    with open(os.path.join(BENCH_DIR, 'intent_corpus.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def check_corpus(corpus):
+    """Retorna los casos donde el clasificador no coincide con lo esperado"""
+    failures = []
+    for case in corpus:
+        result = intents.classify(case['text'])
+        got = (result.is_greeting, result.is_image_request)
+        expected = (case['greeting'], case['image_request'])
+        if got != expected:
+            failures.append((case['text'], expected, got))
+    return failures
+
+
+def per_message_us(func, texts, repeat=5):
+    """Microsegundos por mensaje (mejor de varias corridas)"""
+    number = max(1, 20000 // len(texts))
+    best = min(timeit.repeat(lambda: [func(t) for t in texts], number=number, repeat=repeat))
+    return best / (number * len(texts)) * 1e6
+
+
+def legacy_classify(text):
+    return is_greeting(text), is_image_request(text)
+
+
+def random_phrases(count, seed=7):
+    rnd = random.Random(seed)
+    return [
+        ' '.join(''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 9))) for _ in range(rnd.randint(1, 3)))
+        for _ in range(count)
+    ]
+
+
+def main():
+    corpus = load_corpus()
+    failures = check_corpus(corpus)
+    print(f"Corpus: {len(corpus)} mensajes, {len(failures)} diferencias")
+    for text, expected, got in failures:
+        print(f"  ❌ {text!r}: esperado {expected}, obtenido {got}")
+
+    texts = [case['text'] for case in corpus]
+    legacy = per_message_us(legacy_classify, texts)
+    compiled = per_message_us(intents.classify, texts)
+    print(f"Original (listas):  {legacy:.2f} µs/mensaje")
+    print(f"Compilado (regex):  {compiled:.2f} µs/mensaje ({legacy / compiled:.1f}x)")
+
+    # Escalabilidad: el mismo corpus con cientos de frases extra en cada categoría
+    for extra in (0, 200, 1000):
+        matcher = intents.IntentMatcher({
+            intents.FUERTE: intents.TRIGGERS_IMAGEN_FUERTES + random_phrases(extra, seed=1),
+            intents.ACCION: intents.PALABRAS_ACCION,
+            intents.IMAGEN: intents.PALABRAS_IMAGEN,
+            intents.EXCLUSION: intents.EXCLUSIONES + random_phrases(extra, seed=2),
+            intents.PERSONA_INICIO: intents.PATRONES_PERSONA,
+            intents.AMBIGUO_INICIO: intents.PREFIJOS_AMBIGUOS,
+            intents.SALUDO_INICIO: intents.PREFIJOS_SALUDO,
+        })
+        cost = per_message_us(lambda t: matcher.scan(t.lower().strip()), texts)
+        print(f"  +{extra * 2:>4} frases: {cost:.2f} µs/mensaje ({len(matcher.categories)} frases en total)")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Servidores locales que imitan a Evolution API, OpenAI/xAI, Prodia y la API de tasas
+
+Solo para pruebas de carga (bench/loadtest.py): responden con latencia configurable
+y sin gastar créditos. Usan solo la librería estándar.
+"""
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# JPEG real de 64x64 (lo que devuelven Prodia y la descarga de media de Evolution)
+SAMPLE_JPEG = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAoHBwgHBgoICAgLCgoLDhgQDg0NDh0VFhEYIx8lJCIfIiEmKzcvJik0KSEiMEEx'
+    'NDk7Pj4+JS5ESUM8SDc9Pjv/2wBDAQoLCw4NDhwQEBw7KCIoOzs7Ozs7Ozs7Ozs7Ozs7Ozs7Ozs7Ozs7Ozs7Ozs7Ozs7Ozs7'
+    'Ozs7Ozs7Ozs7Ozs7Ozv/wAARCABAAEADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAA'
+    'AgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6'
+    'Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXG'
+    'x8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREA'
+    'AgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5'
+    'OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPE'
+    'xcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDmqKKK+2PWCiiigAooooAKKKKACiiigAoo'
+    'ooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKAP//Z'
+)
+
+REPLY_WORDS = (
+    "Claro, con gusto te ayudo. Aquí tienes una explicación clara y ordenada del tema que "
+    "me preguntas, con los puntos más importantes y un ejemplo práctico al final."
+).split()
+
+
+class FakeConfig:
+    """Latencias (segundos) y comportamiento de los servicios simulados"""
+
+    def __init__(self, llm_latency=0.8, llm_jitter=0.3, llm_error_rate=0.0, stream_chunks=20,
+                 reply_words=120, prodia_latency=3.0, evolution_latency=0.05, media_latency=0.2):
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.llm_error_rate = llm_error_rate
+        self.stream_chunks = stream_chunks
+        self.reply_words = reply_words
+        self.prodia_latency = prodia_latency
+        self.evolution_latency = evolution_latency
+        self.media_latency = media_latency
+
+
+class FakeServices:
+    """Levanta un solo servidor HTTP con las rutas de todos los proveedores simulados
+
+    on_send(number, kind) se llama con cada mensaje que la app envía por Evolution
+    (kind = 'text' o 'media'): así la prueba sabe cuándo terminó cada turno.
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0, on_send=None):
+        self.config = config or FakeConfig()
+        self.on_send = on_send
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def env(self):
+        """Variables de entorno para que la app use estos servidores"""
+        return {
+            "EVOLUTION_API_URL": f"{self.url}/evolution",
+            "EVOLUTION_API_KEY": "bench",
+            "INSTANCE_NAME": "bench",
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{self.url}/openai/v1",
+            "XAI_API_KEY": "bench",
+            "XAI_BASE_URL": f"{self.url}/xai/v1",
+            "PRODIA_API_KEY": "bench",
+            "PRODIA_API_URL": f"{self.url}/prodia/v2/job",
+            "EXCHANGE_RATES_URL": f"{self.url}/rates/v4/latest/USD"
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass  # Sin ruido en la consola
+
+            def do_GET(self):
+                if self.path.startswith('/rates/'):
+                    services._count('rates')
+                    return self._json({
+                        "base": "USD",
+                        "date": time.strftime('%Y-%m-%d'),
+                        "rates": {"EUR": 0.92, "COP": 4100.5, "MXN": 17.1}
+                    })
+                self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                path = self.path
+
+                if path.startswith('/evolution/message/sendText/'):
+                    return self._evolution_send(body, 'text')
+                if path.startswith('/evolution/message/sendMedia/'):
+                    return self._evolution_send(body, 'media')
+                if path.startswith('/evolution/chat/getBase64FromMediaMessage/'):
+                    services._count('evolution.download')
+                    time.sleep(services.config.media_latency)
+                    return self._json({"base64": base64.b64encode(SAMPLE_JPEG).decode('ascii'), "mimetype": "image/jpeg"})
+                if path.endswith('/chat/completions'):
+                    return self._chat_completion(body, provider=path.split('/')[1])
+                if path.startswith('/prodia/'):
+                    services._count('prodia')
+                    time.sleep(services.config.prodia_latency)
+                    return self._raw(SAMPLE_JPEG, 'image/jpeg')
+                self._json({"error": "not found"}, 404)
+
+            def _evolution_send(self, body, kind):
+                services._count(f"evolution.{kind}")
+                time.sleep(services.config.evolution_latency)
+                self._json({"key": {"id": f"BENCH{random.getrandbits(40):X}"}, "status": "PENDING"}, 201)
+                if services.on_send:
+                    services.on_send(body.get('number'), kind)
+
+            def _chat_completion(self, body, provider):
+                config = services.config
+                services._count(f"{provider}.chat")
+                time.sleep(max(0.0, random.gauss(config.llm_latency, config.llm_jitter)))
+
+                if random.random() < config.llm_error_rate:
+                    services._count(f"{provider}.error")
+                    return self._json({"error": {"message": "fake overload", "type": "server_error"}}, 503)
+
+                words = [random.choice(REPLY_WORDS) for _ in range(min(config.reply_words, body.get('max_tokens') or 4000))]
+                text = ' '.join(words)
+                base = {"id": f"chatcmpl-{random.getrandbits(48):x}", "created": int(time.time()), "model": body.get('model')}
+
+                if not body.get('stream'):
+                    return self._json(dict(base, object="chat.completion", choices=[{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop"
+                    }], usage={"prompt_tokens": 100, "completion_tokens": len(words), "total_tokens": 100 + len(words)}))
+
+                # Streaming: fragmentos SSE repartidos en el tiempo
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                size = max(1, len(words) // config.stream_chunks)
+                for i in range(0, len(words), size):
+                    chunk = dict(base, object="chat.completion.chunk", choices=[{
+                        "index": 0, "delta": {"content": ' '.join(words[i:i + size]) + ' '}, "finish_reason": None
+                    }])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    time.sleep(0.01)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def _json(self, data, status=200):
+                self._raw(json.dumps(data).encode('utf-8'), 'application/json', status)
+
+            def _raw(self, payload, content_type, status=200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
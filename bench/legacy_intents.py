@@ -0,0 +1,100 @@
+"""Implementación original (listas de palabras) de la detección de intención, usada como referencia"""
+
+
+def is_image_request(text):
+    """Detecta si el usuario está pidiendo generar una imagen"""
+    if not text:
+        return False
+    
+    texto_lower = text.lower().strip()
+    
+    # PRIMERO: Detectar frases que CLARAMENTE son solicitudes de imagen
+    triggers_imagen_fuertes = [
+        'genera una imagen', 'generar una imagen', 'generame una imagen', 'genérame una imagen',
+        'genera la imagen', 'generar la imagen', 'generame la imagen', 'genérame la imagen',
+        'crea una imagen', 'crear una imagen', 'creame una imagen', 'créame una imagen',
+        'genera una foto', 'crea una foto', 'hazme una foto',
+        'genera un logo', 'crea un logo', 'genera un logotipo', 'crea un logotipo',
+        'dibuja', 'dibújame', 'dibujar',
+        'hazme una imagen', 'haz una imagen',
+        'hazme un dibujo', 'haz un dibujo',
+        'quiero una imagen', 'necesito una imagen',
+        'genera un dibujo', 'crea un dibujo',
+        'genera imagen', 'crear imagen', 'generar imagen',
+        'dibujame', 'dibújame',
+        'crea img', 'genera img', 'haz img'
+    ]
+    
+    for trigger in triggers_imagen_fuertes:
+        if trigger in texto_lower:
+            return True
+    
+    # Patrones para personas/personajes (genera a X, dibuja a Y)
+    patrones_persona = [
+        'genera a ', 'crea a ', 'dibuja a ', 'hazme a ', 'haz a ',
+        'generame a ', 'genérame a ', 'creame a ', 'créame a ',
+        'dibujame a ', 'dibújame a '
+    ]
+    
+    for patron in patrones_persona:
+        if texto_lower.startswith(patron):
+            return True
+    
+    # Patrones: acción + palabra de imagen
+    palabras_accion = ['genera', 'crea', 'haz', 'hazme', 'dibuja']
+    palabras_imagen = ['imagen', 'dibujo', 'foto', 'ilustración', 'ilustracion', 'img', 'retrato', 'logo', 'logotipo']
+    
+    for accion in palabras_accion:
+        for imagen in palabras_imagen:
+            if accion in texto_lower and imagen in texto_lower:
+                return True
+    
+    # Si NO es claramente imagen, verificar exclusiones para otros patrones
+    exclusiones = [
+        'texto', 'codigo', 'código', 'programa', 'script', 'lista', 
+        'resumen', 'ensayo', 'documento', 'archivo', 'email', 'correo',
+        'mensaje', 'respuesta', 'explicación', 'explicacion', 'plan',
+        'receta', 'horario', 'tabla', 'excel', 'pdf', 'word',
+        'funcion', 'función', 'variable', 'clase', 'método', 'metodo',
+        'párrafo', 'parrafo', 'oracion', 'oración', 'frase', 'historia',
+        'cuento', 'poema', 'canción', 'cancion', 'letra', 'análisis', 'analisis',
+        'informe', 'reporte', 'carta', 'nota', 'apunte', 'tarea',
+        'pregunta', 'quiz', 'examen', 'ejercicio', 'problema de',
+        'sorteo', 'número', 'numero', 'aleatorio', 'random', 'simulacion', 'simulación'
+    ]
+    
+    # Solo aplicar exclusiones si el mensaje empieza con "genera un/una" sin palabra de imagen
+    if texto_lower.startswith(('genera un ', 'genera una ', 'crea un ', 'crea una ')):
+        for excl in exclusiones:
+            if excl in texto_lower:
+                return False
+        # Si no hay exclusión y empieza con genera/crea, probablemente es imagen
+        return True
+    
+    return False
+
+
+def is_greeting(text):
+    """Detecta si el mensaje es un saludo"""
+    if not text:
+        return False
+    
+    saludos = [
+        'hola', 'hi', 'hello', 'buenas', 'buenos días', 'buenos dias', 
+        'buenas tardes', 'buenas noches', 'hey', 'ey', 'alo', 'aló',
+        'que tal', 'qué tal', 'saludos', 'buenas buenas'
+    ]
+    
+    texto_limpio = text.lower().strip()
+    
+    # Verificar si es exactamente un saludo
+    if texto_limpio in saludos:
+        return True
+    
+    # Verificar si empieza con un saludo común
+    for saludo in ['hola', 'buenas', 'buenos', 'hey', 'hi']:
+        if texto_limpio.startswith(saludo) and len(texto_limpio) < 20:
+            return True
+    
+    return False
+
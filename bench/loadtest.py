@@ -0,0 +1,371 @@
+"""Prueba de carga sin servicios externos (Evolution, OpenAI/xAI, Prodia y tasas simulados)
+
+Uso (desde la raíz del repo):
+    python bench/loadtest.py
+    python bench/loadtest.py --requests 500 --concurrency 32 --llm-latency 1.5
+    python bench/loadtest.py --fakes-only          # solo levanta los simulados e imprime el entorno
+    python bench/loadtest.py --target http://127.0.0.1:5000 --fakes-port 8900
+
+1. Levanta bench/fake_services.py con la latencia indicada.
+2. Sin --target importa app.py en este proceso (apuntando a los simulados, sin
+   DATABASE_URL) y lo sirve con werkzeug. Con --target se prueba una app ya
+   corriendo (p. ej. gunicorn) que debe arrancarse con las variables que imprime
+   --fakes-only.
+3. Envía una mezcla de intenciones (saludo, chat, FAQ, imagen, visión) por
+   /webhook, /api/chat y /api/chat/stream. En /webhook el tiempo va hasta que
+   Evolution (simulado) recibe la respuesta final; en /api/chat hasta que termina
+   el job de imagen; en /api/chat/stream se mide además el primer evento SSE.
+4. Reporta throughput y p50/p95/p99 por endpoint e intención.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import FakeConfig, FakeServices  # noqa: E402
+
+MESSAGES = {
+    'greeting': ["hola", "buenas", "hola buenos días", "hey qué tal"],
+    'chat': [
+        "explícame cómo funciona la fotosíntesis",
+        "dame tres ideas de regalo para mi mamá",
+        "cuánto es el 15% de 240000?",
+        "escríbeme un correo para pedir una cita médica",
+        "cómo está el dólar hoy?"
+    ],
+    'faq': ["cuál es su instagram?", "quién te creó?", "cuál es la página web de navros?"],
+    'image': ["genera una imagen de un gato astronauta", "dibuja un paisaje de montañas al atardecer"],
+    'vision': ["qué hay en esta foto?", "describe esta imagen", ""]
+}
+# Mezcla por defecto (pesos relativos), parecida al tráfico real
+DEFAULT_MIX = "greeting=15,chat=50,faq=15,image=10,vision=10"
+# Visión solo existe por WhatsApp (en la app es /api/chat/image, fuera de esta prueba)
+ENDPOINT_INTENTS = {
+    'webhook': ('greeting', 'chat', 'faq', 'image', 'vision'),
+    'chat': ('greeting', 'chat', 'faq', 'image'),
+    'stream': ('greeting', 'chat', 'faq', 'image')
+}
+
+
+class Recorder:
+    """Latencias y errores por (endpoint, intención)"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def ok(self, key, seconds):
+        with self._lock:
+            self.samples.setdefault(key, []).append(seconds)
+
+    def error(self, key, reason):
+        with self._lock:
+            self.errors.setdefault(key, {}).setdefault(reason, 0)
+            self.errors[key][reason] += 1
+
+
+class DeliveryTracker:
+    """Recibe los envíos de Evolution (simulado) y avisa cuando llegó la respuesta final de cada chat"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def expect(self, number, intent):
+        # Las imágenes mandan primero "Dame un momento..." y después la imagen (o un texto de error)
+        state = {"event": threading.Event(), "texts_needed": 2 if intent == 'image' else 1, "kind": None, "at": None}
+        with self._lock:
+            self._pending[number] = state
+        return state
+
+    def on_send(self, number, kind):
+        number = (number or '').split('@')[0]
+        with self._lock:
+            state = self._pending.get(number)
+            if not state:
+                return
+            if kind == 'text':
+                state["texts_needed"] -= 1
+            if kind == 'media' or state["texts_needed"] <= 0:
+                self._pending.pop(number, None)
+                state.update(kind=kind, at=time.perf_counter())
+                state["event"].set()
+
+    def forget(self, number):
+        with self._lock:
+            self._pending.pop(number, None)
+
+
+def post_json(url, payload, timeout):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    return open_json(request, timeout)
+
+
+def open_json(request, timeout):
+    """(status, json) también para respuestas 4xx/5xx"""
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b'{}')
+        except ValueError:
+            return e.code, {}
+
+
+def webhook_payload(number, seq, intent, text):
+    key = {"remoteJid": f"{number}@s.whatsapp.net", "fromMe": False, "id": f"BENCH{seq:010d}"}
+    if intent == 'vision':
+        message = {"imageMessage": {"mimetype": "image/jpeg", "caption": text}}
+    else:
+        message = {"conversation": text}
+    return {
+        "event": "messages.upsert",
+        "instance": "bench",
+        "data": {"key": key, "pushName": "Bench", "message": message, "messageType": next(iter(message)),
+                 "messageTimestamp": int(time.time())}
+    }
+
+
+def run_webhook(target, tracker, recorder, seq, intent, text, timeout):
+    number = f"57300{seq:07d}"
+    key = ('webhook', intent)
+    state = tracker.expect(number, intent)
+    start = time.perf_counter()
+    try:
+        status, body = post_json(f"{target}/webhook", webhook_payload(number, seq, intent, text), timeout)
+    except Exception as e:
+        tracker.forget(number)
+        return recorder.error(key, type(e).__name__)
+
+    if status != 200 or body.get('status') not in ('queued', 'buffered'):
+        tracker.forget(number)
+        return recorder.error(key, f"HTTP {status} {body.get('status', '')}".strip())
+    recorder.ok(('webhook (aceptado)', intent), time.perf_counter() - start)
+    if not state["event"].wait(timeout):
+        tracker.forget(number)
+        return recorder.error(key, 'sin respuesta')
+    if intent == 'image' and state["kind"] != 'media':
+        return recorder.error(key, 'imagen fallida')
+    recorder.ok(key, state["at"] - start)
+
+
+def run_chat(target, recorder, seq, intent, text, timeout):
+    key = ('api/chat', intent)
+    start = time.perf_counter()
+    try:
+        status, body = post_json(f"{target}/api/chat", {"message": text, "user_id": f"bench_{seq}"}, timeout)
+        if status == 202 and body.get('job_id'):
+            status, body = wait_image_job(target, body, start, timeout)
+            if body.get('type') != 'image':
+                return recorder.error(key, f"job {body.get('status')}")
+    except Exception as e:
+        return recorder.error(key, type(e).__name__)
+    if status != 200:
+        return recorder.error(key, f"HTTP {status}")
+    recorder.ok(key, time.perf_counter() - start)
+
+
+def wait_image_job(target, body, start, timeout):
+    """Long-poll del job de imagen hasta que termine. Retorna (status, json) del job"""
+    status = 202
+    while status == 202 or body.get('status') in ('queued', 'running'):
+        if time.perf_counter() - start > timeout:
+            return 504, {"status": "timeout"}
+        request = urllib.request.Request(f"{target}{body.get('status_url') or '/api/jobs/' + body['job_id']}?wait=25")
+        status, body = open_json(request, timeout)
+    return status, body
+
+
+def read_sse(response):
+    """Itera (evento, datos) de una respuesta text/event-stream"""
+    event, data = 'message', []
+    for raw in response:
+        line = raw.decode('utf-8').rstrip('\r\n')
+        if not line:
+            if data:
+                yield event, json.loads('\n'.join(data))
+            event, data = 'message', []
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data.append(line[5:].strip())
+
+
+def run_stream(target, recorder, seq, intent, text, timeout):
+    """/api/chat/stream: tiempo al primer evento (primer fragmento o job de imagen) y al final"""
+    key = ('api/chat/stream', intent)
+    start = time.perf_counter()
+    request = urllib.request.Request(
+        f"{target}/api/chat/stream",
+        data=json.dumps({"message": text, "user_id": f"bench_{seq}"}).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'Accept': 'text/event-stream'}, method='POST'
+    )
+    final = None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            for event, data in read_sse(response):
+                if final is None and event != 'error':
+                    recorder.ok(('stream (1er evento)', intent), time.perf_counter() - start)
+                final = (event, data)
+                if event in ('done', 'job', 'error'):
+                    break
+        if final and final[0] == 'job':
+            status, body = wait_image_job(target, final[1], start, timeout)
+            final = ('done', body) if status == 200 else ('error', body)
+    except urllib.error.HTTPError as e:
+        return recorder.error(key, f"HTTP {e.code}")
+    except Exception as e:
+        return recorder.error(key, type(e).__name__)
+    if not final or final[0] != 'done':
+        return recorder.error(key, final[0] if final else 'sin eventos')
+    recorder.ok(key, time.perf_counter() - start)
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        intent, _, weight = part.partition('=')
+        if intent.strip() in MESSAGES and float(weight or 1) > 0:
+            mix[intent.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def report(recorder, elapsed):
+    print(f"\n{'endpoint':<20} {'intención':<10} {'n':>6} {'err':>5} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    keys = sorted(set(recorder.samples) | set(recorder.errors))
+    totals = {}
+    for key in keys:
+        values = recorder.samples.get(key, [])
+        errors = sum(recorder.errors.get(key, {}).values())
+        totals.setdefault(key[0], [0, 0])
+        totals[key[0]][0] += len(values)
+        totals[key[0]][1] += errors
+        row = f"{key[0]:<20} {key[1]:<10} {len(values):>6} {errors:>5} {len(values) / elapsed:>7.1f}"
+        if values:
+            row += ''.join(f" {percentile(values, p) * 1000:>8.0f}" for p in (0.5, 0.95, 0.99))
+        print(row)
+
+    print()
+    for endpoint, (count, errors) in totals.items():
+        print(f"{endpoint:<20} total {count} ok, {errors} errores, {count / elapsed:.1f} req/s")
+    for key, reasons in sorted(recorder.errors.items()):
+        print(f"  ⚠️ {key[0]} {key[1]}: {reasons}")
+
+
+def start_local_app(fakes, host, port):
+    """Importa app.py apuntando a los simulados y lo sirve en un hilo (threaded, como un worker)"""
+    os.environ.update(fakes.env())
+    os.environ.pop('DATABASE_URL', None)  # Todo en memoria: se mide la app, no Postgres
+    os.environ.setdefault('MEDIA_DIR', tempfile.mkdtemp(prefix='navros-bench-media-'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['PUBLIC_BASE_URL'] = f"http://{host}:{port}"
+
+    from werkzeug.serving import make_server
+    import app as navros
+
+    server = make_server(host, port, navros.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://{host}:{port}", navros
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help="Requests por endpoint")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--endpoints', default='webhook,chat,stream', help="webhook, chat y/o stream")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Pesos por intención (por defecto {DEFAULT_MIX})")
+    parser.add_argument('--llm-latency', type=float, default=0.8)
+    parser.add_argument('--llm-jitter', type=float, default=0.3)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--prodia-latency', type=float, default=3.0)
+    parser.add_argument('--evolution-latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=90)
+    parser.add_argument('--target', help="URL de una app ya corriendo (por defecto se levanta una local)")
+    parser.add_argument('--port', type=int, default=5055, help="Puerto de la app local")
+    parser.add_argument('--fakes-port', type=int, default=0)
+    parser.add_argument('--fakes-only', action='store_true')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    tracker = DeliveryTracker()
+    fakes = FakeServices(FakeConfig(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        llm_error_rate=args.llm_error_rate,
+        prodia_latency=args.prodia_latency,
+        evolution_latency=args.evolution_latency
+    ), port=args.fakes_port, on_send=tracker.on_send).start()
+
+    if args.fakes_only:
+        print(f"Servicios simulados en {fakes.url}. Arrancar la app con:")
+        for name, value in fakes.env().items():
+            print(f"  export {name}={value}")
+        print("(Ctrl+C para terminar)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    navros = None
+    target = args.target.rstrip('/') if args.target else None
+    if not target:
+        target, navros = start_local_app(fakes, '127.0.0.1', args.port)
+    print(f"App: {target} | simulados: {fakes.url} | LLM {args.llm_latency}s±{args.llm_jitter}s, "
+          f"Prodia {args.prodia_latency}s | concurrencia {args.concurrency}")
+
+    rnd = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    recorder = Recorder()
+    seq = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for endpoint in [e.strip() for e in args.endpoints.split(',') if e.strip()]:
+            intents = [intent for intent in ENDPOINT_INTENTS.get(endpoint, ()) if intent in mix]
+            if not intents:
+                continue
+            weights = [mix[intent] for intent in intents]
+            for _ in range(args.requests):
+                seq += 1
+                intent = rnd.choices(intents, weights)[0]
+                text = rnd.choice(MESSAGES[intent])
+                if endpoint == 'webhook':
+                    executor.submit(run_webhook, target, tracker, recorder, seq, intent, text, args.timeout)
+                elif endpoint == 'stream':
+                    executor.submit(run_stream, target, recorder, seq, intent, text or "hola", args.timeout)
+                else:
+                    executor.submit(run_chat, target, recorder, seq, intent, text or "hola", args.timeout)
+    elapsed = time.perf_counter() - start
+
+    report(recorder, elapsed)
+    print(f"\nLlamadas a los simulados: {json.dumps(fakes.counts, sort_keys=True)}")
+    if navros:
+        # Estado interno de la app local (cachés, colas, router) al terminar
+        with navros.app.test_client() as client:
+            health = client.get('/health').get_json() or {}
+        print(f"/health: {json.dumps(health, ensure_ascii=False, default=str)[:2000]}")
+
+
+if __name__ == '__main__':
+    main()
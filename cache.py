@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache LRU en memoria con expiración por tiempo (seguro entre hilos)
+
+    Cada invalidación (pop, pop_where, clear) avanza una generación. Quien lee la
+    fuente fuera del lock toma generation() antes de leer y la pasa a set(): si hubo
+    una invalidación mientras tanto el valor ya puede estar viejo y no se guarda.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Retorna el valor si existe y no ha expirado (lo marca como usado recientemente)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self):
+        """Generación actual (cambia con cada invalidación)"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Guarda un valor; ttl opcional para sobreescribir el TTL por defecto
+
+        generation: la de generation() antes de leer el valor. Si hubo una invalidación
+        desde entonces no se guarda nada. Retorna True si lo guardó.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return False
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+
+            # Expulsar los menos usados recientemente si pasamos el límite
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def add(self, key, value=True, ttl=None):
+        """Guarda el valor solo si la clave no existe (o expiró). Retorna True si lo guardó"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                return False
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def pop(self, key, default=None):
+        """Elimina una entrada y retorna su valor (si existía)"""
+        with self._lock:
+            self._generation += 1
+            item = self._data.pop(key, None)
+            return item[1] if item else default
+
+    def pop_where(self, predicate):
+        """Elimina todas las entradas cuyo valor cumpla la condición. Retorna cuántas eliminó"""
+        with self._lock:
+            self._generation += 1
+            keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Estadísticas básicas del cache"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class MessageCoalescer:
+    """Junta los mensajes seguidos de un mismo chat en un solo turno (debounce por chat)
+
+    Cada mensaje nuevo reinicia la ventana de `window` segundos; cuando el chat queda
+    en silencio (o se llega a `max_wait` desde el primer mensaje) se llama a
+    flush(key, items) una sola vez con todos los mensajes en orden de llegada.
+    La ventana es por proceso: mensajes del mismo chat que lleguen a otro worker
+    de gunicorn forman su propio turno.
+    """
+
+    def __init__(self, flush, window=1.5, max_wait=6.0):
+        self.flush = flush
+        self.window = window
+        self.max_wait = max_wait
+        self._pending = {}  # key -> {"items": [...], "first_at": t, "timer": Timer}
+        self._lock = threading.Lock()
+
+    def add(self, key, item):
+        """Agrega un mensaje al turno del chat. Retorna cuántos mensajes lleva el turno"""
+        with self._lock:
+            pending = self._pending.get(key)
+            now = time.monotonic()
+            if pending is None:
+                pending = {"items": [], "first_at": now, "timer": None}
+                self._pending[key] = pending
+            else:
+                pending["timer"].cancel()
+
+            pending["items"].append(item)
+
+            # Nunca esperar más de max_wait desde el primer mensaje del turno
+            delay = min(self.window, max(0.0, pending["first_at"] + self.max_wait - now))
+            timer = threading.Timer(delay, self._fire, args=(key, pending))
+            timer.daemon = True
+            pending["timer"] = timer
+            timer.start()
+            return len(pending["items"])
+
+    def pending_chats(self):
+        """Cantidad de chats con un turno abierto"""
+        return len(self._pending)
+
+    def drain(self):
+        """Cancela los turnos abiertos y los retorna ({key: items}), por ejemplo al apagar el proceso"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for entry in pending.values():
+            entry["timer"].cancel()
+        return {key: entry["items"] for key, entry in pending.items()}
+
+    def _fire(self, key, pending):
+        with self._lock:
+            # Si otro mensaje reinició la ventana, este timer ya no es el vigente
+            if self._pending.get(key) is not pending or pending["timer"] is not threading.current_thread():
+                return
+            del self._pending[key]
+
+        try:
+            self.flush(key, pending["items"])
+        except Exception as e:
+            print(f"❌ Error entregando mensajes agrupados de {key}: {e}")
@@ -0,0 +1,243 @@
+"""Ventana de historial por presupuesto de tokens, con resumen de los turnos viejos
+
+En vez de "los últimos N mensajes", el prompt lleva los mensajes más recientes que
+quepan en el presupuesto (de más nuevo a más viejo). Los que ya no caben se
+condensan en un resumen que se calcula en segundo plano, fuera del request: el
+turno actual nunca espera al resumen, a lo sumo lo usa en el siguiente.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('o200k_base')
+except Exception:  # tiktoken es opcional: sin él se estima por caracteres
+    _encoding = None
+
+MESSAGE_OVERHEAD = 4  # Tokens de formato por mensaje (rol, separadores)
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    """Tokens aproximados de un texto (exactos con tiktoken)"""
+    if not text:
+        return 0
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Recorta el texto a max_tokens (conserva el principio)"""
+    if max_tokens <= 0:
+        return ''
+    if _encoding:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens]) + '…'
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars] + '…'
+
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD
+
+
+def prompt_message(message):
+    """Solo rol y contenido (el id del historial no va al modelo)"""
+    return {"role": message['role'], "content": message['content']}
+
+
+class HistoryWindow:
+    """Elige qué parte del historial va al prompt y mantiene un resumen de lo anterior
+
+    summarize(resumen_previo, mensajes) -> nuevo resumen. El resumen guarda el id del
+    último mensaje que cubre (los ids de conversation_store crecen con cada mensaje):
+    los mensajes con id mayor, o sin id, son los "no resumidos". Así un texto repetido
+    ("ok", "gracias") no cambia dónde termina el resumen.
+    Con get_connection el resumen se guarda en PostgreSQL y lo comparten los workers.
+    """
+
+    def __init__(self, budget=3000, summarize=None, get_connection=None, workers=1,
+                 cache_size=10000, cache_ttl=1800):
+        self.budget = budget
+        self.summarize = summarize
+        self.get_connection = get_connection  # Context manager que entrega una conexión (o None)
+        self._summaries = TTLCache(maxsize=cache_size, ttl=cache_ttl)  # chat_id -> (resumen, id cubierto)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="history-summary")
+        self._running = set()
+        self._lock = threading.Lock()
+        self.persistent = False
+
+    def init_table(self):
+        if not self.get_connection:
+            return False
+
+        with self.get_connection() as conn:
+            if not conn:
+                return False
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_summaries (
+                        chat_id TEXT PRIMARY KEY,
+                        summary TEXT NOT NULL,
+                        covered_message_id BIGINT,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Tablas creadas cuando la marca era una huella del contenido
+                cur.execute('ALTER TABLE conversation_summaries ADD COLUMN IF NOT EXISTS covered_message_id BIGINT')
+                cur.execute('ALTER TABLE conversation_summaries DROP COLUMN IF EXISTS covered_fingerprint')
+                conn.commit()
+                cur.close()
+                self.persistent = True
+                return True
+            except Exception as e:
+                print(f"❌ Error creando tabla conversation_summaries: {e}")
+                return False
+
+    def build(self, chat_id, history):
+        """Mensajes de historial para el prompt: [resumen] + los más recientes que caben"""
+        chat_id = str(chat_id)
+        summary = self._get_summary(chat_id)
+        pending = self._uncovered(history, summary)
+
+        prefix = []
+        remaining = self.budget
+        if summary:
+            prefix = [summary_message(summary[0])]
+            remaining -= message_tokens(prefix[0])
+
+        # Llenar de más nuevo a más viejo
+        start = len(pending)
+        while start > 0 and message_tokens(pending[start - 1]) <= remaining:
+            start -= 1
+            remaining -= message_tokens(pending[start])
+
+        window = pending[start:]
+        if not window and pending:
+            # Ni el último mensaje cabe entero: va recortado para no perder el hilo
+            last = pending[-1]
+            window = [{"role": last['role'], "content": truncate_to_tokens(last['content'], remaining - MESSAGE_OVERHEAD)}]
+            start = len(pending) - 1
+
+        if start > 0 and self.summarize:
+            self._schedule(chat_id, history)
+
+        return prefix + [prompt_message(message) for message in window]
+
+    def stats(self):
+        return {"budget": self.budget, "summaries": self._summaries.stats(), "summarizing": len(self._running)}
+
+    def _uncovered(self, history, summary):
+        """Mensajes posteriores al último que cubre el resumen"""
+        if not summary or summary[1] is None:
+            return list(history)
+        covered = summary[1]
+        # Sin id: el mensaje no se pudo guardar, se trata como no resumido
+        return [message for message in history if message.get('id') is None or message['id'] > covered]
+
+    def _schedule(self, chat_id, history):
+        with self._lock:
+            if chat_id in self._running:
+                return
+            self._running.add(chat_id)
+        self._executor.submit(self._update_summary, chat_id, list(history))
+
+    def _update_summary(self, chat_id, history):
+        try:
+            # Releer de la DB: otro worker pudo haber resumido mientras tanto
+            if self.persistent:
+                summary = self._load(chat_id)
+                if summary is None:
+                    return  # La DB falló: no resumir sin saber qué cubre el resumen actual
+                self._summaries.set(chat_id, summary)
+                summary = summary or None
+            else:
+                summary = self._get_summary(chat_id)
+            pending = self._uncovered(history, summary)
+
+            # Resumir lo que no cabe en el presupuesto (dejando lugar para el resumen)
+            remaining = self.budget // 2
+            start = len(pending)
+            while start > 0 and message_tokens(pending[start - 1]) <= remaining:
+                start -= 1
+                remaining -= message_tokens(pending[start])
+            older = pending[:start]
+            covered = next((message['id'] for message in reversed(older) if message.get('id') is not None), None)
+            if not older or covered is None:
+                return
+
+            text = self.summarize(summary[0] if summary else None, [prompt_message(message) for message in older])
+            if text:
+                self._set_summary(chat_id, text, covered)
+                print(f"📝 Resumen de {chat_id} actualizado ({len(older)} mensajes, {count_tokens(text)} tokens)")
+        except Exception as e:
+            print(f"❌ Error resumiendo historial de {chat_id}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(chat_id)
+
+    def _get_summary(self, chat_id):
+        summary = self._summaries.get(chat_id)
+        if summary is not None or not self.persistent:
+            return summary or None
+
+        summary = self._load(chat_id)
+        if summary is None:
+            return None  # La DB falló: sin cachear, el próximo turno reintenta
+        self._summaries.set(chat_id, summary)
+        return summary or None
+
+    def _set_summary(self, chat_id, text, covered):
+        self._summaries.set(chat_id, (text, covered))
+        if not self.persistent:
+            return
+
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    INSERT INTO conversation_summaries (chat_id, summary, covered_message_id, updated_at)
+                    VALUES (%s, %s, %s, NOW())
+                    ON CONFLICT (chat_id) DO UPDATE
+                    SET summary = EXCLUDED.summary,
+                        covered_message_id = EXCLUDED.covered_message_id,
+                        updated_at = NOW()
+                    WHERE conversation_summaries.covered_message_id IS NULL
+                    OR conversation_summaries.covered_message_id < EXCLUDED.covered_message_id
+                ''', (chat_id, text, covered))
+                updated = cur.rowcount
+                conn.commit()
+                cur.close()
+                if not updated:
+                    # Otro worker ya guardó un resumen más nuevo: leerlo en el próximo turno
+                    self._summaries.pop(chat_id)
+            except Exception as e:
+                print(f"❌ Error guardando resumen de {chat_id}: {e}")
+
+    def _load(self, chat_id):
+        """(resumen, id cubierto), () si el chat no tiene resumen o None si no se pudo leer"""
+        with self.get_connection() as conn:
+            if not conn:
+                return None
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    'SELECT summary, covered_message_id FROM conversation_summaries WHERE chat_id = %s',
+                    (chat_id,)
+                )
+                row = cur.fetchone()
+                cur.close()
+            except Exception as e:
+                print(f"❌ Error leyendo resumen de {chat_id}: {e}")
+                return None
+        return (row['summary'], row['covered_message_id']) if row else ()
+
+
+def summary_message(summary):
+    return {"role": "system", "content": f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{summary}"}
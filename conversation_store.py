@@ -0,0 +1,163 @@
+import itertools
+import secrets
+
+from sessions import SessionStore
+
+
+class ConversationStore:
+    """Historial de conversación compartido entre workers (PostgreSQL + cache en memoria)
+
+    PostgreSQL es la fuente de verdad: todos los workers de gunicorn ven los mismos
+    últimos N mensajes de cada chat y el historial sobrevive a los deploys. Encima hay
+    un cache de lectura (SessionStore, acotado por memoria e inactividad), así que la
+    memoria depende de los chats activos y no de todos los números que alguna vez escribieron.
+    Sin DATABASE_URL funciona solo con el cache (como el diccionario de antes, pero acotado).
+    """
+
+    def __init__(self, get_connection=None, max_messages=20, sessions=None, notify_channel=None):
+        self.get_connection = get_connection  # Context manager que entrega una conexión (o None)
+        self.max_messages = max_messages
+        self.notify_channel = notify_channel  # Canal NOTIFY para invalidar el cache de otros workers
+        self.origin = secrets.token_hex(4)  # Identifica a este proceso en las notificaciones
+        self.sessions = sessions or SessionStore(max_turns=max_messages)
+        self.persistent = False
+        self._local_ids = itertools.count(1)  # Ids de mensajes cuando no hay DB
+
+    def init_table(self):
+        """Crea la tabla de mensajes si no existe"""
+        if not self.get_connection:
+            return False
+
+        with self.get_connection() as conn:
+            if not conn:
+                return False
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_messages (
+                        id BIGSERIAL PRIMARY KEY,
+                        chat_id TEXT NOT NULL,
+                        role VARCHAR(20) NOT NULL,
+                        content TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_conversation_chat ON conversation_messages(chat_id, id DESC)')
+                conn.commit()
+                cur.close()
+                self.persistent = True
+                return True
+            except Exception as e:
+                print(f"❌ Error creando tabla conversation_messages: {e}")
+                return False
+
+    def get_history(self, chat_id, limit=None):
+        """Retorna los últimos mensajes del chat como [{"role", "content", "id"}, ...]
+
+        El id crece con cada mensaje del chat (el de la fila en la DB, o un contador del
+        proceso sin DB); puede faltar si el mensaje no se pudo guardar.
+        """
+        chat_id = str(chat_id)
+        messages = self.sessions.get_turns(chat_id)
+
+        if messages is None:
+            # Si llega una invalidación mientras leemos, lo leído puede estar viejo: no se cachea
+            generation = self.sessions.turns_generation()
+            messages = self._load(chat_id)
+            if messages is None:
+                # La DB falló: responder sin historial pero sin cachearlo, el próximo turno reintenta
+                return []
+            self.sessions.set_turns(chat_id, messages, generation)
+
+        return messages[-limit:] if limit else messages
+
+    def append(self, chat_id, new_messages):
+        """Agrega mensajes al final del historial y recorta a los últimos max_messages"""
+        chat_id = str(chat_id)
+        if self.persistent:
+            ids = self._save(chat_id, new_messages)
+        else:
+            ids = [next(self._local_ids) for _ in new_messages]
+        if ids:
+            new_messages = [dict(message, id=message_id) for message, message_id in zip(new_messages, ids)]
+
+        # Actualizar el cache local sin volver a leer de la DB
+        if not self.sessions.append_turns(chat_id, new_messages):
+            generation = self.sessions.turns_generation()
+            messages = self._load(chat_id) if self.persistent else new_messages
+            if messages is not None:
+                self.sessions.set_turns(chat_id, messages, generation)
+
+    def handle_notification(self, payload):
+        """Procesa una invalidación 'origen:chat_id' publicada por otro worker"""
+        origin, _, chat_id = payload.partition(':')
+        if origin != self.origin:
+            self.sessions.invalidate_turns(chat_id)
+
+    def clear_cache(self):
+        self.sessions.invalidate_all_turns()
+
+    def _load(self, chat_id):
+        """Últimos mensajes guardados del chat, o None si no se pudieron leer"""
+        if not self.persistent:
+            return []
+
+        with self.get_connection() as conn:
+            if not conn:
+                return None
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    SELECT id, role, content FROM conversation_messages
+                    WHERE chat_id = %s
+                    ORDER BY id DESC
+                    LIMIT %s
+                ''', (chat_id, self.max_messages))
+                rows = cur.fetchall()
+                cur.close()
+                return [{"role": row['role'], "content": row['content'], "id": row['id']} for row in reversed(rows)]
+            except Exception as e:
+                print(f"❌ Error leyendo historial de {chat_id}: {e}")
+                return None
+
+    def _save(self, chat_id, new_messages):
+        """Inserta los mensajes y retorna sus ids (None si falla)"""
+        with self.get_connection() as conn:
+            if not conn:
+                return None
+            try:
+                cur = conn.cursor()
+                cur.executemany('''
+                    INSERT INTO conversation_messages (chat_id, role, content)
+                    VALUES (%s, %s, %s)
+                    RETURNING id
+                ''', [(chat_id, message['role'], message['content']) for message in new_messages], returning=True)
+                ids = []
+                while True:
+                    ids.append(cur.fetchone()['id'])
+                    if not cur.nextset():
+                        break
+
+                # Conservar solo los últimos N mensajes del chat
+                cur.execute('''
+                    DELETE FROM conversation_messages
+                    WHERE chat_id = %s AND id < (
+                        SELECT MIN(id) FROM (
+                            SELECT id FROM conversation_messages
+                            WHERE chat_id = %s
+                            ORDER BY id DESC
+                            LIMIT %s
+                        ) recientes
+                    )
+                ''', (chat_id, chat_id, self.max_messages))
+
+                # Avisar a los demás workers (se entrega al hacer commit)
+                if self.notify_channel:
+                    cur.execute('SELECT pg_notify(%s, %s)', (self.notify_channel, f"chat:{self.origin}:{chat_id}"))
+
+                conn.commit()
+                cur.close()
+                return ids
+            except Exception as e:
+                print(f"❌ Error guardando historial de {chat_id}: {e}")
+                return None
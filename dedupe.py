@@ -0,0 +1,117 @@
+import time
+
+from cache import TTLCache
+
+
+class DeliveryDeduper:
+    """Descarta entregas repetidas del webhook (mismo key.id + remoteJid)
+
+    Primero revisa una ventana acotada en memoria (rápido, por proceso) y, si hay
+    PostgreSQL, una tabla con clave primaria compartida por todos los workers y que
+    sobrevive reinicios. Si la DB no responde se sigue solo con la memoria.
+    """
+
+    def __init__(self, get_connection=None, window_size=10000, window_ttl=3600, retention_hours=48):
+        self.get_connection = get_connection  # Context manager que entrega una conexión (o None)
+        self.retention_hours = retention_hours
+        self._window = TTLCache(maxsize=window_size, ttl=window_ttl)
+        self._last_purge = 0
+        self.persistent = False
+        self.duplicates = 0
+
+    def init_table(self):
+        if not self.get_connection:
+            return False
+
+        with self.get_connection() as conn:
+            if not conn:
+                return False
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS webhook_deliveries (
+                        remote_jid TEXT NOT NULL,
+                        message_id TEXT NOT NULL,
+                        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (remote_jid, message_id)
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_received ON webhook_deliveries(received_at)')
+                conn.commit()
+                cur.close()
+                self.persistent = True
+                return True
+            except Exception as e:
+                print(f"❌ Error creando tabla webhook_deliveries: {e}")
+                return False
+
+    def is_duplicate(self, remote_jid, message_id):
+        """Registra la entrega y retorna True si ya se había recibido antes"""
+        if not message_id or not remote_jid:
+            # Sin id no hay forma de saber si es repetido
+            return False
+
+        key = f"{remote_jid}:{message_id}"
+        if not self._window.add(key):
+            self.duplicates += 1
+            return True
+
+        if self.persistent and not self._claim(remote_jid, message_id):
+            self.duplicates += 1
+            return True
+
+        return False
+
+    def forget(self, remote_jid, message_id):
+        """Olvida una entrega (por ejemplo, si no se pudo encolar y Evolution la va a reintentar)"""
+        if not message_id or not remote_jid:
+            return
+
+        self._window.pop(f"{remote_jid}:{message_id}")
+        if not self.persistent:
+            return
+
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                conn.execute(
+                    'DELETE FROM webhook_deliveries WHERE remote_jid = %s AND message_id = %s',
+                    (remote_jid, message_id)
+                )
+                conn.commit()
+            except Exception as e:
+                print(f"❌ Error olvidando entrega {message_id}: {e}")
+
+    def _claim(self, remote_jid, message_id):
+        """Inserta la entrega en la DB. Retorna False si otro worker ya la tenía"""
+        with self.get_connection() as conn:
+            if not conn:
+                return True
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    INSERT INTO webhook_deliveries (remote_jid, message_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING
+                    RETURNING message_id
+                ''', (remote_jid, message_id))
+                claimed = cur.fetchone() is not None
+                self._purge_old(cur)
+                conn.commit()
+                cur.close()
+                return claimed
+            except Exception as e:
+                print(f"❌ Error registrando entrega {message_id}: {e}")
+                return True
+
+    def _purge_old(self, cur):
+        # Como mucho una vez por hora por proceso, en la misma transacción
+        now = time.monotonic()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        cur.execute(
+            'DELETE FROM webhook_deliveries WHERE received_at < NOW() - make_interval(hours => %s)',
+            (self.retention_hours,)
+        )
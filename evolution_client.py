@@ -0,0 +1,124 @@
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Códigos que vale la pena reintentar en llamadas idempotentes
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class EvolutionClient:
+    """Cliente HTTP de Evolution API con conexiones keep-alive reutilizadas entre hilos
+
+    Una sola requests.Session con pool de conexiones: cada mensaje ya no paga un
+    handshake TCP/TLS nuevo. Todas las llamadas tienen timeout de conexión y de lectura.
+    Las llamadas idempotentes (descargar media) se reintentan con backoff exponencial
+    con jitter; los envíos solo se reintentan si la conexión ni siquiera se estableció,
+    para no mandar el mismo mensaje dos veces.
+    """
+
+    def __init__(self, base_url, api_key, instance, connect_timeout=5, read_timeout=30,
+                 max_retries=2, backoff=0.5, pool_size=20):
+        self.base_url = (base_url or '').rstrip('/')
+        self.instance = instance
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'apikey': api_key or ''
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send_text(self, number, text):
+        """Envía un mensaje de texto. Retorna el JSON de respuesta o None"""
+        response = self._post(f"/message/sendText/{self.instance}", {
+            "number": number,
+            "text": text
+        })
+        return self._json(response)
+
+    def send_media(self, number, media, caption="", mimetype=None, mediatype="image"):
+        """Envía media (URL o base64 sin prefijo). Retorna el JSON de respuesta o None"""
+        data = {
+            "number": number,
+            "mediatype": mediatype,
+            "media": media,
+            "caption": caption
+        }
+        if mimetype:
+            data["mimetype"] = mimetype
+
+        response = self._post(f"/message/sendMedia/{self.instance}", data)
+        if response is not None:
+            print(f"Imagen enviada: {response.status_code}")
+        return self._json(response)
+
+    def get_media_base64(self, message_data, timeout=None):
+        """Descarga la media de un mensaje recibido. Retorna el JSON ({'base64': ...}) o None"""
+        response = self._post(
+            f"/chat/getBase64FromMediaMessage/{self.instance}",
+            {"message": message_data},
+            idempotent=True,
+            timeout=timeout
+        )
+        if response is None:
+            return None
+
+        # 200 y 201 son respuestas exitosas
+        if response.status_code not in (200, 201):
+            print(f"❌ Error descargando media: {response.status_code} - {response.text[:200]}...")
+            return None
+        return self._json(response)
+
+    def _post(self, path, data, idempotent=False, timeout=None):
+        """POST con reintentos acotados. Retorna la respuesta o None si no hubo forma"""
+        url = f"{self.base_url}{path}"
+        timeout = timeout or self.timeout
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.post(url, json=data, timeout=timeout)
+                if idempotent and response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                    print(f"⚠️ Evolution respondió {response.status_code} en {path}, reintentando...")
+                    self._sleep(attempt)
+                    continue
+                return response
+            except requests.exceptions.RequestException as e:
+                if last_attempt or not (idempotent or self._never_sent(e)):
+                    print(f"❌ Error llamando a Evolution API ({path}): {e}")
+                    return None
+                print(f"⚠️ Falla de conexión con Evolution ({path}), reintentando: {e}")
+                self._sleep(attempt)
+
+        return None
+
+    @staticmethod
+    def _never_sent(error):
+        """True si el request seguro no llegó al servidor (reintentarlo no duplica nada)"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+            reason = getattr(error.args[0], 'reason', None)
+            return isinstance(reason, NewConnectionError)
+        return False
+
+    def _sleep(self, attempt):
+        # Backoff exponencial con jitter completo para no reintentar todos a la vez
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    @staticmethod
+    def _json(response):
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
@@ -0,0 +1,149 @@
+"""Cache de respuestas para preguntas frecuentes (Instagram, página web, creador, productos)
+
+Solo aplica a unas pocas preguntas de la marca que se responden igual para todos.
+Un mensaje cuenta como pregunta frecuente solo si, sin palabras vacías, está hecho
+completamente de las palabras de una de esas preguntas ("cuál es su insta?" =
+"instagram"): cualquier palabra extra (una talla, un número, un nombre, "traduce",
+"pedido"...) lo saca del cache. Las preguntas que continúan la conversación ("y el
+link?", "esta página", "mi pedido") tampoco se cachean. La clave del cache es la
+pregunta canónica, no el texto del usuario.
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Preguntas canónicas: el mensaje debe contener todas las palabras de alguna forma y
+# ninguna palabra fuera de las formas y los complementos de esa pregunta
+PREGUNTAS_FAQ = {
+    'instagram': {
+        'formas': [{'instagram'}, {'insta'}, {'ig'}],
+        'complementos': {'navros', 'cuenta', 'tienen', 'tienes', 'usuario', 'arroba', 'oficial'}
+    },
+    'web': {
+        'formas': [{'pagina', 'web'}, {'sitio', 'web'}, {'web'}, {'pagina', 'navros'}, {'tienda', 'online'},
+                   {'tienda', 'virtual'}, {'link', 'tienda'}, {'link', 'pagina'}],
+        'complementos': {'navros', 'tienen', 'tienes', 'link', 'enlace', 'oficial', 'direccion', 'url'}
+    },
+    'creador': {
+        'formas': [{'quien', 'creo'}, {'quien', 'hizo'}, {'quien', 'desarrollo'}, {'quien', 'programo'}, {'creador'}],
+        'complementos': {'navros', 'bot', 'fue', 'quien'}
+    },
+    'productos': {
+        'formas': [{'vende'}, {'venden'}, {'vendes'}, {'productos'}],
+        'complementos': {'navros', 'tienen', 'tienes', 'ofrecen', 'manejan', 'tipo', 'clase', 'productos', 'venden'}
+    }
+}
+
+# Palabras que indican que la pregunta depende de lo que se habló antes o del usuario
+REFERENCIAS_CONTEXTO = [
+    'eso', 'esa', 'ese', 'esto', 'este', 'esta', 'estos', 'estas', 'anterior', 'antes', 'otra vez',
+    'de nuevo', 'tambien', 'lo mismo', 'mas', 'dijiste', 'me dijiste', 'arriba', 'mi', 'mis', 'yo'
+]
+
+# Palabras que no cambian la pregunta ("cuál es tu instagram" = "instagram?")
+PALABRAS_VACIAS = {
+    'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', 'de', 'del', 'y', 'o', 'a', 'en',
+    'es', 'son', 'su', 'sus', 'tu', 'tus', 'me', 'te', 'por', 'para', 'con', 'que',
+    'cual', 'como', 'donde', 'hay', 'ser', 'lo', 'le', 'les', 'se', 'al', 'bro', 'pana',
+    'parce', 'man', 'porfa', 'porfavor', 'favor', 'hola', 'oye', 'dime', 'ustedes', 'usted'
+}
+
+MAX_PREGUNTA = 120  # Caracteres: las preguntas frecuentes son cortas
+
+_PUNTUACION = re.compile(r'[^\w\s]')
+_ESPACIOS = re.compile(r'\s+')
+
+
+def normalize(text):
+    """Minúsculas, sin tildes, sin puntuación y con espacios simples"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = _PUNTUACION.sub(' ', text)
+    return _ESPACIOS.sub(' ', text).strip()
+
+
+def content_key(normalized):
+    """Pregunta sin palabras vacías"""
+    return ' '.join(word for word in normalized.split() if word not in PALABRAS_VACIAS)
+
+
+def _contains_phrase(texto, frases):
+    padded = f" {texto} "
+    return any(f" {frase} " in padded for frase in frases)
+
+
+def faq_intent(normalized):
+    """Pregunta canónica (clave de PREGUNTAS_FAQ) del mensaje ya normalizado, o None"""
+    if not normalized or len(normalized) > MAX_PREGUNTA:
+        return None
+    # "y el link?" / "y cuánto cuesta?" continúan la conversación
+    if normalized.split()[0] == 'y' or _contains_phrase(normalized, REFERENCIAS_CONTEXTO):
+        return None
+
+    words = set(content_key(normalized).split())
+    for intent, pregunta in PREGUNTAS_FAQ.items():
+        permitidas = set(pregunta['complementos']).union(*pregunta['formas'])
+        if words <= permitidas and any(forma <= words for forma in pregunta['formas']):
+            return intent
+    return None
+
+
+class FAQCache:
+    """Respuestas cacheadas por pregunta canónica, con TTL y tope de tamaño (LRU)"""
+
+    def __init__(self, maxsize=1000, ttl=6 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # pregunta canónica -> (expira_en, respuesta)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question):
+        """Respuesta cacheada para la pregunta canónica del mensaje, o None"""
+        key = faq_intent(normalize(question or ''))
+        if not key:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def set(self, question, answer):
+        """Guarda la respuesta si el mensaje es una pregunta canónica. Retorna True si la guardó
+
+        Solo deben guardarse respuestas generadas sin historial: la respuesta se le
+        entrega después a cualquier usuario.
+        """
+        key = faq_intent(normalize(question or ''))
+        if not answer or not key:
+            return False
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, answer)
+            # Expulsar las menos usadas si pasamos el límite
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
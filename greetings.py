@@ -0,0 +1,70 @@
+import random
+import threading
+from collections import deque
+
+
+class GreetingPool:
+    """Saludos de bienvenida generados por lotes en segundo plano
+
+    take() nunca llama al modelo: entrega un saludo del pool (cada uno se usa una
+    vez) y, si el pool baja de low_water, pide otro lote en un hilo aparte.
+    Si el pool está vacío entrega el saludo fijo de respaldo.
+    """
+
+    def __init__(self, generate_batch, fallback, batch_size=10, low_water=5, max_size=50, name="greetings"):
+        self.generate_batch = generate_batch  # n -> lista de saludos
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_size = max_size
+        self.name = name
+        self._pool = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self.served = 0
+        self.fallbacks = 0
+
+    def start(self):
+        """Llena el pool en segundo plano (no bloquea el arranque)"""
+        self._schedule_refill()
+
+    def take(self):
+        with self._lock:
+            greeting = self._pool.popleft() if self._pool else None
+            low = len(self._pool) < self.low_water
+            if greeting:
+                self.served += 1
+            else:
+                self.fallbacks += 1
+
+        if low:
+            self._schedule_refill()
+        return greeting or self.fallback
+
+    def stats(self):
+        return {"size": len(self._pool), "served": self.served, "fallbacks": self.fallbacks}
+
+    def _schedule_refill(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name=f"{self.name}-refill", daemon=True).start()
+
+    def _refill(self):
+        try:
+            while len(self._pool) < self.low_water + self.batch_size:
+                greetings = [g.strip() for g in (self.generate_batch(self.batch_size) or []) if g and g.strip()]
+                if not greetings:
+                    break
+                random.shuffle(greetings)
+                with self._lock:
+                    self._pool.extend(greetings)
+                    while len(self._pool) > self.max_size:
+                        self._pool.popleft()
+                print(f"👋 {len(greetings)} saludos nuevos en el pool ({len(self._pool)} disponibles)")
+        except Exception as e:
+            print(f"❌ Error generando saludos: {e}")
+        finally:
+            with self._lock:
+                self._refilling = False
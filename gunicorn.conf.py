@@ -0,0 +1,26 @@
+"""Configuración de gunicorn (se carga sola al correr `gunicorn app:app` desde la raíz)
+
+Solo prepara las métricas de Prometheus en modo multiproceso; el resto de la
+configuración sigue viniendo de la línea de comandos o de GUNICORN_CMD_ARGS.
+"""
+import os
+import shutil
+import tempfile
+
+# Directorio compartido donde cada worker escribe sus métricas (se hereda al hacer fork)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'navros-metrics'))
+
+
+def on_starting(server):
+    # Empezar limpio: archivos de un arranque anterior sumarían valores viejos
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
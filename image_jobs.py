@@ -0,0 +1,216 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+FINISHED = (STATUS_DONE, STATUS_FAILED)
+
+
+class ImageJob:
+    __slots__ = ('id', 'owner', 'prompt', 'status', 'result', 'error', 'created_at', 'finished_at', 'event')
+
+    def __init__(self, owner, prompt):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.prompt = prompt
+        self.status = STATUS_QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.event = threading.Event()  # Se activa al terminar (para el long-poll)
+
+    def as_dict(self):
+        return {
+            "job_id": self.id,
+            "owner": self.owner,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class ImageJobManager:
+    """Generación de imágenes en segundo plano con un pool dedicado y acotado
+
+    El request recibe un job_id de inmediato y la app consulta el estado (o espera
+    con long-poll). Con PostgreSQL el estado se guarda en image_jobs para que
+    cualquier worker de gunicorn pueda responder la consulta.
+    """
+
+    def __init__(self, generate, workers=2, max_pending=20, result_ttl=3600, get_connection=None):
+        self.generate = generate  # prompt -> URL/data URL de la imagen o None
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.get_connection = get_connection  # Context manager que entrega una conexión (o None)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.persistent = False
+
+    def init_table(self):
+        if not self.get_connection:
+            return False
+
+        with self.get_connection() as conn:
+            if not conn:
+                return False
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS image_jobs (
+                        id VARCHAR(32) PRIMARY KEY,
+                        owner TEXT NOT NULL,
+                        status VARCHAR(20) NOT NULL,
+                        result TEXT,
+                        error TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        finished_at TIMESTAMP
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_image_jobs_created ON image_jobs(created_at)')
+                conn.commit()
+                cur.close()
+                self.persistent = True
+                return True
+            except Exception as e:
+                print(f"❌ Error creando tabla image_jobs: {e}")
+                return False
+
+    def submit(self, prompt, owner):
+        """Crea un job y lo pone a correr. Retorna el job o None si hay demasiados pendientes"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+            self._cleanup()
+
+            job = ImageJob(owner, prompt)
+            self._jobs[job.id] = job
+
+        self._save(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """Estado del job como dict (memoria local o, si no está, PostgreSQL)"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.as_dict()
+        return self._load(job_id)
+
+    def wait(self, job_id, timeout):
+        """Long-poll: espera hasta que el job termine o pase el timeout. Retorna su estado"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.event.wait(timeout)
+            return job.as_dict()
+
+        # El job corre en otro worker: consultar la DB cada segundo
+        deadline = time.monotonic() + timeout
+        state = self._load(job_id)
+        while state and state['status'] not in FINISHED and time.monotonic() < deadline:
+            time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+            state = self._load(job_id)
+        return state
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._pending, "max_pending": self.max_pending, "workers": self.workers}
+
+    def _run(self, job):
+        job.status = STATUS_RUNNING
+        self._save(job)
+        try:
+            result = self.generate(job.prompt)
+            if result:
+                job.result = result
+                job.status = STATUS_DONE
+            else:
+                job.error = "No se pudo generar la imagen"
+                job.status = STATUS_FAILED
+        except Exception as e:
+            print(f"❌ Error en job de imagen {job.id}: {e}")
+            job.error = "No se pudo generar la imagen"
+            job.status = STATUS_FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+            self._save(job)
+            job.event.set()
+
+    def _cleanup(self):
+        """Olvida jobs terminados hace más de result_ttl (requiere el lock)"""
+        limit = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < limit]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _save(self, job):
+        if not self.persistent:
+            return
+
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    INSERT INTO image_jobs (id, owner, status, result, error, finished_at)
+                    VALUES (%s, %s, %s, %s, %s, to_timestamp(%s))
+                    ON CONFLICT (id) DO UPDATE
+                    SET status = EXCLUDED.status, result = EXCLUDED.result,
+                        error = EXCLUDED.error, finished_at = EXCLUDED.finished_at
+                ''', (job.id, job.owner, job.status, job.result, job.error, job.finished_at))
+                if job.status == STATUS_QUEUED:
+                    # Aprovechar para borrar jobs viejos
+                    cur.execute(
+                        'DELETE FROM image_jobs WHERE created_at < NOW() - make_interval(secs => %s)',
+                        (self.result_ttl * 2,)
+                    )
+                conn.commit()
+                cur.close()
+            except Exception as e:
+                print(f"❌ Error guardando job de imagen {job.id}: {e}")
+
+    def _load(self, job_id):
+        if not self.persistent:
+            return None
+
+        with self.get_connection() as conn:
+            if not conn:
+                return None
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    SELECT id, owner, status, result, error,
+                           EXTRACT(EPOCH FROM created_at) AS created_at,
+                           EXTRACT(EPOCH FROM finished_at) AS finished_at
+                    FROM image_jobs WHERE id = %s
+                ''', (job_id,))
+                row = cur.fetchone()
+                cur.close()
+            except Exception as e:
+                print(f"❌ Error leyendo job de imagen {job_id}: {e}")
+                return None
+
+        if not row:
+            return None
+        return {
+            "job_id": row['id'],
+            "owner": row['owner'],
+            "status": row['status'],
+            "result": row['result'],
+            "error": row['error'],
+            "created_at": float(row['created_at']) if row['created_at'] is not None else None,
+            "finished_at": float(row['finished_at']) if row['finished_at'] is not None else None
+        }
@@ -0,0 +1,200 @@
+"""Clasificador de intención del mensaje: saludo, solicitud de imagen o chat normal
+
+Todas las frases se compilan en una sola expresión regular (armada como un trie, así
+que el costo por posición no crece con la cantidad de frases) que recorre el texto
+una vez y reporta cada posición donde empieza alguna frase. Las decisiones son las
+mismas que las de las listas originales (ver bench/legacy_intents.py y el corpus
+en bench/intent_corpus.json); agregar frases no agrega recorridos por mensaje.
+"""
+import re
+
+# PRIMERO: frases que CLARAMENTE son solicitudes de imagen (en cualquier parte del texto)
+TRIGGERS_IMAGEN_FUERTES = [
+    'genera una imagen', 'generar una imagen', 'generame una imagen', 'genérame una imagen',
+    'genera la imagen', 'generar la imagen', 'generame la imagen', 'genérame la imagen',
+    'crea una imagen', 'crear una imagen', 'creame una imagen', 'créame una imagen',
+    'genera una foto', 'crea una foto', 'hazme una foto',
+    'genera un logo', 'crea un logo', 'genera un logotipo', 'crea un logotipo',
+    'dibuja', 'dibújame', 'dibujar',
+    'hazme una imagen', 'haz una imagen',
+    'hazme un dibujo', 'haz un dibujo',
+    'quiero una imagen', 'necesito una imagen',
+    'genera un dibujo', 'crea un dibujo',
+    'genera imagen', 'crear imagen', 'generar imagen',
+    'dibujame', 'dibújame',
+    'crea img', 'genera img', 'haz img'
+]
+
+# Patrones para personas/personajes (genera a X, dibuja a Y), solo al inicio del mensaje
+PATRONES_PERSONA = [
+    'genera a ', 'crea a ', 'dibuja a ', 'hazme a ', 'haz a ',
+    'generame a ', 'genérame a ', 'creame a ', 'créame a ',
+    'dibujame a ', 'dibújame a '
+]
+
+# Acción + palabra de imagen (ambas en cualquier parte del texto)
+PALABRAS_ACCION = ['genera', 'crea', 'haz', 'hazme', 'dibuja']
+PALABRAS_IMAGEN = ['imagen', 'dibujo', 'foto', 'ilustración', 'ilustracion', 'img', 'retrato', 'logo', 'logotipo']
+
+# Inicios ambiguos: son imagen salvo que aparezca alguna exclusión
+PREFIJOS_AMBIGUOS = ['genera un ', 'genera una ', 'crea un ', 'crea una ']
+
+EXCLUSIONES = [
+    'texto', 'codigo', 'código', 'programa', 'script', 'lista',
+    'resumen', 'ensayo', 'documento', 'archivo', 'email', 'correo',
+    'mensaje', 'respuesta', 'explicación', 'explicacion', 'plan',
+    'receta', 'horario', 'tabla', 'excel', 'pdf', 'word',
+    'funcion', 'función', 'variable', 'clase', 'método', 'metodo',
+    'párrafo', 'parrafo', 'oracion', 'oración', 'frase', 'historia',
+    'cuento', 'poema', 'canción', 'cancion', 'letra', 'análisis', 'analisis',
+    'informe', 'reporte', 'carta', 'nota', 'apunte', 'tarea',
+    'pregunta', 'quiz', 'examen', 'ejercicio', 'problema de',
+    'sorteo', 'número', 'numero', 'aleatorio', 'random', 'simulacion', 'simulación'
+]
+
+# Saludos exactos y saludos al inicio de un mensaje corto
+SALUDOS = {
+    'hola', 'hi', 'hello', 'buenas', 'buenos días', 'buenos dias',
+    'buenas tardes', 'buenas noches', 'hey', 'ey', 'alo', 'aló',
+    'que tal', 'qué tal', 'saludos', 'buenas buenas'
+}
+PREFIJOS_SALUDO = ['hola', 'buenas', 'buenos', 'hey', 'hi']
+SALUDO_MAX_LEN = 20
+
+# Categorías (bits). Las "_INICIO" solo cuentan si la frase está al principio del mensaje
+FUERTE = 1
+ACCION = 2
+IMAGEN = 4
+EXCLUSION = 8
+PERSONA_INICIO = 16
+AMBIGUO_INICIO = 32
+SALUDO_INICIO = 64
+SOLO_INICIO = PERSONA_INICIO | AMBIGUO_INICIO | SALUDO_INICIO
+
+INTENT_IMAGE = 'image'
+INTENT_GREETING = 'greeting'
+INTENT_CHAT = 'chat'
+
+
+class Intent:
+    """Resultado de clasificar un mensaje"""
+
+    __slots__ = ('is_greeting', 'is_image_request')
+
+    def __init__(self, is_greeting, is_image_request):
+        self.is_greeting = is_greeting
+        self.is_image_request = is_image_request
+
+    @property
+    def name(self):
+        # Misma prioridad que el webhook: imagen > saludo > chat
+        if self.is_image_request:
+            return INTENT_IMAGE
+        if self.is_greeting:
+            return INTENT_GREETING
+        return INTENT_CHAT
+
+    def __repr__(self):
+        return f"Intent({self.name}, greeting={self.is_greeting}, image={self.is_image_request})"
+
+
+class IntentMatcher:
+    """Matcher precompilado: una regex con todas las frases y sus categorías"""
+
+    def __init__(self, phrases_by_category):
+        categories = {}
+        for category, phrases in phrases_by_category.items():
+            for phrase in phrases:
+                categories[phrase] = categories.get(phrase, 0) | category
+
+        # Cualquier frase que empiece en una posición es prefijo de la más larga que empieza
+        # ahí, así que cada frase hereda las categorías de sus prefijos y basta con reportar
+        # la más larga por posición (el trie siempre intenta seguir antes de terminar)
+        self.categories = {}
+        for phrase in categories:
+            mask = 0
+            for i in range(1, len(phrase) + 1):
+                mask |= categories.get(phrase[:i], 0)
+            self.categories[phrase] = mask
+
+        # Lookahead de ancho cero: reporta frases solapadas en un solo recorrido
+        self.pattern = re.compile(f'(?=({_trie_regex(_build_trie(categories))}))')
+
+    def scan(self, text):
+        """Retorna el bitmask de categorías presentes en el texto (ya normalizado)"""
+        found = 0
+        categories = self.categories
+        for match in self.pattern.finditer(text):
+            mask = categories[match.group(1)]
+            if match.start():
+                mask &= ~SOLO_INICIO
+            found |= mask
+        return found
+
+
+def _build_trie(phrases):
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True  # Fin de frase
+    return trie
+
+
+def _trie_regex(node):
+    """Convierte el trie en regex: alternativas por primer carácter y sufijos opcionales greedy"""
+    is_end = '' in node
+    branches = []
+    for char in sorted(k for k in node if k):
+        child = node[char]
+        literal = re.escape(char)
+        # Comprimir cadenas de un solo hijo en un literal
+        while len(child) == 1 and '' not in child:
+            (next_char, child), = child.items()
+            literal += re.escape(next_char)
+        branches.append(literal + _trie_regex(child))
+
+    if not branches:
+        return ''
+    group = '(?:' + '|'.join(branches) + ')'
+    if is_end:
+        # Greedy: primero intenta la frase más larga, si no, termina aquí
+        return group + '?'
+    return branches[0] if len(branches) == 1 else group
+
+
+_matcher = IntentMatcher({
+    FUERTE: TRIGGERS_IMAGEN_FUERTES,
+    ACCION: PALABRAS_ACCION,
+    IMAGEN: PALABRAS_IMAGEN,
+    EXCLUSION: EXCLUSIONES,
+    PERSONA_INICIO: PATRONES_PERSONA,
+    AMBIGUO_INICIO: PREFIJOS_AMBIGUOS,
+    SALUDO_INICIO: PREFIJOS_SALUDO,
+})
+
+
+def classify(text):
+    """Clasifica un mensaje en un solo recorrido del texto"""
+    if not text:
+        return Intent(False, False)
+
+    texto = text.lower().strip()
+    found = _matcher.scan(texto)
+
+    # Solicitud de imagen
+    if found & (FUERTE | PERSONA_INICIO):
+        is_image = True
+    elif found & ACCION and found & IMAGEN:
+        is_image = True
+    elif found & AMBIGUO_INICIO:
+        # Si no hay exclusión y empieza con genera/crea, probablemente es imagen
+        is_image = not found & EXCLUSION
+    else:
+        is_image = False
+
+    # Saludo: exacto o al inicio de un mensaje corto
+    is_greeting = texto in SALUDOS or bool(found & SALUDO_INICIO and len(texto) < SALUDO_MAX_LEN)
+
+    return Intent(is_greeting, is_image)
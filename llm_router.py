@@ -0,0 +1,288 @@
+"""Enrutamiento entre proveedores de LLM (Grok, OpenAI) según salud y latencia
+
+Cada proveedor/modelo lleva una ventana de latencias y resultados recientes y un
+circuit breaker: tras varios errores seguidos deja de recibir tráfico durante
+`cooldown` segundos y luego se prueba con un solo request. Opcionalmente, si el
+proveedor principal no respondió en su p95 reciente, se lanza el mismo request al
+siguiente (hedging) y se usa la primera respuesta que llegue.
+
+Solo cuentan como fallas del proveedor los timeouts, errores de conexión, 429 y 5xx.
+Los errores del request (400 por una imagen inválida o un contexto muy largo,
+rechazos de contenido) se devuelven tal cual al llamador, sin tocar el breaker ni
+pasar a otro proveedor: no dicen nada de la salud del proveedor.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import openai
+except ImportError:  # Sin el SDK solo se reconocen los errores de red de la librería estándar
+    openai = None
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class NoProviderAvailable(Exception):
+    pass
+
+
+def is_provider_failure(error):
+    """True si el error indica que el proveedor está mal (y debe contar para el breaker)"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    if openai is not None and isinstance(error, openai.APIConnectionError):  # Incluye APITimeoutError
+        return True
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+class Provider:
+    """Un cliente compatible con OpenAI + modelo, con sus estadísticas y su breaker"""
+
+    def __init__(self, name, client, model, window=100, failure_threshold=5, cooldown=30):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._latencies = deque(maxlen=window)  # Segundos de las llamadas exitosas
+        self._outcomes = deque(maxlen=window)  # True = éxito
+        self._lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def label(self):
+        return f"{self.name}/{self.model}"
+
+    def available(self):
+        """True si el breaker dejaría pasar un request (sin reservar el de prueba)"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return self.state == STATE_CLOSED or not self._trial_in_flight
+
+    def acquire(self):
+        """Reserva el paso por el breaker. True si el request puede salir ahora"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = STATE_HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == STATE_HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True  # Un solo request de prueba
+                return True
+            return False
+
+    def record_success(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._outcomes.append(True)
+            self.consecutive_failures = 0
+            if self.state != STATE_CLOSED:
+                print(f"✅ {self.label} recuperado, circuito cerrado")
+            self.state = STATE_CLOSED
+            self._trial_in_flight = False
+
+    def release(self):
+        """El request terminó con un error del request: liberar el paso de prueba sin cambiar el estado"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    print(f"⚠️ {self.label} falla, circuito abierto por {self.cooldown:.0f}s")
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def sample_count(self):
+        with self._lock:
+            return len(self._latencies)
+
+    def percentile(self, p):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    def stats(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "state": self.state,
+            "calls": len(outcomes),
+            "error_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None
+        }
+
+
+class LLMRouter:
+    """Elige proveedor en orden de preferencia, saltando los que tienen el circuito abierto"""
+
+    def __init__(self, providers, hedge=True, hedge_percentile=0.95, hedge_min_delay=2.0,
+                 hedge_max_delay=20.0, min_samples=20, timeout=60, workers=8, observe=None):
+        self.providers = [provider for provider in providers if provider.client]
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay  # Sin suficientes muestras se espera esto
+        self.min_samples = min_samples
+        self.timeout = timeout  # Timeout de cada llamada al proveedor
+        self.observe = observe  # Opcional: observe(proveedor, segundos, error) para métricas
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def complete(self, **kwargs):
+        """chat.completions.create en el mejor proveedor disponible. Retorna (respuesta, proveedor)"""
+        candidates, force = self._candidates()
+        if not candidates:
+            raise NoProviderAvailable("No hay proveedores de LLM configurados")
+
+        futures = {}
+        errors = []
+        request_error = None
+        index = 0
+        hedged = False
+
+        def launch():
+            nonlocal index
+            while index < len(candidates):
+                provider = candidates[index]
+                index += 1
+                if force or provider.acquire():
+                    futures[self._executor.submit(self._call, provider, kwargs)] = provider
+                    return True
+            return False
+
+        launch()
+        primary = next(iter(futures.values()), None)
+        while futures:
+            # Esperar al principal hasta su p95; si no llega, lanzar el siguiente (hedge)
+            can_hedge = self.hedge and not hedged and index < len(candidates)
+            done, _ = wait(futures, timeout=self._hedge_delay(primary) if can_hedge else None,
+                           return_when=FIRST_COMPLETED)
+
+            if not done:
+                hedged = True
+                if launch():
+                    self.hedged += 1
+                    print(f"⏱️ {primary.label} lento, enviando también a {list(futures.values())[-1].label}")
+                continue
+
+            for future in done:
+                provider = futures.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    if not is_provider_failure(e):
+                        # Error del request: otro proveedor fallaría igual (sin failover), pero
+                        # si el otro llamado del hedge sigue en curso su respuesta todavía sirve
+                        request_error = request_error or e
+                    else:
+                        errors.append(f"{provider.label}: {e}")
+                    continue
+
+                if hedged and provider is not primary:
+                    self.hedge_wins += 1
+                return response, provider
+
+            # Todos los que terminaron fallaron: pasar al siguiente proveedor (failover)
+            if not futures:
+                if request_error:
+                    raise request_error
+                launch()
+
+        raise NoProviderAvailable("; ".join(errors) or "Ningún proveedor disponible")
+
+    def stream(self, **kwargs):
+        """Streaming en el mejor proveedor disponible (cambia de proveedor solo antes del primer fragmento)"""
+        candidates, force = self._candidates()
+        errors = []
+        for provider in candidates:
+            if not (force or provider.acquire()):
+                continue
+            start = time.monotonic()
+            try:
+                chunks = iter(provider.client.chat.completions.create(
+                    model=provider.model, stream=True, timeout=self.timeout, **kwargs
+                ))
+                first = next(chunks, None)
+            except Exception as e:
+                self._observe(provider, time.monotonic() - start, e)
+                if not is_provider_failure(e):
+                    provider.release()
+                    raise
+                provider.record_failure()
+                errors.append(f"{provider.label}: {e}")
+                continue
+
+            provider.record_success(time.monotonic() - start)  # Latencia hasta el primer fragmento
+            self._observe(provider, time.monotonic() - start)
+            return provider, _prepend(first, chunks)
+
+        raise NoProviderAvailable("; ".join(errors) or "No hay proveedores de LLM configurados")
+
+    def stats(self):
+        return {
+            "providers": {provider.label: provider.stats() for provider in self.providers},
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins
+        }
+
+    def _candidates(self):
+        """Proveedores disponibles en orden. Si todos tienen el circuito abierto se usan todos
+        igual (force=True): mejor intentar que responder error sin intentar"""
+        available = [provider for provider in self.providers if provider.available()]
+        if available:
+            return available, False
+        return list(self.providers), True
+
+    def _hedge_delay(self, provider):
+        if provider.sample_count() < self.min_samples:
+            return self.hedge_max_delay
+        delay = provider.percentile(self.hedge_percentile)
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, delay))
+
+    def _call(self, provider, kwargs):
+        start = time.monotonic()
+        try:
+            response = provider.client.chat.completions.create(model=provider.model, timeout=self.timeout, **kwargs)
+        except Exception as e:
+            if is_provider_failure(e):
+                provider.record_failure()
+            else:
+                provider.release()
+            self._observe(provider, time.monotonic() - start, e)
+            raise
+        provider.record_success(time.monotonic() - start)
+        self._observe(provider, time.monotonic() - start)
+        return response
+
+    def _observe(self, provider, seconds, error=None):
+        if self.observe:
+            try:
+                self.observe(provider.label, seconds, error)
+            except Exception as e:
+                print(f"❌ Error registrando métrica de {provider.label}: {e}")
+
+
+def _prepend(first, chunks):
+    if first is not None:
+        yield first
+    yield from chunks
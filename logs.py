@@ -0,0 +1,170 @@
+"""Logs estructurados (una línea JSON por evento), recortados, sin secretos y sin bloquear
+
+- Cada campo se recorta a max_field caracteres y las claves sensibles (base64,
+  thumbnails, tokens, api keys) se reemplazan por su tamaño: nunca se formatea
+  un payload de megabytes. Recortar es barato: solo se copia lo que se muestra.
+- El request solo encola el registro; un hilo aparte (QueueListener) escribe en
+  stdout. Si la cola se llena el registro se descarta en vez de esperar.
+- Eventos muy frecuentes pueden muestrearse (LOG_SAMPLE_RATES); advertencias y
+  errores se escriben siempre.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+SENSITIVE_KEYS = {
+    'base64', 'jpegthumbnail', 'thumbnail', 'mediakey', 'filesha256', 'fileencsha256',
+    'apikey', 'api_key', 'authorization', 'token', 'password', 'password_hash', 'secret'
+}
+MAX_ITEMS = 20  # Elementos de listas/dicts que se muestran
+MAX_DEPTH = 5
+
+_settings = {"max_field": 200, "sample_rates": {}, "default_rate": 1.0}
+_listener = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) registros cuando la cola está llena"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # El formateo (json.dumps) lo hace el hilo del listener, no el request
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            entry.setdefault(key, value)
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), 2000)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(+{len(text) - limit})"
+
+
+def redact(value, max_field=None, depth=0):
+    """Copia recortada del valor: strings cortos, listas/dicts acotados, claves sensibles ocultas"""
+    max_field = max_field or _settings["max_field"]
+    if isinstance(value, str):
+        return truncate(value, max_field)
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return f"<dict {len(value)} claves>"
+        result = {}
+        for i, (key, item) in enumerate(value.items()):
+            if i >= MAX_ITEMS:
+                result["…"] = f"+{len(value) - MAX_ITEMS} claves"
+                break
+            if str(key).lower() in SENSITIVE_KEYS:
+                result[key] = f"<oculto {len(item) if isinstance(item, (str, bytes)) else type(item).__name__}>"
+            else:
+                result[key] = redact(item, max_field, depth + 1)
+        return result
+    if isinstance(value, (list, tuple)):
+        if depth >= MAX_DEPTH:
+            return f"<lista {len(value)}>"
+        result = [redact(item, max_field, depth + 1) for item in value[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            result.append(f"…+{len(value) - MAX_ITEMS}")
+        return result
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return truncate(str(value), max_field)
+
+
+class StructuredLogger:
+    """logger.info('evento', campo=valor, ...) -> una línea JSON
+
+    El nombre del evento es solo posicional: un campo llamado event (o level, logger,
+    ts) no choca con el parámetro, y en la línea JSON no pisa esas claves.
+    """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"navros.{name}")
+
+    def debug(self, event, /, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, /, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, /, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, /, exc_info=False, **fields):
+        self._log(logging.ERROR, event, fields, exc_info)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = _settings["sample_rates"].get(event, _settings["default_rate"])
+            if rate < 1.0 and random.random() >= rate:
+                return
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": redact(fields)})
+
+
+def get_logger(name):
+    return StructuredLogger(name)
+
+
+def parse_sample_rates(spec):
+    """'webhook.received=0.1,prodia.response=0.5' -> {'webhook.received': 0.1, ...}"""
+    rates = {}
+    for part in (spec or '').split(','):
+        event, sep, rate = part.partition('=')
+        if sep:
+            try:
+                rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                print(f"⚠️ Tasa de muestreo inválida para {event}: {rate}")
+    return rates
+
+
+def setup(level='INFO', max_field=200, sample_rates=None, default_rate=1.0, queue_size=10000, stream=None):
+    """Configura el logger 'navros' con cola + hilo escritor. Se puede llamar una sola vez por proceso"""
+    global _listener
+    _settings.update(max_field=max_field, sample_rates=sample_rates or {}, default_rate=default_rate)
+
+    root = logging.getLogger('navros')
+    root.setLevel(level)
+    root.propagate = False
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    root.addHandler(DroppingQueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)  # Escribir lo pendiente al salir
+
+
+def stats():
+    return {"dropped": DroppingQueueHandler.dropped, "queued": _listener.queue.qsize() if _listener else 0}
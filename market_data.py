@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+import requests
+
+EXCHANGE_RATES_URL = os.environ.get('EXCHANGE_RATES_URL', 'https://api.exchangerate-api.com/v4/latest/USD')
+
+
+def fetch_exchange_rates(timeout=5):
+    """Descarga las tasas de cambio (base USD) desde la API gratuita"""
+    response = requests.get(EXCHANGE_RATES_URL, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+class RatesCache:
+    """Snapshot de datos de mercado refrescado en segundo plano
+
+    El request nunca espera a la API externa: siempre se sirve el último snapshot
+    bueno (aunque esté viejo) mientras un hilo lo refresca según el horario. Si el
+    refresco falla se conserva el snapshot anterior y se reintenta antes.
+    """
+
+    def __init__(self, fetch, refresh_interval=3600, retry_interval=60, name="market-data"):
+        self.fetch = fetch  # Función sin argumentos que retorna los datos nuevos
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.name = name
+        self._snapshot = None
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self.last_error = None
+
+    def start(self):
+        """Arranca el hilo de refresco (idempotente). La primera carga también es en segundo plano"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._refresh_loop, name=self.name, daemon=True).start()
+
+    def get(self):
+        """Retorna el último snapshot bueno (o None si todavía no hay ninguno). No bloquea"""
+        if self.is_stale() and not self._recently_attempted():
+            # Stale-while-revalidate: servir lo que hay y despertar al hilo de refresco
+            self._wakeup.set()
+        return self._snapshot
+
+    def age(self):
+        """Segundos desde el último refresco exitoso (None si nunca se refrescó)"""
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def is_stale(self):
+        age = self.age()
+        return age is None or age > self.refresh_interval
+
+    def _recently_attempted(self):
+        # Evita martillar la API si está caída: máximo un intento por retry_interval
+        return self._last_attempt is not None and time.monotonic() - self._last_attempt < self.retry_interval
+
+    def refresh(self):
+        """Refresca el snapshot ahora. Retorna True si funcionó"""
+        self._last_attempt = time.monotonic()
+        try:
+            data = self.fetch()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ No se pudo refrescar {self.name}, se mantiene el último snapshot: {e}")
+            return False
+
+        with self._lock:
+            self._snapshot = data
+            self._fetched_at = time.monotonic()
+            self.last_error = None
+        return True
+
+    def _refresh_loop(self):
+        while True:
+            ok = self.refresh()
+            self._wakeup.clear()
+            self._wakeup.wait(self.refresh_interval if ok else self.retry_interval)
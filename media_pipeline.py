@@ -0,0 +1,97 @@
+"""Preparación de imágenes recibidas antes de mandarlas al modelo de visión
+
+Un solo decode del base64 (sin .replace()/.split() intermedios), reducción de
+dimensiones y bytes al presupuesto de visión y re-encode compacto en JPEG.
+Pillow es opcional: sin él la imagen pasa tal cual (solo se normaliza el base64).
+"""
+import base64
+import binascii
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Sin Pillow: las imágenes se envían sin reducir
+    Image = None
+
+SUPPORTED_MIMETYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/gif')
+
+
+class VisionImagePipeline:
+    """Normaliza una imagen (base64 o data URL) a una data URL dentro del presupuesto
+
+    GPT-4o escala cada imagen para que su lado corto quede en 768 px, así que enviar
+    más resolución que max_side solo cuesta subida y memoria, no detalle.
+    """
+
+    def __init__(self, max_side=1024, max_bytes=1024 * 1024, quality=85, hard_limit=20 * 1024 * 1024):
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.hard_limit = hard_limit  # Límite de la API: por encima no vale la pena ni intentar
+        self.enabled = Image is not None
+
+    def to_data_url(self, payload, mime_type='image/jpeg'):
+        """Retorna la data URL lista para el modelo, o None si la imagen no sirve"""
+        data, mime_type = decode_payload(payload, mime_type)
+        if not data:
+            return None
+
+        if self.enabled:
+            try:
+                data, mime_type = self.shrink(data, mime_type)
+            except Exception as e:
+                # Imagen que Pillow no entiende: mejor enviarla tal cual que perderla
+                print(f"⚠️ No se pudo reducir la imagen ({e}), se envía original")
+
+        if len(data) > self.hard_limit or mime_type not in SUPPORTED_MIMETYPES:
+            print(f"❌ Imagen descartada ({mime_type}, {len(data)} bytes)")
+            return None
+
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def shrink(self, data, mime_type):
+        """Reduce la imagen si se pasa del presupuesto. Retorna (bytes, mime_type)"""
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if len(data) <= self.max_bytes and max(width, height) <= self.max_side and mime_type in SUPPORTED_MIMETYPES:
+            return data, mime_type  # Ya cabe: no re-encodear (ni perder calidad)
+
+        # En JPEG, draft() decodifica directo a una escala menor (mucho más barato)
+        image.draft('RGB', (self.max_side, self.max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+        quality = self.quality
+        while True:
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+            if output.tell() <= self.max_bytes or quality <= 40:
+                break
+            quality -= 15
+
+        print(f"🖼️ Imagen reducida: {width}x{height} ({len(data)} bytes) -> "
+              f"{image.size[0]}x{image.size[1]} ({output.tell()} bytes)")
+        return output.getvalue(), 'image/jpeg'
+
+
+def decode_payload(payload, mime_type='image/jpeg'):
+    """Decodifica base64 con o sin prefijo data: en un solo paso. Retorna (bytes, mime_type)"""
+    if not payload:
+        return None, mime_type
+
+    # Prefijo de data URL (solo se busca al principio del string)
+    prefix_end = payload.find('base64,', 0, 100)
+    if prefix_end >= 0:
+        header = payload[:prefix_end].strip()
+        if header.startswith('data:'):
+            mime_type = header[5:].split(';')[0] or mime_type
+        payload = payload[prefix_end + 7:]
+
+    try:
+        # validate=False descarta saltos de línea y espacios sin copiar el string antes
+        return base64.b64decode(payload, validate=False), mime_type.lower()
+    except (binascii.Error, ValueError) as e:
+        print(f"❌ Base64 de imagen inválido: {e}")
+        return None, mime_type
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+# Extensiones permitidas por tipo de contenido
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp'
+}
+MIMETYPES = {ext: mimetype for mimetype, ext in EXTENSIONS.items()}
+
+# Nombre válido: sha256 en hex + extensión conocida (evita rutas arbitrarias)
+NAME_RE = re.compile(r'^([0-9a-f]{64})\.(jpg|png|webp)$')
+
+
+class MediaStore:
+    """Almacén local de imágenes direccionado por contenido (sha256)
+
+    Cada imagen se guarda una sola vez como <hash>.<ext> y se sirve por URL
+    (/media/<hash>.<ext>) en lugar de viajar como base64 en JSON. El directorio
+    puede compartirse entre workers de gunicorn; cuando pasa de max_bytes se
+    borran los archivos usados hace más tiempo (mtime se actualiza al servirlos).
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, url_prefix='/media'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.url_prefix = url_prefix.rstrip('/')
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._total = self._scan_size()  # Estimado (otros workers también escriben)
+        self.evictions = 0
+
+    def put(self, data, mimetype='image/jpeg'):
+        """Guarda los bytes y retorna el nombre (<hash>.<ext>). Si ya existía solo lo marca como usado"""
+        ext = EXTENSIONS.get(mimetype, 'jpg')
+        name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        path = os.path.join(self.root, name)
+
+        if os.path.exists(path):
+            self._touch(path)
+            return name
+
+        # Escritura atómica: otro worker nunca ve un archivo a medio escribir
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total += len(data)
+            over_budget = self._total > self.max_bytes
+        if over_budget:
+            self._evict()
+        return name
+
+    def url(self, name):
+        """Ruta relativa con la que se sirve el archivo"""
+        return f"{self.url_prefix}/{name}"
+
+    def name_from_url(self, url):
+        """Nombre del archivo si la URL apunta a este almacén, si no None"""
+        if not url or not url.startswith(self.url_prefix + '/'):
+            return None
+        name = url[len(self.url_prefix) + 1:]
+        return name if NAME_RE.match(name) else None
+
+    def path(self, name):
+        """Ruta en disco del archivo (o None si el nombre no es válido o no existe)"""
+        if not NAME_RE.match(name or ''):
+            return None
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            return None
+        self._touch(path)
+        return path
+
+    def read(self, name):
+        path = self.path(name)
+        if not path:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def mimetype(self, name):
+        match = NAME_RE.match(name or '')
+        return MIMETYPES[match.group(2)] if match else None
+
+    def stats(self):
+        return {"bytes": self._total, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and NAME_RE.match(entry.name):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        """Borra los archivos usados hace más tiempo hasta quedar en el 90% del presupuesto"""
+        with self._lock:
+            files = sorted(self._files())
+            total = sum(size for _, size, _ in files)
+            target = self.max_bytes * 0.9
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.evictions += 1
+                except FileNotFoundError:
+                    total -= size  # Otro worker ya lo borró
+                except OSError as e:
+                    print(f"❌ Error borrando {path}: {e}")
+            self._total = total
@@ -0,0 +1,340 @@
+import json
+import threading
+import time
+from collections import deque
+
+
+class PostgresJobStore:
+    """Persistencia opcional de la cola en PostgreSQL (sobrevive reinicios y deploys)"""
+
+    def __init__(self, get_connection, stale_after=900):
+        # get_connection: context manager que entrega una conexión (o None)
+        self.get_connection = get_connection
+        self.stale_after = stale_after  # Segundos sin actividad para dar por perdido un job
+
+    def init_table(self):
+        with self.get_connection() as conn:
+            if not conn:
+                return False
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS webhook_jobs (
+                        id BIGSERIAL PRIMARY KEY,
+                        payload JSONB NOT NULL,
+                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        locked_at TIMESTAMP
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_webhook_jobs_status ON webhook_jobs(status, created_at)')
+                conn.commit()
+                cur.close()
+                return True
+            except Exception as e:
+                print(f"❌ Error creando tabla webhook_jobs: {e}")
+                return False
+
+    def save(self, payload, replaces=None):
+        """Guarda el job antes de encolarlo. Retorna su id o None
+
+        replaces: ids de jobs retenidos (mensajes agrupados) que este job reemplaza; se
+        marcan 'merged' en la misma transacción para que la recuperación no los repita.
+        """
+        with self.get_connection() as conn:
+            if not conn:
+                return None
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    INSERT INTO webhook_jobs (payload, status, locked_at)
+                    VALUES (%s, 'pending', NOW())
+                    RETURNING id
+                ''', (json.dumps(payload),))
+                job_id = cur.fetchone()['id']
+                if replaces:
+                    cur.execute("UPDATE webhook_jobs SET status = 'merged' WHERE id = ANY(%s)", (list(replaces),))
+                conn.commit()
+                cur.close()
+                return job_id
+            except Exception as e:
+                print(f"❌ Error guardando job: {e}")
+                return None
+
+    def start(self, job_id):
+        """Marca un job como en proceso (renueva su lock)"""
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                conn.execute(
+                    "UPDATE webhook_jobs SET status = 'processing', locked_at = NOW() WHERE id = %s",
+                    (job_id,)
+                )
+                conn.commit()
+            except Exception as e:
+                print(f"❌ Error actualizando job {job_id}: {e}")
+
+    def finish(self, job_id, failed=False):
+        """Marca un job como terminado (o fallido)"""
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                conn.execute(
+                    'UPDATE webhook_jobs SET status = %s, attempts = attempts + 1 WHERE id = %s',
+                    ('failed' if failed else 'done', job_id)
+                )
+                conn.commit()
+            except Exception as e:
+                print(f"❌ Error actualizando job {job_id}: {e}")
+
+    def heartbeat(self, job_ids):
+        """Renueva el lock de los jobs que este proceso todavía tiene (en cola, en proceso o
+        retenidos) para que claim_stale de otro worker no los repita"""
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                conn.execute('''
+                    UPDATE webhook_jobs SET locked_at = NOW()
+                    WHERE id = ANY(%s) AND status IN ('pending', 'processing')
+                ''', (list(job_ids),))
+                conn.commit()
+            except Exception as e:
+                print(f"❌ Error renovando jobs en curso: {e}")
+
+    def claim_stale(self, limit=100):
+        """Recupera jobs que quedaron a medias (por ejemplo, un worker murió en un deploy)
+
+        Mientras el proceso dueño vive renueva locked_at (heartbeat) cada
+        recover_interval: solo se recuperan jobs cuyo dueño dejó de hacerlo.
+        """
+        with self.get_connection() as conn:
+            if not conn:
+                return []
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                    UPDATE webhook_jobs SET locked_at = NOW()
+                    WHERE id IN (
+                        SELECT id FROM webhook_jobs
+                        WHERE status IN ('pending', 'processing')
+                        AND locked_at < NOW() - make_interval(secs => %s)
+                        AND attempts < 3
+                        ORDER BY created_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, payload
+                ''', (self.stale_after, limit))
+                jobs = [(row['id'], row['payload']) for row in cur.fetchall()]
+                conn.commit()
+                cur.close()
+                return jobs
+            except Exception as e:
+                print(f"❌ Error recuperando jobs pendientes: {e}")
+                return []
+
+    def purge(self, older_than_days=2):
+        """Borra jobs terminados viejos para que la tabla no crezca sin límite"""
+        with self.get_connection() as conn:
+            if not conn:
+                return
+            try:
+                conn.execute('''
+                    DELETE FROM webhook_jobs
+                    WHERE status IN ('done', 'failed', 'merged')
+                    AND created_at < NOW() - make_interval(days => %s)
+                ''', (older_than_days,))
+                conn.commit()
+            except Exception as e:
+                print(f"❌ Error limpiando webhook_jobs: {e}")
+
+
+class MessageQueue:
+    """Cola acotada en memoria con un pool de hilos que procesa los mensajes del webhook
+
+    Los jobs de un mismo chat (según key_func) se ejecutan de a uno y en orden de
+    llegada; chats distintos se procesan en paralelo hasta `workers` a la vez.
+    Con store, los jobs guardados que este proceso todavía tiene se renuevan en cada
+    vuelta de la recuperación (recover_interval debe ser menor que stale_after).
+    """
+
+    def __init__(self, handler, workers=4, maxsize=500, store=None, recover_interval=60, key_func=None):
+        self.handler = handler  # Función que recibe el payload del job
+        self.workers = workers
+        self.maxsize = maxsize
+        self.store = store
+        self.recover_interval = recover_interval
+        self.key_func = key_func  # payload -> clave del chat (None = sin orden entre jobs)
+        self._chats = {}  # clave -> deque de (job_id, payload) esperando
+        self._ready = deque()  # Chats con jobs esperando y ningún worker ocupándose
+        self._active = set()  # Chats que un worker está procesando ahora
+        self._size = 0  # Jobs esperando + en proceso
+        self._owned = set()  # Ids guardados en el store que este proceso tiene (en cola, en proceso o retenidos)
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+        self.in_flight = 0
+
+    def start(self):
+        """Arranca los workers (idempotente)"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+
+        if self.store and not self.store.init_table():
+            print("⚠️ Cola sin persistencia: no se pudo preparar webhook_jobs")
+            self.store = None
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        if self.store:
+            threading.Thread(target=self._recover_loop, name="webhook-recover", daemon=True).start()
+
+        print(f"✅ Cola de mensajes iniciada ({self.workers} workers, máximo {self.maxsize} en cola)")
+
+    def hold(self, payload):
+        """Guarda un job en el store sin encolarlo (por ejemplo, un mensaje esperando a
+        agruparse). Se renueva mientras este proceso lo tenga; si el proceso muere, o el
+        submit(replaces=...) que debía reemplazarlo no encuentra lugar, la recuperación
+        lo procesa solo. Retorna su id, o None sin store"""
+        job_id = self.store.save(payload) if self.store else None
+        self._own(job_id)
+        return job_id
+
+    def submit(self, payload, timeout=None, replaces=None):
+        """Encola un job. Retorna False si la cola está llena (esperando hasta timeout segundos)
+
+        replaces: ids de jobs retenidos con hold() que este job reemplaza.
+        """
+        deadline = time.monotonic() + (timeout or 0)
+        with self._cond:
+            while self._size >= self.maxsize:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Los retenidos dejan de renovarse: la recuperación los procesará
+                    self._owned.difference_update(replaces or ())
+                    return False
+                self._cond.wait(remaining)
+            # Reservar el lugar antes de ir a la DB
+            self._size += 1
+
+        job_id = self.store.save(payload, replaces) if self.store else None
+        with self._cond:
+            self._owned.difference_update(replaces or ())
+        self._own(job_id)
+        self._put(job_id, payload)
+        return True
+
+    def depth(self):
+        """Cantidad de jobs esperando"""
+        with self._cond:
+            return self._size - self.in_flight
+
+    def chat_depth(self, key):
+        """Jobs pendientes de un chat (esperando + el que se está procesando)"""
+        with self._cond:
+            return len(self._chats.get(key, ())) + (1 if key in self._active else 0)
+
+    def chat_depths(self):
+        """Jobs pendientes por chat, solo de los chats que tienen algo pendiente"""
+        with self._cond:
+            depths = {key: len(jobs) for key, jobs in self._chats.items() if self._is_chat_key(key)}
+            for key in self._active:
+                if self._is_chat_key(key):
+                    depths[key] = depths.get(key, 0) + 1
+            return depths
+
+    def stats(self):
+        """Resumen de la cola (sin exponer las claves de los chats)"""
+        depths = self.chat_depths()
+        return {
+            "depth": self.depth(),
+            "in_flight": self.in_flight,
+            "chats": len(depths),
+            "max_chat_depth": max(depths.values(), default=0),
+            "workers": self.workers
+        }
+
+    @staticmethod
+    def _is_chat_key(key):
+        return isinstance(key, str)
+
+    def _own(self, job_id):
+        if job_id is not None:
+            with self._cond:
+                self._owned.add(job_id)
+
+    def _key(self, payload):
+        key = self.key_func(payload) if self.key_func else None
+        # Sin clave: cada job es su propio "chat" y no espera a ningún otro
+        return key if key is not None else object()
+
+    def _put(self, job_id, payload):
+        """Agrega el job a la fila de su chat (el lugar ya está reservado en _size)"""
+        key = self._key(payload)
+        with self._cond:
+            jobs = self._chats.setdefault(key, deque())
+            jobs.append((job_id, payload))
+            # Si el chat no estaba esperando ni en proceso, queda listo para un worker
+            if len(jobs) == 1 and key not in self._active:
+                self._ready.append(key)
+                self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                job_id, payload = self._chats[key].popleft()
+                self._active.add(key)
+                self.in_flight += 1
+
+            failed = False
+            try:
+                if job_id is not None:
+                    self.store.start(job_id)
+                self.handler(payload)
+            except Exception as e:
+                failed = True
+                print(f"❌ Error procesando job en segundo plano: {e}")
+                import traceback
+                traceback.print_exc()
+            finally:
+                if job_id is not None:
+                    self.store.finish(job_id, failed=failed)
+
+                with self._cond:
+                    self._owned.discard(job_id)
+                    self._active.discard(key)
+                    self.in_flight -= 1
+                    self._size -= 1
+                    # El siguiente mensaje del mismo chat va al final de la fila (justo con los demás chats)
+                    if self._chats[key]:
+                        self._ready.append(key)
+                    else:
+                        del self._chats[key]
+                    self._cond.notify_all()
+
+    def _recover_loop(self):
+        while True:
+            with self._cond:
+                owned = list(self._owned)
+            if owned:
+                self.store.heartbeat(owned)
+            for job_id, payload in self.store.claim_stale():
+                print(f"♻️ Recuperando job pendiente {job_id}")
+                with self._cond:
+                    self._size += 1
+                    self._owned.add(job_id)
+                self._put(job_id, payload)
+            self.store.purge()
+            time.sleep(self.recover_interval)
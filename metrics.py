@@ -0,0 +1,145 @@
+"""Métricas de Prometheus (latencia por etapa, intenciones, errores por proveedor, colas)
+
+Con gunicorn se usa el modo multiproceso de prometheus_client: cada worker escribe
+sus valores en PROMETHEUS_MULTIPROC_DIR (lo configura gunicorn.conf.py) y /metrics
+suma los de todos los workers, sin importar cuál atienda el scrape.
+Sin prometheus_client instalado todo esto no hace nada y /metrics responde 503.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+    )
+    from prometheus_client import multiprocess
+except ImportError:  # prometheus_client es opcional
+    Counter = None
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# Etapas medidas (buckets pensados para llamadas de red: de 5 ms a 2 min)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+class _NoOp:
+    """Reemplazo de las métricas cuando prometheus_client no está instalado"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if Counter is not None:
+    STAGE_SECONDS = Histogram(
+        'navros_stage_seconds', 'Duración de cada etapa del procesamiento',
+        ['stage'], buckets=STAGE_BUCKETS
+    )
+    LLM_SECONDS = Histogram(
+        'navros_llm_seconds', 'Duración de las llamadas al LLM por proveedor',
+        ['provider', 'outcome'], buckets=STAGE_BUCKETS
+    )
+    INTENTS = Counter('navros_intents_total', 'Mensajes por intención detectada', ['intent', 'channel'])
+    PROVIDER_ERRORS = Counter('navros_provider_errors_total', 'Errores de proveedores externos', ['provider'])
+    LOST_TURNS = Counter('navros_lost_turns_total', 'Turnos agrupados del webhook que se perdieron', ['reason'])
+    # livesum: suma de los workers vivos (cada worker publica sus propios valores)
+    QUEUE_DEPTH = Gauge('navros_queue_depth', 'Mensajes esperando en la cola del webhook', multiprocess_mode='livesum')
+    IN_FLIGHT = Gauge('navros_in_flight', 'Mensajes del webhook procesándose', multiprocess_mode='livesum')
+    IMAGE_JOBS_PENDING = Gauge('navros_image_jobs_pending', 'Jobs de imagen en cola o corriendo', multiprocess_mode='livesum')
+else:
+    STAGE_SECONDS = LLM_SECONDS = INTENTS = PROVIDER_ERRORS = LOST_TURNS = _NoOp()
+    QUEUE_DEPTH = IN_FLIGHT = IMAGE_JOBS_PENDING = _NoOp()
+
+enabled = Counter is not None
+
+
+@contextmanager
+def timed(stage):
+    """Mide la duración del bloque como una etapa"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def timed_stage(stage):
+    """Decorador: mide cada llamada a la función como una etapa"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            with timed(stage):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def observe_llm(provider, seconds, error=None):
+    """Callback del router de LLM: latencia y errores por proveedor
+
+    Los errores del request (400, contenido rechazado) van como 'rejected' y no
+    cuentan como errores del proveedor.
+    """
+    from llm_router import is_provider_failure
+
+    if error is None:
+        outcome = 'ok'
+    elif is_provider_failure(error):
+        outcome = 'error'
+        PROVIDER_ERRORS.labels(provider).inc()
+    else:
+        outcome = 'rejected'
+    LLM_SECONDS.labels(provider, outcome).observe(seconds)
+
+
+def provider_error(provider):
+    PROVIDER_ERRORS.labels(provider).inc()
+
+
+def lost_turn(reason):
+    LOST_TURNS.labels(reason).inc()
+
+
+def count_intent(intent, channel):
+    INTENTS.labels(intent, channel).inc()
+
+
+def start_gauge_updater(update, interval=5):
+    """Llama a update() cada `interval` segundos en un hilo aparte (gauges siempre al día en cada worker)"""
+    if not enabled:
+        return
+
+    def loop():
+        while True:
+            try:
+                update()
+            except Exception as e:
+                print(f"❌ Error actualizando métricas: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="metrics-gauges", daemon=True).start()
+
+
+def render():
+    """Texto en formato Prometheus con las métricas de todos los workers. Retorna (body, content_type)"""
+    if not enabled:
+        return None, None
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
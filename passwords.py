@@ -0,0 +1,174 @@
+"""Hash de contraseñas (PBKDF2-SHA256) con costo ajustable y cupos compartidos entre procesos
+
+- Formato autodescriptivo: pbkdf2_sha256$<iteraciones>$<salt>$<hash>. El costo se
+  puede subir (PASSWORD_HASH_ITERATIONS) y cada login con un hash viejo o más
+  barato devuelve uno nuevo para guardar. Los hashes antiguos (<salt>$<hash>, 100000
+  iteraciones) se siguen aceptando.
+- gunicorn corre con workers sync (un request a la vez por proceso): un límite por
+  proceso no sirve, porque nunca hay más de un hash esperando en cada uno. Los cupos
+  son N archivos de bloqueo (flock) en un directorio compartido por todos los
+  workers del host: como mucho N workers calculan un hash a la vez y el resto de los
+  logins recibe 503 tras una espera corta. Así una ráfaga de logins no puede ocupar
+  todos los workers y el webhook sigue atendiéndose.
+- Las comparaciones son en tiempo constante (hmac.compare_digest).
+"""
+import hashlib
+import hmac
+import os
+import random
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Sin flock (Windows) el límite es solo por proceso
+    fcntl = None
+
+ALGORITHM = 'pbkdf2_sha256'
+LEGACY_ITERATIONS = 100000  # Hashes "<salt>$<hash>" creados antes de este módulo
+# Directorio de los cupos: el mismo para todos los workers del host
+DEFAULT_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'navros-password-slots')
+
+
+class PasswordHasherBusy(Exception):
+    """No hay capacidad para calcular otro hash ahora (reintentar en unos segundos)"""
+
+
+def make_hash(password, iterations, salt=None):
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+    return f"{ALGORITHM}${iterations}${salt}${digest.hex()}"
+
+
+def parse_hash(password_hash):
+    """(iteraciones, salt, hash hex) o None si el formato no se reconoce"""
+    parts = (password_hash or '').split('$')
+    if len(parts) == 4 and parts[0] == ALGORITHM and parts[1].isdigit():
+        return int(parts[1]), parts[2], parts[3]
+    if len(parts) == 2:
+        return LEGACY_ITERATIONS, parts[0], parts[1]
+    return None
+
+
+def check_password(password, password_hash):
+    parsed = parse_hash(password_hash)
+    if not parsed:
+        return False
+    iterations, salt, expected = parsed
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def needs_rehash(password_hash, iterations):
+    """True si el hash es del formato viejo o usa menos iteraciones que las configuradas"""
+    parsed = parse_hash(password_hash)
+    return not password_hash.startswith(f"{ALGORITHM}$") or not parsed or parsed[0] < iterations
+
+
+class HashSlots:
+    """Cupos de cálculo de hash compartidos por todos los procesos del host (flock sobre N archivos)"""
+
+    def __init__(self, slots, directory, max_wait=0.5, poll=0.02):
+        self.slots = slots
+        self.max_wait = max_wait  # Segundos esperando un cupo antes de rechazar
+        self.poll = poll
+        self._paths = [os.path.join(directory, f"slot-{i}.lock") for i in range(slots)]
+        self._local = threading.BoundedSemaphore(slots)  # Solo sin fcntl
+        if fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def acquire(self):
+        """Ocupa un cupo mientras dura el bloque. Lanza PasswordHasherBusy si no hay ninguno libre"""
+        if fcntl is None:
+            if not self._local.acquire(timeout=self.max_wait):
+                raise PasswordHasherBusy("Demasiadas verificaciones de contraseña en curso")
+            try:
+                yield
+            finally:
+                self._local.release()
+            return
+
+        deadline = time.monotonic() + self.max_wait
+        fd = self._try_lock()
+        while fd is None:
+            if time.monotonic() >= deadline:
+                raise PasswordHasherBusy("Demasiadas verificaciones de contraseña en curso")
+            time.sleep(self.poll)
+            fd = self._try_lock()
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _try_lock(self):
+        # Orden aleatorio para no pelear siempre por el primer archivo
+        for path in random.sample(self._paths, len(self._paths)):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+
+class PasswordHasher:
+    """Calcula y verifica hashes ocupando un cupo compartido (HashSlots) mientras tanto"""
+
+    def __init__(self, iterations=100000, slots=1, max_wait=0.5, lock_dir=None):
+        self.iterations = iterations
+        self._slots = HashSlots(slots, lock_dir or DEFAULT_LOCK_DIR, max_wait)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def hash(self, password):
+        """Hash nuevo con el costo configurado"""
+        return self._run(make_hash, password, self.iterations)
+
+    def verify(self, password, password_hash):
+        """Retorna (válida, hash_nuevo). hash_nuevo no es None cuando conviene guardarlo
+        (formato viejo o costo menor al configurado)
+
+        Sin password_hash (usuario inexistente o solo Google) se gasta el mismo tiempo
+        igual, para no revelar por tiempos qué emails existen.
+        """
+        return self._run(self._verify, password, password_hash)
+
+    def stats(self):
+        """Contadores de este proceso (los cupos son de todo el host)"""
+        return {
+            "iterations": self.iterations,
+            "slots": self._slots.slots,
+            "shared": fcntl is not None,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+    def _verify(self, password, password_hash):
+        if not password_hash:
+            make_hash(password, self.iterations)
+            return False, None
+        if not check_password(password, password_hash):
+            return False, None
+        if needs_rehash(password_hash, self.iterations):
+            return True, make_hash(password, self.iterations)
+        return True, None
+
+    def _run(self, func, *args):
+        try:
+            with self._slots.acquire():
+                result = func(*args)
+        except PasswordHasherBusy:
+            with self._lock:
+                self.rejected += 1
+            raise
+        with self._lock:
+            self.completed += 1
+        return result
+
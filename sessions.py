@@ -0,0 +1,219 @@
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Costo aproximado en bytes de los objetos que no son texto (para la cuenta de memoria)
+TURN_OVERHEAD = 64
+SESSION_OVERHEAD = 200
+
+
+class Turn:
+    """Un mensaje del historial guardado en forma compacta (UTF-8, zlib si es largo)"""
+
+    __slots__ = ('role', 'data', 'compressed', 'message_id')
+
+    def __init__(self, role, content, compress_min=None, message_id=None):
+        self.role = role
+        self.message_id = message_id  # Id del mensaje en conversation_store (orden dentro del chat)
+        data = content.encode('utf-8')
+        # Solo vale la pena comprimir respuestas largas del asistente
+        if compress_min and role == 'assistant' and len(data) >= compress_min:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data):
+                data = packed
+                self.compressed = True
+            else:
+                self.compressed = False
+        else:
+            self.compressed = False
+        self.data = data
+
+    @property
+    def content(self):
+        data = zlib.decompress(self.data) if self.compressed else self.data
+        return data.decode('utf-8')
+
+    def as_message(self):
+        message = {"role": self.role, "content": self.content}
+        if self.message_id is not None:
+            message["id"] = self.message_id
+        return message
+
+    def nbytes(self):
+        return sys.getsizeof(self.data) + TURN_OVERHEAD
+
+
+class Session:
+    """Estado en memoria de un chat: últimos mensajes y momento del último uso"""
+
+    __slots__ = ('turns', 'last_seen', 'nbytes')
+
+    def __init__(self):
+        self.turns = None  # None = historial no cargado en este worker
+        self.last_seen = time.monotonic()
+        self.nbytes = SESSION_OVERHEAD
+
+
+class SessionStore:
+    """Sesiones por chat acotadas por memoria total y tiempo de inactividad (LRU)
+
+    Reemplaza a los diccionarios por número de teléfono: un chat inactivo por más de
+    idle_ttl segundos se olvida, y si el total pasa de max_bytes se expulsan primero
+    los chats usados hace más tiempo.
+
+    Como en TTLCache, cada invalidación de historiales avanza una generación: quien
+    lee la DB toma turns_generation() antes y la pasa a set_turns().
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, idle_ttl=1800, max_turns=20, compress_min=1024):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.compress_min = compress_min  # Tamaño (bytes) desde el que se comprimen respuestas; 0 = nunca
+        self._sessions = OrderedDict()  # key -> Session, de la menos a la más usada
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def touch(self, key):
+        """Marca el chat como activo. Retorna True si es un chat nuevo para este worker"""
+        with self._lock:
+            session = self._get(key)
+            is_new = session is None
+            if is_new:
+                session = Session()
+                self._sessions[key] = session
+                self.total_bytes += session.nbytes
+                self._evict()
+            return is_new
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get(key) is not None
+
+    def get_turns(self, key):
+        """Retorna el historial como [{"role", "content", "id"}, ...] o None si no está en memoria"""
+        with self._lock:
+            session = self._get(key)
+            if session is None or session.turns is None:
+                return None
+            turns = list(session.turns)
+
+        # Descomprimir fuera del lock
+        return [turn.as_message() for turn in turns]
+
+    def turns_generation(self):
+        """Generación actual (cambia con cada invalidación de historiales)"""
+        with self._lock:
+            return self._generation
+
+    def set_turns(self, key, messages, generation=None):
+        """Reemplaza el historial del chat (se conservan los últimos max_turns)
+
+        generation: la de turns_generation() antes de leer los mensajes. Si hubo una
+        invalidación desde entonces no se guarda nada. Retorna True si lo guardó.
+        """
+        turns = [Turn(m['role'], m['content'], self.compress_min, m.get('id')) for m in messages[-self.max_turns:]]
+        return self._store(key, turns, generation)
+
+    def append_turns(self, key, messages):
+        """Agrega mensajes al historial en memoria. Retorna False si no estaba cargado"""
+        new_turns = [Turn(m['role'], m['content'], self.compress_min, m.get('id')) for m in messages]
+        with self._lock:
+            session = self._get(key)
+            if session is None or session.turns is None:
+                return False
+            self._set_turns(session, (session.turns + new_turns)[-self.max_turns:])
+            self._evict()
+            return True
+
+    def invalidate_turns(self, key):
+        """Olvida el historial en memoria (otro worker lo cambió) pero conserva la sesión"""
+        with self._lock:
+            self._generation += 1
+            session = self._sessions.get(key)
+            if session is not None:
+                self._set_turns(session, None)
+
+    def invalidate_all_turns(self):
+        with self._lock:
+            self._generation += 1
+            for session in self._sessions.values():
+                self._set_turns(session, None)
+
+    def pop(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self.total_bytes -= session.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self.total_bytes = 0
+
+    def footprint(self):
+        """Uso de memoria actual (aproximado)"""
+        with self._lock:
+            self._evict()
+            loaded = [s for s in self._sessions.values() if s.turns is not None]
+            return {
+                "sessions": len(self._sessions),
+                "loaded_histories": len(loaded),
+                "turns": sum(len(s.turns) for s in loaded),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions
+            }
+
+    def _store(self, key, turns, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            session = self._get(key)
+            if session is None:
+                session = Session()
+                self._sessions[key] = session
+                self.total_bytes += session.nbytes
+            self._set_turns(session, turns)
+            self._evict()
+            return True
+
+    def _get(self, key):
+        """Busca la sesión y la marca como usada (requiere el lock)"""
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+
+        now = time.monotonic()
+        if now - session.last_seen > self.idle_ttl:
+            del self._sessions[key]
+            self.total_bytes -= session.nbytes
+            self.evictions += 1
+            return None
+
+        session.last_seen = now
+        self._sessions.move_to_end(key)
+        return session
+
+    def _set_turns(self, session, turns):
+        """Actualiza los mensajes y la cuenta de bytes (requiere el lock)"""
+        new_bytes = SESSION_OVERHEAD + (sum(turn.nbytes() for turn in turns) if turns else 0)
+        self.total_bytes += new_bytes - session.nbytes
+        session.nbytes = new_bytes
+        session.turns = turns
+
+    def _evict(self):
+        """Expulsa sesiones inactivas y, si hace falta, las menos usadas (requiere el lock)"""
+        now = time.monotonic()
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            idle = now - session.last_seen > self.idle_ttl
+            if not idle and self.total_bytes <= self.max_bytes:
+                break
+            del self._sessions[key]
+            self.total_bytes -= session.nbytes
+            self.evictions += 1
@@ -0,0 +1,61 @@
+"""LLMRouter.complete con clientes falsos (sin red)"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_router import LLMRouter, Provider  # noqa: E402
+
+
+class RequestError(Exception):
+    """Como un 400 de OpenAI: error del request, no del proveedor"""
+    status_code = 400
+
+
+class FakeClient:
+    """Imita client.chat.completions.create: espera `release` (si hay) y responde o lanza"""
+
+    def __init__(self, result=None, error=None, release=None):
+        self.result = result
+        self.error = error
+        self.release = release
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        if self.release:
+            self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class CompleteTest(unittest.TestCase):
+
+    def test_request_error_from_hedge_waits_for_primary(self):
+        primary_done = threading.Event()
+        primary = Provider('grok', FakeClient(result='respuesta', release=primary_done), 'grok-4')
+        hedge = Provider('openai', FakeClient(error=RequestError('bad request')), 'gpt-4o')
+
+        # Sin muestras el hedge se lanza tras hedge_max_delay; el principal responde después del error del hedge
+        router = LLMRouter([primary, hedge], hedge_max_delay=0.05)
+        threading.Timer(0.3, primary_done.set).start()
+
+        response, provider = router.complete(messages=[])
+
+        self.assertEqual(response, 'respuesta')
+        self.assertIs(provider, primary)
+        self.assertEqual(router.hedged, 1)
+        self.assertEqual(hedge.state, 'closed')
+
+    def test_request_error_is_raised_when_nothing_else_is_pending(self):
+        router = LLMRouter([Provider('grok', FakeClient(error=RequestError('bad request')), 'grok-4')])
+
+        with self.assertRaises(RequestError):
+            router.complete(messages=[])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""/webhook de punta a punta con los servicios simulados de bench/ (sin DATABASE_URL)"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from fake_services import FakeConfig, FakeServices  # noqa: E402
+
+# Payload tal como lo manda Evolution API para un mensaje de texto entrante
+EVOLUTION_PAYLOAD = {
+    "event": "messages.upsert",
+    "instance": "navros",
+    "data": {
+        "key": {"remoteJid": "573001234567@s.whatsapp.net", "fromMe": False, "id": "3EB0C431C26A1916E07A"},
+        "pushName": "Ana",
+        "message": {"conversation": "explícame cómo funciona la fotosíntesis"},
+        "messageType": "conversation",
+        "messageTimestamp": 1760760000
+    },
+    "destination": "https://navros.example/webhook",
+    "date_time": "2026-10-18T04:40:00.000Z",
+    "sender": "573009999999@s.whatsapp.net",
+    "server_url": "http://evolution.local",
+    "apikey": "B6D711FCDE4D4FD5936544120E713976"
+}
+
+
+class WebhookTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sent = []
+        cls.delivered = threading.Event()
+        cls.fakes = FakeServices(
+            FakeConfig(llm_latency=0.05, llm_jitter=0.0, evolution_latency=0.0),
+            on_send=cls._on_send
+        ).start()
+        os.environ.update(cls.fakes.env())
+        os.environ.pop('DATABASE_URL', None)
+        os.environ.setdefault('MEDIA_DIR', tempfile.mkdtemp(prefix='navros-test-media-'))
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        import app
+        cls.app = app
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fakes.stop()
+
+    @classmethod
+    def _on_send(cls, number, kind):
+        cls.sent.append((number, kind))
+        cls.delivered.set()
+
+    def test_evolution_message_is_accepted_and_answered(self):
+        with self.app.app.test_client() as client:
+            response = client.post('/webhook', json=EVOLUTION_PAYLOAD)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response.get_json()['status'], ('queued', 'buffered'))
+        self.assertTrue(self.delivered.wait(15), "Evolution no recibió la respuesta")
+        self.assertEqual(self.sent[0], ('573001234567@s.whatsapp.net', 'text'))
+
+
+if __name__ == '__main__':
+    unittest.main()